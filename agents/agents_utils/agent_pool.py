@@ -0,0 +1,202 @@
+"""
+Agent instances of a handler with their loads, and policies to pick one for a request
+
+Loads are indexed by a heap with lazy invalidation: every change pushes a new entry and outdated
+entries are skipped when they reach the top, so picks and updates are O(log n).
+
+Policies:
+    least_busy - the agent with the fewest running tasks
+    two_choices - the less loaded of two random agents, avoids herding of concurrent picks on one agent
+    latency_weighted - like two_choices, comparing (tasks + 1) * average response time
+    sticky - the same agent for the same key (rendezvous hashing), e.g. for the same element
+"""
+import collections
+import hashlib
+import heapq
+import itertools
+import math
+import random
+import threading
+from typing import Dict, Iterable, List, Optional
+
+LEAST_BUSY_POLICY = 'least_busy'
+TWO_CHOICES_POLICY = 'two_choices'
+LATENCY_WEIGHTED_POLICY = 'latency_weighted'
+STICKY_POLICY = 'sticky'
+AGENT_SELECTION_POLICIES = (LEAST_BUSY_POLICY, TWO_CHOICES_POLICY, LATENCY_WEIGHTED_POLICY, STICKY_POLICY)
+
+LATENCY_SMOOTHING = 0.2  # weight of the newest response time in the moving average
+DEFAULT_LATENCY = 1.0  # in seconds, assumed for agents without measured responses
+LATENCY_WINDOW_SIZE = 200  # number of the latest response times to compute percentiles of
+
+
+class AgentPool:
+    """
+    Thread-safe set of agents' addresses with their numbers of running tasks
+    """
+
+    def __init__(self, policy: str = LEAST_BUSY_POLICY):
+        """
+        :param policy: one of AGENT_SELECTION_POLICIES
+        """
+        if policy not in AGENT_SELECTION_POLICIES:
+            raise ValueError(f'Unknown agent selection policy {policy}, expected one of {AGENT_SELECTION_POLICIES}')
+        self.__policy = policy
+
+        self.__lock = threading.Lock()
+        self.__loads: Dict[str, int] = {}  # ip -> number of tasks it is doing
+        self.__latencies: Dict[str, float] = {}  # ip -> moving average of response time
+        self.__heap = []  # (load, sequence number, ip)
+        self.__entries: Dict[str, int] = {}  # ip -> sequence number of its valid heap entry
+        self.__sequence = itertools.count()
+        self.__recent_latencies = collections.deque(maxlen=LATENCY_WINDOW_SIZE)  # of all the agents
+
+    def __contains__(self, ip: str) -> bool:
+        return ip in self.__loads
+
+    def __len__(self) -> int:
+        return len(self.__loads)
+
+    def get_ips(self) -> List[str]:
+        """Returns addresses of all the agents"""
+        with self.__lock:
+            return list(self.__loads)
+
+    def add(self, ip: str) -> bool:
+        """
+        Adds an agent without tasks
+        :param ip: the agent's address
+        :return: False if the agent was already added
+        """
+        with self.__lock:
+            if ip in self.__loads:
+                return False
+            self.__set_load(ip, 0)
+            return True
+
+    def remove(self, ip: str) -> None:
+        """
+        Removes an agent, its heap entries become outdated
+        :param ip: the agent's address
+        """
+        with self.__lock:
+            self.__loads.pop(ip, None)
+            self.__latencies.pop(ip, None)
+            self.__entries.pop(ip, None)
+
+    def acquire(self, ip: str) -> None:
+        """
+        Counts a new task of the agent
+        :param ip: the agent's address
+        """
+        with self.__lock:
+            if ip in self.__loads:
+                self.__set_load(ip, self.__loads[ip] + 1)
+
+    def release(self, ip: str, latency: Optional[float] = None) -> None:
+        """
+        Counts a finished task of the agent
+        :param ip: the agent's address
+        :param latency: seconds the task took, to weight the agent by, None if it failed
+        """
+        with self.__lock:
+            if ip not in self.__loads:
+                return
+            self.__set_load(ip, max(self.__loads[ip] - 1, 0))
+            if latency is not None:
+                previous = self.__latencies.get(ip, latency)
+                self.__latencies[ip] = (1 - LATENCY_SMOOTHING) * previous + LATENCY_SMOOTHING * latency
+                self.__recent_latencies.append(latency)
+
+    def get_latency_percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Returns a percentile of the latest response times of all the agents
+        :param percentile: from 0 to 100
+        :param min_samples: number of response times needed for a meaningful value
+        :return: seconds, or None if there are fewer response times than min_samples
+        """
+        with self.__lock:
+            latencies = sorted(self.__recent_latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        rank = min(max(math.ceil(len(latencies) * percentile / 100), 1), len(latencies))
+        return latencies[rank - 1]
+
+    def pick(self, exclude: Iterable[str] = (), sticky_key: Optional[str] = None) -> str:
+        """
+        Picks an agent by the pool's policy
+        :param exclude: addresses of agents not to pick
+        :param sticky_key: a key to always pick the same agent for, used by the sticky policy
+        :return: the agent's address, or '' if there are no agents to pick from
+        """
+        exclude = set(exclude)
+        with self.__lock:
+            if self.__policy == STICKY_POLICY and sticky_key:
+                return self.__pick_sticky(exclude, sticky_key)
+            if self.__policy in (TWO_CHOICES_POLICY, LATENCY_WEIGHTED_POLICY):
+                return self.__pick_two_choices(exclude)
+            return self.__pick_least_busy(exclude)
+
+    def pick_idle(self, exclude: Iterable[str] = ()) -> str:
+        """
+        Picks an agent without running tasks
+        :param exclude: addresses of agents not to pick
+        :return: the agent's address, or '' if all the agents which are not excluded are busy
+        """
+        with self.__lock:
+            ip = self.__pick_least_busy(set(exclude))
+            return ip if ip and self.__loads[ip] == 0 else ''
+
+    def __set_load(self, ip: str, load: int) -> None:
+        """Updates the agent's load and pushes its new heap entry (the lock must be held)"""
+        self.__loads[ip] = load
+        sequence = next(self.__sequence)
+        self.__entries[ip] = sequence
+        heapq.heappush(self.__heap, (load, sequence, ip))
+
+        # Drop the outdated entries when they outnumber the valid ones
+        if len(self.__heap) > 4 * len(self.__loads) + 16:
+            self.__heap = [(self.__loads[agent_ip], agent_sequence, agent_ip)
+                           for agent_ip, agent_sequence in self.__entries.items()]
+            heapq.heapify(self.__heap)
+
+    def __pick_least_busy(self, exclude: set) -> str:
+        """Pops entries until a valid one of an agent which is not excluded (the lock must be held)"""
+        skipped = []
+        picked = ''
+        while self.__heap:
+            load, sequence, ip = self.__heap[0]
+            if self.__entries.get(ip) != sequence:
+                heapq.heappop(self.__heap)
+                continue
+            if ip in exclude:
+                skipped.append(heapq.heappop(self.__heap))
+                continue
+            picked = ip
+            break
+
+        for entry in skipped:
+            heapq.heappush(self.__heap, entry)
+        return picked
+
+    def __pick_two_choices(self, exclude: set) -> str:
+        """Picks the better of two random agents (the lock must be held)"""
+        candidates = [ip for ip in self.__loads if ip not in exclude] if exclude else list(self.__loads)
+        if not candidates:
+            return ''
+        if len(candidates) == 1:
+            return candidates[0]
+        return min(random.sample(candidates, 2), key=self.__get_cost)
+
+    def __get_cost(self, ip: str) -> float:
+        """Returns the agent's cost for the two choices policies (the lock must be held)"""
+        if self.__policy == LATENCY_WEIGHTED_POLICY:
+            return (self.__loads[ip] + 1) * self.__latencies.get(ip, DEFAULT_LATENCY)
+        return self.__loads[ip]
+
+    def __pick_sticky(self, exclude: set, sticky_key: str) -> str:
+        """Picks the agent with the highest hash of (key, address), stable while the agent is in the pool"""
+        candidates = [ip for ip in self.__loads if ip not in exclude]
+        if not candidates:
+            return ''
+        return max(candidates, key=lambda ip: hashlib.md5(f'{sticky_key}|{ip}'.encode()).digest())
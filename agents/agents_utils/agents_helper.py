@@ -15,10 +15,11 @@ from multiprocessing import Pool
 from multiprocessing.pool import ThreadPool
 from random import uniform
 from sys import _getframe
-from time import sleep, time
+from time import monotonic, sleep, time
 from timeit import default_timer
-from typing import Callable, List, Any
+from typing import Callable, List, Any, Optional
 
+import flask
 import requests
 from google.cloud import translate
 
@@ -461,6 +462,16 @@ def get_my_ip() -> str:
         return ''
 
 
+def get_request_time_left() -> Optional[float]:
+    """
+    Gets seconds left to the deadline of the agent's current request, set by AgentAPI from its handler's budget
+    :return: seconds, or None outside of a request or if the request has no deadline
+    """
+    if not flask.has_request_context() or flask.g.get('deadline') is None:
+        return None
+    return max(flask.g.deadline - monotonic(), 0)
+
+
 def str_to_bool(bool_string: str) -> bool:
     """
     Uses with flask.request.form.get to cast str 'False' or 'True' to bool
@@ -4,11 +4,11 @@ Base class to implement API access methods
 import atexit
 import threading
 from abc import abstractmethod
-from datetime import timedelta, datetime
-from time import sleep
+from datetime import datetime
 from typing import Optional, Dict
 
-from agents.agents_utils.agents_helper import execute_function_in_parallel
+from agents.agents_utils.agents_helper import execute_function_in_parallel, get_request_time_left
+from agents.agents_utils.rate_limiter import CredentialsLimiter
 from agents.agents_utils.utils_constants import AGENT_UTILS_NAME
 from utils import logger
 from utils.credentials_store import CredentialsStore
@@ -19,8 +19,6 @@ LAST_REQUEST_KEY = 'last_request'
 API_INSTANCE_KEY = 'api_instance'
 CREDENTIALS_ID_KEY = 'credentials_id'
 
-SLEEP_TIME_BETWEEN_CHECK_TO_RELEASE_A_KEY = 0.05
-
 
 class BaseAPI:
     """
@@ -37,10 +35,11 @@ class BaseAPI:
         :param used_by: ip of agent which use credentials
         """
         self.MAX_NUMBER_OF_CREDENTIALS = max_number_of_credentials
-        self.db = CredentialsStore(name)
+        self.db = CredentialsStore(name, used_by_id=used_by)
         self.name = name
         self.credentials = {}
         self.lock = threading.Lock()
+        self.limiter = CredentialsLimiter()
         self.used_by = used_by
         self.max_index = 0
         atexit.register(lambda: self.release_credentials(call_from_atexit=True))
@@ -67,66 +66,34 @@ class BaseAPI:
         if not new_credentials:
             return False
 
-        self.credentials[self.max_index] = new_credentials
-        self.max_index += 1
+        self.lock.acquire()
+        try:
+            index = self.max_index
+            self.max_index += 1
+            self.credentials[index] = new_credentials
+        finally:
+            self.lock.release()
+        # time_between_requests is in microseconds
+        self.limiter.add(index, new_credentials.get(TIME_BETWEEN_REQUESTS_KEY, 0) / 1e6)
         return True
 
     def _get_active_credentials(self) -> Optional[int]:
         """
-        Get active credentials
-        :return: index of credentials in self.credentials
+        Get credentials which are not in use and may be called now, waiting in line for them if needed,
+        but not beyond the deadline of the agent's request, if any
+        The caller must return them with self.limiter.release(index)
+        :return: index of credentials in self.credentials, None if there are none in time
         """
-        tried_to_add_new = False
-        while True:
-            if not self.credentials:
-                res = self._add_new_credentials()
-                if not res:
-                    return None
-
-            active_credentials = None
-            index = None
-            for i, credentials in self.credentials.items():
-                if credentials.get(ACTIVE_KEY, False):
-                    active_credentials = credentials
-                    index = i
-                    break
-
-            if not active_credentials:
-                if not tried_to_add_new and len(self.credentials) < self.MAX_NUMBER_OF_CREDENTIALS:
-                    tried_to_add_new = True
-                    self._add_new_credentials()
-                else:
-                    sleep(SLEEP_TIME_BETWEEN_CHECK_TO_RELEASE_A_KEY)
-
-                continue
-
-            return index
-
-    def after_request(self, index: int):
-        """
-        After each request make a key inactive and sleep to not reach rate limiting
-        :param index: an index of the key
-        :return: Nothing
-        """
-        try:
-            key = self.credentials[index]
-        except Exception as e:
-            logger.exception(AGENT_UTILS_NAME, f'Index for a key is wrong. Error: {e}')
+        if not len(self.limiter) and not self._add_new_credentials():
             return None
 
-        last_request = key.get(LAST_REQUEST_KEY, None)
-        time_between_requests = key.get(TIME_BETWEEN_REQUESTS_KEY, 0)
-
-        if last_request and last_request + \
-                timedelta(microseconds=time_between_requests) >= datetime.now():
-            time_diff = last_request + timedelta(microseconds=time_between_requests) - datetime.now()
-            sleep(time_diff.total_seconds())
-
-        self.lock.acquire()
-        try:
-            key[ACTIVE_KEY] = True
-        finally:
-            self.lock.release()
+        index = self.limiter.try_acquire()
+        if index is None and len(self.limiter) < self.MAX_NUMBER_OF_CREDENTIALS:
+            self._add_new_credentials()
+            index = self.limiter.try_acquire()
+        if index is None:
+            index = self.limiter.acquire(timeout=get_request_time_left())
+        return index
 
     def call_function(self, method_name: str, *args, **kwargs):
         """
@@ -149,27 +116,24 @@ class BaseAPI:
             try:
                 func = getattr(api, method_name)
             except Exception as e:
+                self.limiter.release(index)
                 logger.exception(AGENT_UTILS_NAME, f'No method "{method_name}" in {self.name} API class. Error {e}')
                 return None
 
             try:
-                self.lock.acquire()
-                try:
-                    current_credentials[ACTIVE_KEY] = False
-                finally:
-                    self.lock.release()
                 result = func(*args, **kwargs)
                 current_credentials[LAST_REQUEST_KEY] = datetime.now()
-                threading.Thread(target=lambda: self.after_request(index), daemon=True).start()
 
                 return result
             except Exception as e:
-                if 'Rate limit exceeded' in str(e):
+                if 'Rate limit exceeded' in str(e) and self.limiter.remove(index):
+                    # Limiting releases the credentials as well
                     self.db.limit_credentials_for_service_usage(credentials_id)
-                    self.db.release_credentials_for_service(credentials_id)
-                    self.credentials.pop(index)
+                    self.credentials.pop(index, None)
 
                     logger.warning(AGENT_UTILS_NAME, f'Rate limit reached for {self.name} credentials')
+            finally:
+                self.limiter.release(index)
 
         logger.exception(AGENT_UTILS_NAME, f'Failed to get data from {self.name}. Rate limit was'
                                            ' reached in all attempts')
@@ -183,32 +147,21 @@ class BaseAPI:
         """
 
         def release_credentials(key, api):
-            already_being_removed = False
-            if api[ACTIVE_KEY] is None:
-                if not call_from_atexit:
-                    return None
-                already_being_removed = True
-
-            while not api[ACTIVE_KEY]:
-                api[ACTIVE_KEY] = None
-                sleep(SLEEP_TIME_BETWEEN_CHECK_TO_RELEASE_A_KEY)
+            # No new calls get the credentials, the current one is finished first
+            if not self.limiter.remove(key):
+                return None
+            self.limiter.wait_until_released(key)
 
             self.lock.acquire()
             try:
-                if not already_being_removed:
-                    try:
-                        self.credentials.pop(key)
-                    except Exception as e:
-                        # Error is likely because credentials were already removed
-                        logger.warning(AGENT_UTILS_NAME, f'Failed to remove credentials. Error: {e}')
-
-                    self.db.release_credentials_for_service(api[CREDENTIALS_ID_KEY])
+                self.credentials.pop(key, None)
+                self.db.release_credentials_for_service(api[CREDENTIALS_ID_KEY])
             finally:
                 self.lock.release()
 
         def release_in_parallel():
             execute_function_in_parallel(release_credentials, [(key, credentials,)
-                                                               for key, credentials in self.credentials.items()])
+                                                               for key, credentials in list(self.credentials.items())])
 
         if not call_from_atexit:
             threading.Thread(target=release_in_parallel,
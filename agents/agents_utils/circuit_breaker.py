@@ -0,0 +1,90 @@
+"""
+Per-agent circuit breakers
+
+An agent's circuit opens after failure_threshold failures in a row, and requests skip the agent.
+After reset_timeout seconds one trial request is let through (half-open): its success closes
+the circuit, its failure opens it again for another reset_timeout.
+"""
+import threading
+import time
+from typing import Dict, Set
+
+from agents.agents_utils.utils_constants import CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT
+
+CLOSED_STATE = 'closed'
+OPEN_STATE = 'open'
+HALF_OPEN_STATE = 'half_open'
+
+
+class CircuitBreakers:
+    """
+    Thread-safe circuit breakers of a set of agents, an agent without records has a closed circuit
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_BREAKER_RESET_TIMEOUT):
+        """
+        :param failure_threshold: number of failures in a row to open a circuit
+        :param reset_timeout: seconds an open circuit rejects requests before a trial one
+        """
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+
+        self.__lock = threading.Lock()
+        self.__failures: Dict[str, int] = {}  # ip -> failures in a row
+        self.__states: Dict[str, str] = {}  # ip -> state of a circuit which is not closed
+        self.__opened_at: Dict[str, float] = {}  # ip -> time its circuit was opened
+
+    def get_rejecting(self) -> Set[str]:
+        """Returns ips of agents which requests must not be sent to now"""
+        now = time.monotonic()
+        with self.__lock:
+            return {ip for ip, state in self.__states.items()
+                    if state == HALF_OPEN_STATE or now - self.__opened_at[ip] < self.__reset_timeout}
+
+    def allow(self, ip: str) -> bool:
+        """
+        Checks if a request may be sent to the agent, taking the trial request of an open circuit
+        :param ip: the agent's address
+        :return: False if the circuit rejects the request
+        """
+        with self.__lock:
+            state = self.__states.get(ip, CLOSED_STATE)
+            if state == CLOSED_STATE:
+                return True
+            if state == OPEN_STATE and time.monotonic() - self.__opened_at[ip] >= self.__reset_timeout:
+                self.__states[ip] = HALF_OPEN_STATE
+                return True
+            return False
+
+    def record_success(self, ip: str) -> None:
+        """
+        Closes the agent's circuit
+        :param ip: the agent's address
+        """
+        with self.__lock:
+            self.__failures.pop(ip, None)
+            self.__states.pop(ip, None)
+            self.__opened_at.pop(ip, None)
+
+    def record_failure(self, ip: str) -> bool:
+        """
+        Counts a failure of the agent, opening its circuit after the threshold or a failed trial
+        :param ip: the agent's address
+        :return: True if the circuit has been opened
+        """
+        with self.__lock:
+            failures = self.__failures.get(ip, 0) + 1
+            self.__failures[ip] = failures
+            if self.__states.get(ip) == HALF_OPEN_STATE or failures >= self.__failure_threshold:
+                self.__states[ip] = OPEN_STATE
+                self.__opened_at[ip] = time.monotonic()
+                return True
+            return False
+
+    def remove(self, ip: str) -> None:
+        """
+        Forgets the agent, e.g. when it's removed from the handler
+        :param ip: the agent's address
+        """
+        self.record_success(ip)
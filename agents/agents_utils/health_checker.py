@@ -0,0 +1,160 @@
+"""
+Concurrent health checking of a set of hosts
+
+All the hosts are probed at once, each probe with its own timeout, every interval seconds
+with a random jitter, so one dead host doesn't delay the others and checkers of different
+handlers don't probe in lockstep. A host is marked down after failure_threshold failed probes
+in a row and up again after success_threshold successful ones; a host which stays down
+for forget_after probes is forgotten.
+"""
+import bisect
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from agents.agents_utils.utils_constants import HEALTH_CHECK_INTERVAL, HEALTH_CHECK_TIMEOUT, HEALTH_CHECK_JITTER, \
+    HEALTH_CHECK_FAILURE_THRESHOLD, HEALTH_CHECK_SUCCESS_THRESHOLD, HEALTH_CHECK_FORGET_AFTER, HEALTH_CHECK_WORKERS
+from utils import logger
+
+# Upper bounds of probe latency histogram buckets, in seconds; the last bucket counts the slower probes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+UP_STATE = 'up'
+DOWN_STATE = 'down'
+
+
+class HealthChecker:
+    """
+    Background prober of hosts, reporting changes of their state through callbacks
+    """
+
+    def __init__(self, name: str, probe: Callable[[str, float], bool],
+                 on_down: Callable[[str], None], on_up: Callable[[str], None],
+                 interval: float = HEALTH_CHECK_INTERVAL, timeout: float = HEALTH_CHECK_TIMEOUT,
+                 jitter: float = HEALTH_CHECK_JITTER, failure_threshold: int = HEALTH_CHECK_FAILURE_THRESHOLD,
+                 success_threshold: int = HEALTH_CHECK_SUCCESS_THRESHOLD,
+                 forget_after: int = HEALTH_CHECK_FORGET_AFTER, max_workers: int = HEALTH_CHECK_WORKERS):
+        """
+        :param name: name to log with and of the probing threads
+        :param probe: function of (host, timeout) which returns True if the host is healthy
+        :param on_down: called with a host which has been marked down
+        :param on_up: called with a down host which has been marked up again
+        :param interval: average seconds between probing rounds
+        :param timeout: seconds a probe may take
+        :param jitter: fraction of the interval the rounds are randomly shifted by
+        :param failure_threshold: failed probes in a row to mark a host down
+        :param success_threshold: successful probes in a row to mark a down host up
+        :param forget_after: failed probes in a row to stop probing a host
+        :param max_workers: maximum number of probes at once
+        """
+        self.__name = name
+        self.__probe = probe
+        self.__on_down = on_down
+        self.__on_up = on_up
+        self.__interval = interval
+        self.__timeout = timeout
+        self.__jitter = jitter
+        self.__failure_threshold = failure_threshold
+        self.__success_threshold = success_threshold
+        self.__forget_after = forget_after
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}_health_check')
+
+        self.__lock = threading.Lock()
+        self.__hosts: Dict[str, Dict] = {}  # host -> its state, counters of probes in a row and latency histogram
+        self.__histogram = [0] * (len(LATENCY_BUCKETS) + 1)  # of all the probes
+
+    def add(self, host: str) -> None:
+        """
+        Starts probing a host, it's considered up
+        :param host: the host's address
+        """
+        with self.__lock:
+            info = self.__hosts.setdefault(host, {'histogram': [0] * (len(LATENCY_BUCKETS) + 1)})
+            info.update(state=UP_STATE, failures=0, successes=0)
+
+    def remove(self, host: str) -> None:
+        """
+        Stops probing a host
+        :param host: the host's address
+        """
+        with self.__lock:
+            self.__hosts.pop(host, None)
+
+    def run(self) -> None:
+        """
+        Probes the hosts in rounds. Never returns
+        :return: Nothing
+        """
+        while True:
+            time.sleep(self.__interval * (1 + random.uniform(-self.__jitter, self.__jitter)))
+            self.check_all()
+
+    def check_all(self) -> None:
+        """
+        Probes all the hosts at once and waits for the results
+        :return: Nothing
+        """
+        with self.__lock:
+            hosts = list(self.__hosts)
+        for future in [self.__executor.submit(self.__check, host) for host in hosts]:
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception(self.__name, f'Health check failed. Error {e}')
+
+    def get_metrics(self) -> Dict:
+        """
+        Returns the hosts' states and probe latency histograms: counts of probes
+        up to each of the bucket bounds (seconds) and above the last one ('+Inf')
+        """
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+        with self.__lock:
+            return {
+                'latency': dict(zip(bounds, self.__histogram)),
+                'hosts': {host: {'state': info['state'],
+                                 'failures': info['failures'],
+                                 'latency': dict(zip(bounds, info['histogram']))}
+                          for host, info in self.__hosts.items()},
+            }
+
+    def __check(self, host: str) -> None:
+        """Probes a host and updates its state"""
+        started_at = time.monotonic()
+        try:
+            healthy = self.__probe(host, self.__timeout)
+        except Exception as e:
+            logger.warning(self.__name, f'Probe of {host} raised {e}')
+            healthy = False
+        latency = time.monotonic() - started_at
+
+        marked = None
+        with self.__lock:
+            info = self.__hosts.get(host)
+            if info is None:
+                return
+            bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+            info['histogram'][bucket] += 1
+            self.__histogram[bucket] += 1
+
+            if healthy:
+                info['failures'] = 0
+                info['successes'] += 1
+                if info['state'] == DOWN_STATE and info['successes'] >= self.__success_threshold:
+                    info['state'] = marked = UP_STATE
+            else:
+                info['successes'] = 0
+                info['failures'] += 1
+                if info['state'] == UP_STATE and info['failures'] >= self.__failure_threshold:
+                    info['state'] = marked = DOWN_STATE
+                elif info['failures'] >= self.__forget_after:
+                    self.__hosts.pop(host)
+                    logger.info(self.__name, f'{host} is down for {self.__forget_after} probes, stopped probing it')
+
+        if marked == DOWN_STATE:
+            logger.warning(self.__name, f'{host} is marked down after {self.__failure_threshold} failed probes')
+            self.__on_down(host)
+        elif marked == UP_STATE:
+            logger.info(self.__name, f'{host} is marked up after {self.__success_threshold} successful probes')
+            self.__on_up(host)
@@ -0,0 +1,187 @@
+"""
+Rate limiting of API credentials shared by threads
+
+Every credential has a token bucket and serves one call at a time. Threads waiting for a credential
+queue up in FIFO order: only the first one waits for a credential, on its own condition, until the exact
+time the next token is due or a credential is released, and it wakes the next one when it's done.
+Nothing polls, and no thread is needed to return a credential after a call.
+"""
+import collections
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+
+
+class TokenBucket:
+    """
+    Tokens refilled one per interval, up to capacity
+    """
+
+    def __init__(self, interval: float, capacity: int = 1):
+        """
+        :param interval: seconds to refill one token
+        :param capacity: maximum number of tokens, i.e. calls in a burst
+        """
+        self.__interval = interval
+        self.__capacity = capacity
+        self.__tokens = float(capacity)
+        self.__updated_at = time.monotonic()
+
+    def get_wait_time(self, now: float) -> float:
+        """
+        :param now: time.monotonic() time
+        :return: seconds until a token is available, 0 if it is already
+        """
+        self.__refill(now)
+        return 0.0 if self.__tokens >= 1 else (1 - self.__tokens) * self.__interval
+
+    def take(self, now: float) -> None:
+        """
+        Takes a token, the caller must check it's available first
+        :param now: time.monotonic() time
+        """
+        self.__refill(now)
+        self.__tokens -= 1
+
+    def __refill(self, now: float) -> None:
+        """Adds the tokens refilled since the last update"""
+        if self.__interval <= 0:
+            self.__tokens = float(self.__capacity)
+        else:
+            self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated_at) / self.__interval)
+        self.__updated_at = now
+
+
+class CredentialsLimiter:
+    """
+    Thread-safe FIFO hand-off of rate-limited credentials, identified by their indexes
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__released = threading.Condition(self.__lock)
+        self.__buckets: Dict[int, TokenBucket] = {}
+        self.__in_use: Set[int] = set()
+        self.__retired: Set[int] = set()  # removed, but still in use
+        self.__waiters = collections.deque()  # conditions of the waiting threads, the first one is served next
+
+    def __len__(self) -> int:
+        return len(self.__buckets) - len(self.__retired)
+
+    def add(self, index: int, interval: float) -> None:
+        """
+        Adds a credential
+        :param index: the credential's index
+        :param interval: seconds between the credential's calls
+        """
+        with self.__lock:
+            self.__buckets[index] = TokenBucket(interval)
+            self.__notify_first_waiter()
+
+    def try_acquire(self) -> Optional[int]:
+        """
+        Takes a credential which is due now, unless other threads are waiting for one
+        :return: the credential's index, or None
+        """
+        with self.__lock:
+            if self.__waiters:
+                return None
+            index, _ = self.__find_due(time.monotonic())
+            if index is not None:
+                self.__take(index)
+            return index
+
+    def acquire(self, timeout: float = None) -> Optional[int]:
+        """
+        Waits in line for a credential which is not in use and has a token
+        :param timeout: seconds to wait, None to wait until a credential is due
+        :return: the credential's index, or None on timeout or if there are no credentials left
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__lock:
+            waiter = threading.Condition(self.__lock)
+            self.__waiters.append(waiter)
+            try:
+                while True:
+                    if len(self.__buckets) == len(self.__retired):
+                        return None
+
+                    wait_time = None
+                    if self.__waiters[0] is waiter:
+                        index, wait_time = self.__find_due(time.monotonic())
+                        if index is not None:
+                            self.__take(index)
+                            return index
+
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return None
+                        wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                    waiter.wait(wait_time)
+            finally:
+                self.__waiters.remove(waiter)
+                self.__notify_first_waiter()
+
+    def release(self, index: int) -> None:
+        """
+        Returns a credential after a call, it's due again when its next token is
+        :param index: the credential's index
+        """
+        with self.__lock:
+            self.__in_use.discard(index)
+            if index in self.__retired:
+                self.__retired.discard(index)
+                self.__buckets.pop(index, None)
+            self.__released.notify_all()
+            self.__notify_first_waiter()
+
+    def remove(self, index: int) -> bool:
+        """
+        Stops handing out a credential. If it's in use, it's dropped when released
+        :param index: the credential's index
+        :return: False if the credential was already removed
+        """
+        with self.__lock:
+            if index not in self.__buckets or index in self.__retired:
+                return False
+            if index in self.__in_use:
+                self.__retired.add(index)
+            else:
+                self.__buckets.pop(index)
+            self.__notify_first_waiter()
+            return True
+
+    def wait_until_released(self, index: int) -> None:
+        """
+        Waits until a call with the credential is over
+        :param index: the credential's index
+        """
+        with self.__lock:
+            self.__released.wait_for(lambda: index not in self.__in_use)
+
+    def __find_due(self, now: float) -> Tuple[Optional[int], Optional[float]]:
+        """
+        Looks for a credential to hand out (the lock must be held)
+        :return: the index of a credential which is due now, or None and seconds until one is due
+                 (None if all of them are in use)
+        """
+        wait_time = None
+        for index, bucket in self.__buckets.items():
+            if index in self.__in_use or index in self.__retired:
+                continue
+            bucket_wait_time = bucket.get_wait_time(now)
+            if bucket_wait_time <= 0:
+                return index, None
+            wait_time = bucket_wait_time if wait_time is None else min(wait_time, bucket_wait_time)
+        return None, wait_time
+
+    def __take(self, index: int) -> None:
+        """Marks a credential as in use and takes its token (the lock must be held)"""
+        self.__buckets[index].take(time.monotonic())
+        self.__in_use.add(index)
+
+    def __notify_first_waiter(self) -> None:
+        """Wakes the thread which is served next up (the lock must be held)"""
+        if self.__waiters:
+            self.__waiters[0].notify()
@@ -0,0 +1,94 @@
+"""
+In-memory counter of running tasks, reconciled with the DB in the background
+
+Requests only change the counter; a background thread writes it to the DB every flush_interval seconds
+if it has changed, or right away when it has drifted from the last written value by flush_threshold.
+"""
+import threading
+from typing import Callable
+
+from agents.agents_utils.utils_constants import AGENT_UTILS_NAME, TASK_COUNT_FLUSH_INTERVAL, \
+    TASK_COUNT_FLUSH_THRESHOLD
+from utils import logger
+
+
+class TaskCounter:
+    """
+    Thread-safe counter with a lazily written DB copy
+    """
+
+    def __init__(self, write_to_db: Callable[[int], None], flush_interval: float = TASK_COUNT_FLUSH_INTERVAL,
+                 flush_threshold: int = TASK_COUNT_FLUSH_THRESHOLD):
+        """
+        :param write_to_db: a function to write the current value to the DB
+        :param flush_interval: seconds between writes of a changed value (the reconciliation window)
+        :param flush_threshold: a difference from the written value which is written at once
+        """
+        self.__write_to_db = write_to_db
+        self.__flush_interval = flush_interval
+        self.__flush_threshold = flush_threshold
+
+        self.__lock = threading.Lock()
+        self.__value = 0
+        self.__written_value = 0
+        self.__significant_change = threading.Event()
+
+    @property
+    def value(self) -> int:
+        """Current number of tasks"""
+        return self.__value
+
+    def increment(self) -> int:
+        """
+        Adds a task
+        :return: the new number of tasks
+        """
+        return self.__change(1)
+
+    def decrement(self) -> int:
+        """
+        Removes a task
+        :return: the new number of tasks
+        """
+        return self.__change(-1)
+
+    def is_in_sync(self, value_from_db: int) -> bool:
+        """
+        Checks if a value read from the DB may be a delayed copy of this counter
+        :param value_from_db: the number of tasks as seen in the DB
+        :return: True if the difference is within what lazy writing explains
+        """
+        return abs(self.__value - value_from_db) < self.__flush_threshold + 1
+
+    def flush(self) -> None:
+        """
+        Writes the current value to the DB if it has changed
+        :return: Nothing
+        """
+        value = self.__value
+        if value == self.__written_value:
+            return
+        try:
+            self.__write_to_db(value)
+            self.__written_value = value
+        except Exception as e:
+            logger.exception(AGENT_UTILS_NAME, f'Could not write number of tasks {value}. Error {e}')
+
+    def run_flushing(self) -> None:
+        """
+        Writes the value every flush interval, or at once after a significant change. Never returns
+        :return: Nothing
+        """
+        while True:
+            self.__significant_change.wait(self.__flush_interval)
+            self.__significant_change.clear()
+            self.flush()
+
+    def __change(self, delta: int) -> int:
+        """Changes the value and wakes the flushing thread up if it has drifted too far"""
+        with self.__lock:
+            self.__value += delta
+            value = self.__value
+        if abs(value - self.__written_value) >= self.__flush_threshold:
+            self.__significant_change.set()
+        return value
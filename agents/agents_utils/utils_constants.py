@@ -38,6 +38,45 @@ MESSAGE_KEY = 'message'
 AGENT_NUMBER_KEY = 'agent_number'
 NUMBER_OF_TASKS_KEY = 'num_tasks'
 
+# Handler's number of tasks is kept in memory and written to the DB every TASK_COUNT_FLUSH_INTERVAL seconds,
+# or at once when it differs from the written one by TASK_COUNT_FLUSH_THRESHOLD
+TASK_COUNT_FLUSH_INTERVAL = float(os.environ.get('TASK_COUNT_FLUSH_INTERVAL', 5))  # in seconds
+TASK_COUNT_FLUSH_THRESHOLD = int(os.environ.get('TASK_COUNT_FLUSH_THRESHOLD', 3))
+
+# How a handler picks an agent for a request: least_busy, two_choices, latency_weighted or sticky
+AGENT_SELECTION_POLICY = os.environ.get('AGENT_SELECTION_POLICY', 'least_busy')
+# A request's query parameter to pick the same agent by, with the sticky policy
+STICKY_KEY = 'sticky_key'
+
+# Handlers pass agents' responses through in chunks instead of parsing and re-encoding them
+STREAMING_PROXY_MODE = os.environ.get('STREAMING_PROXY_MODE', 'True') == 'True'
+PROXY_CHUNK_SIZE = 64 * 1024  # in bytes
+# Headers which belong to a single connection, so a proxy must not forward them
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+                      'transfer-encoding', 'upgrade'}
+
+# Requests from handlers to agents
+AGENT_REQUEST_TIMEOUT = float(os.environ.get('AGENT_REQUEST_TIMEOUT', 300))  # in seconds, if the caller set no deadline
+AGENT_CONNECT_TIMEOUT = 5  # in seconds
+# Hedging: when an agent is slower than the HEDGING_PERCENTILE of recent responses, an idle one is asked too
+AGENT_REQUEST_HEDGING = os.environ.get('AGENT_REQUEST_HEDGING', 'False') == 'True'
+HEDGING_PERCENTILE = float(os.environ.get('HEDGING_PERCENTILE', 95))
+HEDGING_MIN_SAMPLES = 20  # responses needed before hedging starts
+HEDGING_WORKERS = 20  # threads sending hedged requests
+# An agent's circuit opens after CIRCUIT_BREAKER_FAILURE_THRESHOLD failures in a row,
+# and it gets no requests for CIRCUIT_BREAKER_RESET_TIMEOUT seconds
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 3))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_BREAKER_RESET_TIMEOUT', 30))
+
+# Health checks of a handler's agents
+HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', 30))  # in seconds
+HEALTH_CHECK_TIMEOUT = float(os.environ.get('HEALTH_CHECK_TIMEOUT', 2))  # in seconds, per probe
+HEALTH_CHECK_JITTER = 0.1  # fraction of the interval
+HEALTH_CHECK_FAILURE_THRESHOLD = int(os.environ.get('HEALTH_CHECK_FAILURE_THRESHOLD', 2))
+HEALTH_CHECK_SUCCESS_THRESHOLD = int(os.environ.get('HEALTH_CHECK_SUCCESS_THRESHOLD', 2))
+HEALTH_CHECK_FORGET_AFTER = 20  # failed probes in a row to stop probing an agent
+HEALTH_CHECK_WORKERS = 32
+
 DOWNLOADS_DIR = 'downloads'
 MAX_NUMBER_OF_TOPIC_SYMBOLS_IN_FILENAME = 30
 
@@ -2,10 +2,10 @@
 Abstract class for Agent API Implementation
 """
 import threading
+from http import HTTPStatus
 from random import shuffle, randint
-from time import sleep
+from time import monotonic, sleep
 
-import atexit
 import flask
 import requests
 from flask import send_from_directory, after_this_request, safe_join
@@ -17,7 +17,8 @@ from agents.agents_utils.utils_constants import *
 from utils import logger
 from utils.cloud_firestore_communication import Firestore, AGENT_HANDLER_ADDRESS_KEY, \
     AGENT_HANDLER_NUM_AGENTS_KEY
-from utils.constants import MESSAGE_KEY
+from utils.constants import MESSAGE_KEY, REQUEST_TIMEOUT_HEADER, TASK_SUBSCRIPTION_MODE
+from utils.firestore_task_subscription import TaskSubscription
 
 
 class AgentAPI:
@@ -32,6 +33,7 @@ class AgentAPI:
         :param app: an instance of Flask app
         """
         app.add_url_rule('/ping', view_func=self.ping_pong, methods=['GET'])
+        app.before_request(self.start_request_deadline)
 
         app.add_url_rule(f'/{DOWNLOADS_DIR}/<path:path>', view_func=self.send_static_files)
 
@@ -45,7 +47,6 @@ class AgentAPI:
         self.workers = {}
         self.running = True
         self.worker_lock = threading.Lock()
-        atexit.register(self.stop_running_workers_on_exit)
 
         try:
             self.agent_db_key = os.environ[f'{self.name.upper()}_AGENT_DB_KEY']
@@ -77,6 +78,22 @@ class AgentAPI:
         """
         return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Pong'}), SUCCESS_CODE)
 
+    @staticmethod
+    def start_request_deadline():
+        """
+        Starts the deadline of a request from the seconds its handler has left for it, see get_request_time_left.
+        A request with no time left is rejected, as the handler has given up on it already
+        :return: None, or a response to reject the request with
+        """
+        timeout = flask.request.headers.get(REQUEST_TIMEOUT_HEADER, type=float)
+        if timeout is None:
+            return None
+        if timeout <= 0:
+            return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Request deadline has passed'}),
+                                       HTTPStatus.GATEWAY_TIMEOUT)
+        flask.g.deadline = monotonic() + timeout
+        return None
+
     def find_agent_handler(self):
         """
         Find an agent handler to handle this instance
@@ -183,6 +200,16 @@ class AgentAPI:
         :param task_name: a name of a task to start
         :return: Nothing
         """
+        if TASK_SUBSCRIPTION_MODE:
+            try:
+                subscription = TaskSubscription(self.db, task_name, worker=True).start()
+            except Exception as e:
+                logger.warning(self.name, f'Could not subscribe to {task_name} tasks, polling them instead. '
+                                          f'Error: {e}')
+            else:
+                subscription.serve(self.workers, self.worker_lock, lambda: self.running,
+                                   lambda doc: self.constant_task_handler(task_name, doc))
+                return
 
         while True:
             with self.worker_lock:
@@ -196,7 +223,8 @@ class AgentAPI:
 
     def stop_running_workers_on_exit(self):
         """
-        Update values in DB for tasks being process by workers before exiting
+        Stop claiming tasks and release the leases on the ones being processed by workers.
+        Not required on exit, as the leases expire anyway
 
         :return: Nothing
         """
@@ -4,20 +4,30 @@ Abstract class for Agent Handler API Implementation
 import atexit
 import os
 import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from http import HTTPStatus
 from random import shuffle
 from time import sleep
-from typing import Dict, Optional
+from typing import Dict, Optional, Set
 
 import flask
 import requests
 from werkzeug.datastructures import MultiDict
 
+from agents.agents_utils.agent_pool import AgentPool
 from agents.agents_utils.agents_helper import get_my_ip
-from agents.agents_utils.utils_constants import IP_ADDRESS_KEY, AGENT_NUMBER_KEY, MESSAGE_KEY, NUMBER_OF_TASKS_KEY
+from agents.agents_utils.circuit_breaker import CircuitBreakers
+from agents.agents_utils.health_checker import HealthChecker
+from agents.agents_utils.task_counter import TaskCounter
+from agents.agents_utils.utils_constants import IP_ADDRESS_KEY, AGENT_NUMBER_KEY, MESSAGE_KEY, NUMBER_OF_TASKS_KEY, \
+    AGENT_SELECTION_POLICY, STICKY_KEY, STREAMING_PROXY_MODE, PROXY_CHUNK_SIZE, HOP_BY_HOP_HEADERS, \
+    AGENT_REQUEST_TIMEOUT, AGENT_CONNECT_TIMEOUT, AGENT_REQUEST_HEDGING, HEDGING_PERCENTILE, HEDGING_MIN_SAMPLES, \
+    HEDGING_WORKERS, HEALTH_CHECK_TIMEOUT
 from utils import logger
 from utils.cloud_firestore_communication import Firestore, AGENT_HANDLER_MAX_TASKS_KEY
-from utils.constants import MESSAGE_KEY
+from utils.http_session import RequestCanceller, UpstreamSessions
+from utils.constants import MESSAGE_KEY, REQUEST_TIMEOUT_HEADER, UPSTREAM_SESSIONS_MAX
 
 
 class AgentHandlerAPI:
@@ -34,20 +44,27 @@ class AgentHandlerAPI:
         atexit.register(self.delete_ip_address_from_db_on_exit)
         app.add_url_rule('/ping', view_func=self.ping_pong, methods=['GET'])
         app.add_url_rule('/addNewAgentInstance', view_func=self.add_new_agent_instance, methods=['POST'])
+        app.add_url_rule('/healthMetrics', view_func=self.health_metrics, methods=['GET'])
         app.before_request(self.before_request)
         app.after_request(self.after_request)
 
         self.app = app
         self.name = name
-        self.agent_ips = {}  # ip -> number of tasks it is doing
+        self.agent_pool = AgentPool(AGENT_SELECTION_POLICY)  # agents' ips with numbers of tasks they are doing
+        # keep-alive connections to the agents
+        self.agent_sessions = UpstreamSessions(max_upstreams=UPSTREAM_SESSIONS_MAX)
+        self.circuit_breakers = CircuitBreakers()
+        self.hedging_executor = ThreadPoolExecutor(max_workers=HEDGING_WORKERS, thread_name_prefix=f'{name}_hedging')
+        self.health_checker = HealthChecker(name, self.ping_agent_ip, self.__on_agent_down, self.__on_agent_up)
         self.number_of_agents_in_db = 0
 
         self.lock = threading.Lock()
         self.chosen_port = None
         self.handler_id = None
-        self.number_of_tasks = 0
+        self.task_counter = TaskCounter(
+            lambda number_of_tasks: self.db.change_number_of_tasks_in_agent_handler(self.handler_id, number_of_tasks))
         self.max_amount_of_tasks = 0
-        self.list_of_util_paths = ['/ping', '/addNewAgentInstance']
+        self.list_of_util_paths = ['/ping', '/addNewAgentInstance', '/healthMetrics']
         self.enable_feature_toggle = False
 
         try:
@@ -70,9 +87,14 @@ class AgentHandlerAPI:
         if self.enable_feature_toggle:
             feature_dict = self.db.get_agent_feature()
             data_form.update(feature_dict)
-        response = self.send_request_to_agent(flask.request.method, flask.request.path, flask.request.args, data_form)
-
-        if response:
+        timeout = flask.request.headers.get(REQUEST_TIMEOUT_HEADER, type=float)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        response = self.send_request_to_agent(flask.request.method, flask.request.path, flask.request.args, data_form,
+                                              stream=STREAMING_PROXY_MODE, deadline=deadline)
+
+        if response and STREAMING_PROXY_MODE:
+            return self.__stream_response(response)
+        elif response:
             response_json = {}
             try:
                 response_json = response.json()
@@ -83,6 +105,28 @@ class AgentHandlerAPI:
             return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Failed to get report from agents'}),
                                        HTTPStatus.INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    def __stream_response(response: requests.Response) -> flask.Response:
+        """
+        Passes an agent's response through as it is received: the status, the headers
+        and the body as raw (still encoded) chunks, without parsing or buffering it.
+        The agent's response is closed, which releases the agent, once the body is sent or the client is gone
+        :param response: the agent's response, requested with stream=True
+        :return: flask.Response
+        """
+        def generate_chunks():
+            try:
+                yield from response.raw.stream(PROXY_CHUNK_SIZE, decode_content=False)
+            finally:
+                response.close()
+
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in HOP_BY_HOP_HEADERS]
+        streamed_response = flask.Response(generate_chunks(), status=response.status_code, headers=headers,
+                                           direct_passthrough=True)
+        streamed_response.call_on_close(response.close)
+        return streamed_response
+
     def before_request(self):
         """
         Check and update number of tasks before request
@@ -91,20 +135,16 @@ class AgentHandlerAPI:
         if flask.request.path in self.list_of_util_paths:
             return None
 
-        self.lock.acquire()
-        try:
-            number_of_tasks = flask.request.args.get(NUMBER_OF_TASKS_KEY, type=int, default=0)
-            self.number_of_tasks += 1
-            self.db.change_number_of_tasks_in_agent_handler(self.handler_id, self.number_of_tasks)
-            if self.number_of_tasks != number_of_tasks + 1:
-                return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Wrong number of tasks. Please sync with DB.'}),
-                                           HTTPStatus.CONFLICT)
-            if self.number_of_tasks >= self.max_amount_of_tasks:
-                return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Maximum number of tasks reached.'
-                                                                       ' Please, wait or try with other handler.'}),
-                                           HTTPStatus.BAD_REQUEST)
-        finally:
-            self.lock.release()
+        number_of_tasks = flask.request.args.get(NUMBER_OF_TASKS_KEY, type=int, default=0)
+        current_number_of_tasks = self.task_counter.increment()
+        # The DB copy is written lazily, so it may lag behind within the flush threshold
+        if not self.task_counter.is_in_sync(number_of_tasks + 1):
+            return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Wrong number of tasks. Please sync with DB.'}),
+                                       HTTPStatus.CONFLICT)
+        if current_number_of_tasks >= self.max_amount_of_tasks:
+            return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Maximum number of tasks reached.'
+                                                                   ' Please, wait or try with other handler.'}),
+                                       HTTPStatus.BAD_REQUEST)
 
     def after_request(self, response):
         """
@@ -114,91 +154,202 @@ class AgentHandlerAPI:
         if flask.request.path in self.list_of_util_paths:
             return response
 
-        self.lock.acquire()
-        try:
-            self.number_of_tasks -= 1
-            self.db.change_number_of_tasks_in_agent_handler(self.handler_id, self.number_of_tasks)
-        finally:
-            self.lock.release()
+        if response.is_streamed:
+            # The task isn't done until the body is sent
+            response.call_on_close(self.task_counter.decrement)
+        else:
+            self.task_counter.decrement()
         return response
 
     def periodically_update_number_of_tasks(self):
         """
-        Periodically check if number of tasks is updated
+        Write the number of tasks to DB when it has changed
         :return: Nothing
         """
-        SLEEP_TIME = 30
-        while True:
-            self.db.change_number_of_tasks_in_agent_handler(self.handler_id, self.number_of_tasks)
-            sleep(SLEEP_TIME)
+        self.task_counter.run_flushing()
 
     def send_request_to_agent(self, method: str, url: str, params: Dict = None,
-                              data: Dict = None) -> Optional[requests.Response]:
+                              data: Dict = None, stream: bool = False,
+                              deadline: float = None) -> Optional[requests.Response]:
         """
         Send a task to a free agent
         :param method: an http method to use
         :param url: an url of endpoint
         :param params: query params to transfer
         :param data: data to transfer
+        :param stream: True to get the response before its body is read, the caller must close it then
+        :param deadline: time.monotonic() time to give up at, the time left is passed to the agent.
+                         AGENT_REQUEST_TIMEOUT from now if None
         :return: response or None
         """
         number_of_attempts = 3
         black_list_of_agents = {}
-        response = None
+        sticky_key = params.get(STICKY_KEY) if params else None
+        if deadline is None:
+            deadline = time.monotonic() + AGENT_REQUEST_TIMEOUT
 
-        while number_of_attempts > 0:
-            agent_ip = self.find_least_busy_agent(black_list_of_agents)
+        while number_of_attempts > 0 and time.monotonic() < deadline:
+            agent_ip = self.find_least_busy_agent(black_list_of_agents, sticky_key)
             if not agent_ip:
                 break
             black_list_of_agents[agent_ip] = True
-            self.lock.acquire()
-            try:
-                self.agent_ips[agent_ip] += 1
-            finally:
-                self.lock.release()
+            if not self.circuit_breakers.allow(agent_ip):
+                continue
 
+            request = (method, url, params, data, stream, deadline)
             try:
-                agent_url = f'{agent_ip}{url}' if url.startswith('/') else f'{agent_ip}/{url}'
-                response = requests.request(method=method, url=agent_url, params=params, data=data)
-                response.raise_for_status()
-                return response
+                if AGENT_REQUEST_HEDGING:
+                    return self.__send_hedged_request(agent_ip, black_list_of_agents, *request)
+                return self.__send_request_to_agent_ip(agent_ip, *request)
             except Exception as e:
-                logger.exception(self.name, f'Agent responded with an error {e}.', response)
-
-            self.lock.acquire()
-            try:
-                self.agent_ips[agent_ip] -= 1
-            finally:
-                self.lock.release()
+                logger.exception(self.name, f'Agent responded with an error {e}.')
 
             number_of_attempts -= 1
 
-        logger.exception(self.name, f'Amount of requests to agents from handler exceeded limit.')
+        logger.exception(self.name, f'Amount of requests to agents from handler exceeded limit or deadline passed.')
         return None
 
-    def find_least_busy_agent(self, black_list_of_agents: Dict[str, bool]) -> str:
+    def __send_request_to_agent_ip(self, agent_ip: str, method: str, url: str, params: Optional[Dict],
+                                   data: Optional[Dict], stream: bool, deadline: float,
+                                   canceller: RequestCanceller = None) -> requests.Response:
         """
-        Find an agent with the least amount of tasks
-        :return: an ip address of the agent
+        Sends a request to the agent, counting it in the agent's load, latency and circuit breaker
+        :param agent_ip: the agent's address
+        :param deadline: time.monotonic() time to give up at
+        :param canceller: to abort the request with, an aborted request doesn't count as the agent's failure
+        :return: the successful response, raises otherwise
         """
-        self.lock.acquire()
+        self.agent_pool.acquire(agent_ip)
+        started_at = time.monotonic()
+        response = None
         try:
-            for ip, _ in sorted(self.agent_ips.items(), key=lambda x: x[1]):
-                if ip not in black_list_of_agents:
-                    return ip
-        finally:
-            self.lock.release()
-        return ''
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise requests.Timeout(f'Deadline passed before the request to {agent_ip}')
+            agent_url = f'{agent_ip}{url}' if url.startswith('/') else f'{agent_ip}/{url}'
+            response = self.agent_sessions.request(method=method, url=agent_url, params=params, data=data,
+                                                   headers={REQUEST_TIMEOUT_HEADER: str(timeout)}, stream=stream,
+                                                   timeout=(min(AGENT_CONNECT_TIMEOUT, timeout), timeout),
+                                                   canceller=canceller)
+            response.raise_for_status()
+        except Exception as e:
+            self.agent_pool.release(agent_ip)
+            # Only an agent which is unreachable, hung or broken trips its circuit, not a bad or aborted request
+            if canceller is not None and canceller.is_cancelled():
+                logger.debug(self.name, f'Request to agent {agent_ip} is aborted')
+            elif not isinstance(e, requests.HTTPError) or response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                if self.circuit_breakers.record_failure(agent_ip):
+                    logger.warning(self.name, f'Circuit of agent {agent_ip} is open after failures')
+            else:
+                self.circuit_breakers.record_success(agent_ip)
+            if response is not None:
+                response.close()
+            raise
+
+        self.circuit_breakers.record_success(agent_ip)
+        if stream:
+            self.__release_agent_on_close(response, agent_ip, started_at)
+        else:
+            self.agent_pool.release(agent_ip, latency=time.monotonic() - started_at)
+        return response
+
+    def __release_agent_on_close(self, response: requests.Response, agent_ip: str, started_at: float) -> None:
+        """
+        Makes closing a streamed response release its agent, counting the time until then as the agent's latency,
+        as the agent is busy until its body is received. Only the first close releases the agent
+        :param response: the agent's response, requested with stream=True
+        :param agent_ip: the agent's address
+        :param started_at: time.monotonic() time the request was sent at
+        """
+        close = response.close
+        release_once = threading.Lock()
 
-    def ping_agent_ip(self, ip: str) -> bool:
+        def close_and_release():
+            close()
+            if release_once.acquire(blocking=False):
+                self.agent_pool.release(agent_ip, latency=time.monotonic() - started_at)
+
+        response.close = close_and_release
+
+    def __send_hedged_request(self, agent_ip: str, black_list_of_agents: Dict[str, bool], method: str, url: str,
+                              params: Optional[Dict], data: Optional[Dict], stream: bool,
+                              deadline: float) -> requests.Response:
+        """
+        Sends a request to the agent and, if it's slower than the HEDGING_PERCENTILE of recent responses,
+        the same request to an idle agent. The first successful response wins, the other request is aborted,
+        which releases its agent at once, or its response is discarded if it has arrived meanwhile
+        :param agent_ip: the agent's address
+        :param black_list_of_agents: ips of agents not to pick for the hedged request, the picked one is added
+        :param deadline: time.monotonic() time to give up at
+        :return: the successful response, raises otherwise
+        """
+        request = (method, url, params, data, stream, deadline)
+        cancellers = {}  # future of a request -> its canceller
+
+        def submit(ip: str) -> Future:
+            canceller = RequestCanceller()
+            future = self.hedging_executor.submit(self.__send_request_to_agent_ip, ip, *request, canceller)
+            cancellers[future] = canceller
+            return future
+
+        futures = {submit(agent_ip)}
+
+        hedging_delay = self.agent_pool.get_latency_percentile(HEDGING_PERCENTILE, HEDGING_MIN_SAMPLES)
+        if hedging_delay is not None:
+            done, _ = wait(futures, timeout=min(hedging_delay, max(deadline - time.monotonic(), 0)))
+            hedge_ip = '' if done else self.agent_pool.pick_idle(
+                set(black_list_of_agents) | self.circuit_breakers.get_rejecting())
+            if hedge_ip and self.circuit_breakers.allow(hedge_ip):
+                black_list_of_agents[hedge_ip] = True
+                logger.debug(self.name, f'Agent {agent_ip} is slow, hedging the request to agent {hedge_ip}')
+                futures.add(submit(hedge_ip))
+
+        error = None
+        while futures:
+            done, futures = wait(futures, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                error = requests.Timeout('Deadline passed while waiting for agents')
+                break
+            for future in done:
+                if future.exception() is None:
+                    self.__discard_requests(futures, cancellers)
+                    return future.result()
+                error = future.exception()
+
+        self.__discard_requests(futures, cancellers)
+        raise error
+
+    def __discard_requests(self, futures: Set[Future], cancellers: Dict[Future, RequestCanceller]) -> None:
+        """Aborts the requests which lost the race, and closes their responses if they have arrived anyway"""
+        for loser in futures:
+            cancellers[loser].cancel()
+            loser.add_done_callback(self.__close_discarded_response)
+
+    @staticmethod
+    def __close_discarded_response(future: Future) -> None:
+        """Closes the response of a request which lost the race, to return its connection to the pool"""
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def find_least_busy_agent(self, black_list_of_agents: Dict[str, bool], sticky_key: str = None) -> str:
+        """
+        Find an agent to send a task to, by the AGENT_SELECTION_POLICY (the least busy one by default)
+        :param black_list_of_agents: ips of agents not to pick
+        :param sticky_key: a key to pick the same agent for, with the sticky policy
+        :return: an ip address of the agent
+        """
+        return self.agent_pool.pick(set(black_list_of_agents) | self.circuit_breakers.get_rejecting(), sticky_key)
+
+    def ping_agent_ip(self, ip: str, timeout: float = HEALTH_CHECK_TIMEOUT) -> bool:
         """
         Pings an agent instance
         :param ip: an ip address of an agent with port for request
+        :param timeout: seconds to wait for the answer
         :return: True if the request was successful, false otherwise
         """
         response = None
         try:
-            response = requests.get(f'{ip}/ping')
+            response = self.agent_sessions.request(method='GET', url=f'{ip}/ping', timeout=timeout)
             response.raise_for_status()
         except requests.RequestException as e:
             logger.warning(self.name, f'Could not ping agent instance {ip}. Error {e}', response)
@@ -207,16 +358,33 @@ class AgentHandlerAPI:
 
     def periodical_ping(self):
         """
-        Ping all agent instances and remove those which are silent
+        Ping all agent instances at once, removing those which are silent and adding back those which recovered
         :return: None
         """
-        SLEEP_TIME = 30
-        while True:
-            ips = self.agent_ips.copy()
-            for agent_ip in ips:
-                if not self.ping_agent_ip(agent_ip):
-                    self.agent_ips.pop(agent_ip)
-            sleep(SLEEP_TIME)
+        self.health_checker.run()
+
+    def __on_agent_down(self, agent_ip: str) -> None:
+        """
+        Stops sending tasks to an agent which doesn't answer pings
+        :param agent_ip: the agent's address
+        """
+        self.agent_pool.remove(agent_ip)
+        self.agent_sessions.close(agent_ip)
+        self.circuit_breakers.remove(agent_ip)
+
+    def __on_agent_up(self, agent_ip: str) -> None:
+        """
+        Sends tasks to an agent again after it has recovered
+        :param agent_ip: the agent's address
+        """
+        self.agent_pool.add(agent_ip)
+
+    def health_metrics(self) -> flask.Response:
+        """
+        Answer with the agents' states and ping latency histograms
+        :return: response
+        """
+        return flask.make_response(flask.jsonify(self.health_checker.get_metrics()), HTTPStatus.OK)
 
     def check_number_of_agents(self):
         """
@@ -226,7 +394,7 @@ class AgentHandlerAPI:
         SLEEP_TIME = 5
         while True:
             sleep(SLEEP_TIME)
-            current_len_of_agent_ips = len(self.agent_ips)
+            current_len_of_agent_ips = len(self.agent_pool)
             if current_len_of_agent_ips != self.number_of_agents_in_db and self.handler_id:
                 self.number_of_agents_in_db = current_len_of_agent_ips
                 self.db.change_number_of_agents_in_agent_handler(self.handler_id, self.number_of_agents_in_db)
@@ -240,16 +408,15 @@ class AgentHandlerAPI:
         try:
             ip = flask.request.args.get(IP_ADDRESS_KEY, type=str)
             agent_number = flask.request.args.get(AGENT_NUMBER_KEY, type=int)
-            if agent_number != len(self.agent_ips):
+            if agent_number != len(self.agent_pool):
                 return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Wrong number of agents. Please, sync with DB'
                                                                        ' and try again'}), HTTPStatus.CONFLICT)
 
             if self.ping_agent_ip(ip):
-                if ip not in self.agent_ips:
-                    self.agent_ips[ip] = 0
-                else:
+                if not self.agent_pool.add(ip):
                     return flask.make_response(flask.jsonify({MESSAGE_KEY: 'Agent is already added'}),
                                                HTTPStatus.BAD_REQUEST)
+                self.health_checker.add(ip)
             else:
                 return flask.make_response(flask.jsonify({MESSAGE_KEY: 'The agent did not respond'}),
                                            HTTPStatus.BAD_REQUEST)
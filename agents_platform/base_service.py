@@ -2,7 +2,7 @@
 Base class for agent_service
 """
 
-import atexit
+import copy
 import datetime
 import json
 import re
@@ -12,7 +12,6 @@ import urllib.parse
 from abc import ABCMeta, abstractmethod
 from configparser import ConfigParser, NoSectionError, NoOptionError
 from http import HTTPStatus
-from multiprocessing.pool import ThreadPool
 from typing import Dict, List, Optional
 
 import requests
@@ -24,11 +23,18 @@ from agents_platform.own_adapter.agent import Agent
 from agents_platform.own_adapter.agent_data import get_agent_data_by_user_id
 from agents_platform.own_adapter.agent_task import get_agent_task_answers_by_id
 from agents_platform.own_adapter.board import Board
+from agents_platform.own_adapter.board_cache import get_board_snapshot_cache
+from agents_platform.own_adapter.board_outbox import BoardOutbox
 from agents_platform.own_adapter.constants import ENGINE_NAME, PROTOCOL, STATUS, AGENTS_SERVICES_PATH, AdapterStatus
 from agents_platform.own_adapter.element import Element
 from agents_platform.own_adapter.platform_access import PlatformAccess
+from agents_platform.util.agent_task_registry import AgentTaskRegistry
+from agents_platform.util.dispatcher import PriorityDispatcher
 from utils import logger
+from utils.agent_handler_directory import AgentHandlerDirectory
 from utils.cloud_firestore_communication import Firestore
+from utils.firestore_task_subscription import TaskSubscription
+from utils.http_session import UpstreamSessions
 from utils.constants import *
 from utils.logger import debug, error, exception, info
 
@@ -47,7 +53,10 @@ class AgentService(metaclass=ABCMeta):
             self.redis_name = self._agent_config.get(META_SECTION_KEY, 'redis_name') or f'{self.name}_agent'
             self.description = self._agent_config.get(META_SECTION_KEY, 'description')
             self.status = self._agent_config.getint(META_SECTION_KEY, 'status')
-            self.pool = ThreadPool(NUM_THREADS_PER_SERVICE)
+            self.websocket_dispatcher = PriorityDispatcher(self.name, self.on_websocket_message,
+                                                           num_workers=NUM_THREADS_PER_SERVICE,
+                                                           max_size=WEBSOCKET_DISPATCH_QUEUE_SIZE,
+                                                           put_timeout=WEBSOCKET_DISPATCH_PUT_TIMEOUT)
 
             # Subscription data extraction
             currency = self._agent_config.get(SUBSCRIPTION_SECTION_KEY, CURRENCY_KEY)
@@ -111,16 +120,21 @@ class AgentService(metaclass=ABCMeta):
             }
 
             self.platform_access = None
+            self.board_outbox = BoardOutbox()
+            # keep-alive connections to the agent handlers
+            self.handler_sessions = UpstreamSessions(max_upstreams=UPSTREAM_SESSIONS_MAX)
             self.agent_db_key = os.environ[f'{self.name.upper()}_AGENT_DB_KEY']
             self.db = Firestore(self.agent_db_key)
+            self.agent_handler_directory = AgentHandlerDirectory(self.db).start()
             self.task_running_listeners = {}
             self.task_running_updaters = {}
+            self.task_running_workers = {}  # constant monitoring tasks created here, worked on by the agents
             self.running = True
             self.updater_thread_lock = threading.Lock()
             self.listener_thread_lock = threading.Lock()
 
-            atexit.register(self.stop_running_tasks_on_exit)
-
+            self.agent_task_registry = AgentTaskRegistry(
+                os.path.join(AGENTS_SERVICES_PATH, f'{self.name}_service', 'agent_tasks'), self.name)
             for task_file_name in self.get_agent_tasks_names():
                 task_name = task_file_name.replace('.json', '')
                 threading.Thread(target=lambda: self._start_periodical_updates(task_name,
@@ -205,7 +219,7 @@ class AgentService(metaclass=ABCMeta):
         finally:
             if doc_id:
                 self.db.finish_monitoring_task(doc_ref, listener=True)
-                self.task_running_listeners.pop(doc_id)
+                self.task_running_listeners.pop(doc_id, None)
 
     def retrieve_and_upload_data(self, doc_ref: firestore.firestore.DocumentReference,
                                  board: Board):
@@ -230,22 +244,31 @@ class AgentService(metaclass=ABCMeta):
         if not content:
             return
 
-        last_message_read = content[LAST_MESSAGE_READ_KEY]
-        messages = content[MESSAGES_KEY]
-        last_index = max(last_message_read, messages[-1][INDEX_KEY] if messages else 0)
-        new_messages = list(filter(lambda message: message[INDEX_KEY] > last_index, messages))
-
+        # Messages added after this are flagged again, so the next listener round picks them up
         self.db.update_document(doc_ref, {
-            LAST_MESSAGE_READ_KEY: last_index,
-            MESSAGES_KEY: new_messages,
+            HAS_NEW_MESSAGES_KEY: False,
         })
-        for message in messages:
-            if message[INDEX_KEY] <= last_index:
-                board.put_message(message[MESSAGE_KEY])
+        # The task leaves task_running_listeners if its lease is lost
+        while self.db.get_doc_id(doc_ref) in self.task_running_listeners:
+            messages = self.db.get_messages(doc_ref)
+            if not messages:
+                break
+            posts = [self.board_outbox.put(board, message[MESSAGE_KEY]) for message in messages]
+            # Messages are deleted only after they are posted, the failed ones are read again by the next round
+            posted = [message for message, post in zip(messages, posts) if post.result()]
+            self.db.acknowledge_messages(doc_ref, posted)
+            if len(posted) < len(messages):
+                self.db.update_document(doc_ref, {
+                    HAS_NEW_MESSAGES_KEY: True,
+                })
+                break
+            if len(messages) < MESSAGES_PAGE_SIZE:
+                break
 
     def stop_running_tasks_on_exit(self):
         """
-        Update values in DB for monitoring tasks before exiting
+        Stop claiming tasks and release the leases on the running ones, so other instances don't wait for them
+        to expire. Not required on exit, as the leases expire anyway
         :return: Nothing
         """
         self.running = False
@@ -255,6 +278,8 @@ class AgentService(metaclass=ABCMeta):
         with self.updater_thread_lock:
             for doc in self.task_running_updaters.copy().values():
                 self.db.finish_monitoring_task(doc_ref=doc, update=True)
+        for doc in self.task_running_workers.copy().values():
+            self.db.finish_monitoring_task(doc_ref=doc, worker=True)
 
     def _run_on_element_default(self, element: Element, query_id: str = '', agent_task: Optional[Dict] = None,
                                 update: bool = False, constant_monitoring: bool = False) -> Optional[Element]:
@@ -290,12 +315,19 @@ class AgentService(metaclass=ABCMeta):
         :return: Target element
         """
         self.db.delete_old_agent_tasks(element.get_id())
+        # The leases of this instance are renewed while the task runs here, so no one else claims it
+        runners = {UPDATING_LEASE_KEY: self.task_running_updaters}
+        if start_listener or constant_monitoring:
+            runners[LISTENER_LEASE_KEY] = self.task_running_listeners
+        if constant_monitoring:
+            # The agent works on the task from the request, until the task is deleted
+            runners[WORKER_LEASE_KEY] = self.task_running_workers
         doc_ref = self.db.create_new_doc_for_task(element.get_board().get_id(), element.get_id(), query_id, task_name,
                                                   update_period=self.updating_time_interval,
-                                                  constant_monitoring=constant_monitoring, agent_task=agent_task)
+                                                  constant_monitoring=constant_monitoring, agent_task=agent_task,
+                                                  runners=runners)
         doc_id = self.db.get_doc_id(doc_ref)
         try:
-            self.task_running_updaters[doc_id] = doc_ref
             if start_listener or constant_monitoring:
                 threading.Thread(target=lambda: self.communication_handling(doc_ref),
                                  daemon=True).start()
@@ -307,7 +339,7 @@ class AgentService(metaclass=ABCMeta):
             logger.exception(self.name, f'Couldn\'t run updates on element for task: {task_name}. Error: {e}')
         finally:
             self.db.finish_monitoring_task(doc_ref, update=True)
-            self.task_running_updaters.pop(doc_id)
+            self.task_running_updaters.pop(doc_id, None)
 
     def _run_update_for_task(self, doc_ref: firestore.firestore.DocumentReference, task_name: str) \
             -> Optional[Element]:
@@ -334,9 +366,33 @@ class AgentService(metaclass=ABCMeta):
         finally:
             self.db.finish_monitoring_task(doc_ref, update=True)
             if doc_id:
-                self.task_running_updaters.pop(doc_id)
+                self.task_running_updaters.pop(doc_id, None)
 
     # Web-sockets
+    def dispatch_websocket_message(self, ws: websocket.WebSocketApp, message: str) -> None:
+        """
+        Queues a websocket message for on_websocket_message by its type's priority.
+        A message about an element replaces a queued message of the same type about that element,
+        unless they belong to different agent queries, e.g. two submissions of answers.
+        Live updates are applied to the cached board snapshots here, in order of arrival
+        """
+        try:
+            message_dict = json.loads(message)
+            message_type = message_dict['contentType'].replace('application/vnd.uberblik.', '')
+        except (ValueError, KeyError, AttributeError) as e:
+            error(self.name, f'Unexpected websocket message: {message}. Error: {e}')
+            return
+
+        try:
+            get_board_snapshot_cache().apply_live_update(message_type, message_dict)
+        except Exception as e:
+            exception(self.name, f'Could not apply a live update to the board snapshots: {message}. Error: {e}')
+
+        priority = WEBSOCKET_MESSAGE_PRIORITIES.get(message_type, DEFAULT_WEBSOCKET_MESSAGE_PRIORITY)
+        target = message_dict.get('elementId') or message_dict.get('path')
+        key = (message_type, message_dict.get('boardId'), target, message_dict.get('agentQueryId')) if target else None
+        self.websocket_dispatcher.put((ws, message), priority=priority, key=key)
+
     def on_websocket_message(self, ws: websocket.WebSocketApp, message: str) -> None:
         """Processes websocket messages"""
         message_dict = json.loads(message)
@@ -407,22 +463,15 @@ class AgentService(metaclass=ABCMeta):
             agent_task_answers = agent_task['agentTaskElement']['agentTask']
             agent_task_config_id = agent_task_answers['id']
 
-        # Get all the agent-tasks
-        possible_files = self.get_agent_tasks_names()
-
-        # Find the AgentTask to run
-        for filename in possible_files:
-            if self.get_agent_task_config_from_file(filename)['agentTask'].get('id', None) == agent_task_config_id:
-                return filename.replace('.json', '')
-
-        return ''
+        return self.agent_task_registry.get_task_name(agent_task_config_id)
 
     def on_websocket_error(self, ws, err):
         """Logs websocket errors"""
         error(self.name, err)
 
     def on_websocket_open(self, ws):
-        """Logs websocket openings"""
+        """Logs websocket openings, and drops the board snapshots which may have missed live updates"""
+        get_board_snapshot_cache().clear()
         info(self.name, f'{self.redis_name}\'s websocket is open')
 
     def on_websocket_close(self, ws):
@@ -439,7 +488,7 @@ class AgentService(metaclass=ABCMeta):
         query['token'] = agent.get_platform_access().get_access_token()
         url = f'{PROTOCOL}://{platform_url_no_protocol}/opensocket?{urllib.parse.urlencode(query)}'
         ws = websocket.WebSocketApp(url,
-                                    on_message=lambda *args: self.pool.starmap_async(self.on_websocket_message, [args]),
+                                    on_message=self.dispatch_websocket_message,
                                     on_error=self.on_websocket_error,
                                     on_open=self.on_websocket_open,
                                     on_close=self.on_websocket_close)
@@ -469,6 +518,10 @@ class AgentService(metaclass=ABCMeta):
                     exception(self.name,
                               f'Could not open a websocket. Exception message: {str(excpt)}')
 
+            dispatch_metrics = self.websocket_dispatcher.get_metrics()
+            if dispatch_metrics['depth']:
+                debug(self.name, f'Websocket dispatch queue: {dispatch_metrics}')
+
             # wait until next check
             time.sleep(10)
 
@@ -513,15 +566,13 @@ class AgentService(metaclass=ABCMeta):
         :return: the agent task config
         """
 
-        file_location = os.path.join(AGENTS_SERVICES_PATH, f'{self.name}_service', 'agent_tasks', file_name)
-        try:
-            with open(file_location, 'r') as file:
-                agent_task_config = json.load(file)
-        except Exception as e:
-            error(self.name, f'Agent task config in {file_name} not found. Exception {e}.')
-            raise
+        agent_task_config = self.agent_task_registry.get_config(file_name)
+        if agent_task_config is None:
+            error(self.name, f'Agent task config in {file_name} not found.')
+            raise FileNotFoundError(f'Agent task config in {file_name} not found')
 
-        return agent_task_config
+        # The registry's config is shared
+        return copy.deepcopy(agent_task_config)
 
     def update_element_caption(self, element: Element, update_with_data: str) -> None:
         """
@@ -556,16 +607,8 @@ class AgentService(metaclass=ABCMeta):
 
     def get_agent_tasks_names(self) -> List[str]:
         """Returns AgentTasks' names in the agent-service agent_task directory"""
-        # Form the agent_tasks absolute path
-        this_service_tasks_path = os.path.join(AGENTS_SERVICES_PATH, f'{self.name}_service', 'agent_tasks')
-        if not os.path.exists(this_service_tasks_path):
-            return []
-
-        # Get all the filenames that are .json
-        possible_files = [file for file in os.listdir(this_service_tasks_path) if file.endswith('.json')]
-
         # TODO: Check if they are really AgentTasks
-        return possible_files
+        return self.agent_task_registry.get_file_names()
 
     def send_request_to_agent_handler(self, method: str, url: str, params: Dict = None, data: Dict = None) \
             -> Optional[requests.Response]:
@@ -582,17 +625,30 @@ class AgentService(metaclass=ABCMeta):
         MAX_NUMBER_OF_ATTEMPTS = 5
         number_of_attempts = 0
         black_list_of_agent_handlers = set()
+        # Handlers which rejected the request as their number of tasks was out of date (409 CONFLICT),
+        # with the number of directory snapshots received before the request
+        conflicted_handlers = {}
         response = None
-        SLEEP_TIME = 2
+        # Handlers and agents get the same deadline, so a hung one can't block the task forever
+        deadline = time.monotonic() + AGENT_HANDLER_REQUEST_TIMEOUT
 
-        while number_of_attempts <= MAX_NUMBER_OF_ATTEMPTS:
-            handler = self.db.get_agent_handler_with_least_amount_of_tasks(list(black_list_of_agent_handlers))
+        # A failed handler is replaced by the next least loaded one at once, without waiting.
+        # Once only conflicted handlers are left, they are tried again after a newer snapshot of their numbers of tasks
+        while number_of_attempts <= MAX_NUMBER_OF_ATTEMPTS and time.monotonic() < deadline:
+            handler = self.agent_handler_directory.acquire(black_list_of_agent_handlers)
             if not handler:
+                if conflicted_handlers and self.agent_handler_directory.wait_for_snapshot(
+                        min(conflicted_handlers.values()), deadline - time.monotonic()):
+                    black_list_of_agent_handlers.difference_update(conflicted_handlers)
+                    conflicted_handlers.clear()
+                    continue
                 break
 
             handler_id, handler_info = handler
             handler_ip = handler_info.get(AGENT_HANDLER_ADDRESS_KEY, None)
             if not handler_ip:
+                self.agent_handler_directory.release(handler_id)
+                black_list_of_agent_handlers.add(handler_id)
                 continue
 
             black_list_of_agent_handlers.add(handler_id)
@@ -601,21 +657,27 @@ class AgentService(metaclass=ABCMeta):
                 params = {}
             params[NUMBER_OF_TASKS_KEY] = num_of_tasks_in_handler
 
+            snapshot_number = self.agent_handler_directory.get_snapshot_number()
             try:
-                response = requests.request(method=method, url=f'{handler_ip}/{url}', params=params, data=data)
+                timeout = max(deadline - time.monotonic(), 0.001)
+                response = self.handler_sessions.request(method=method, url=f'{handler_ip}/{url}', params=params,
+                                                         data=data, headers={REQUEST_TIMEOUT_HEADER: str(timeout)},
+                                                         timeout=timeout)
                 if response.status_code == HTTPStatus.CONFLICT:
-                    black_list_of_agent_handlers.remove(handler_id)
+                    conflicted_handlers[handler_id] = snapshot_number
 
                 response.raise_for_status()
                 return response
             except requests.ConnectionError as e:
                 self.db.increase_handler_number_of_fails(handler_id)
+                self.handler_sessions.close(handler_ip)
                 logger.exception(self.name, f'Agent handler is not reachable. Error {e}.', response)
             except requests.RequestException as e:
                 logger.exception(self.name, f'Agent handler responded with an error {e}.', response)
+            finally:
+                self.agent_handler_directory.release(handler_id)
 
             number_of_attempts += 1
-            time.sleep(SLEEP_TIME * (number_of_attempts ** 2))
 
         logger.exception(self.name, f'Amount of requests to agents from handler exceeded limit.')
         return response
@@ -628,26 +690,23 @@ class AgentService(metaclass=ABCMeta):
         :param period_time: amount of seconds to wait between checks
         :return: Nothing
         """
-        SLEEP_TIME = 1
+        if TASK_SUBSCRIPTION_MODE and self.__serve_subscription(task_name, self.task_running_listeners,
+                                                                self.listener_thread_lock,
+                                                                self.communication_handling, listener=True):
+            return
+
         MAX_NUMBER_OF_TASKS_FOR_ONE_PERIOD = 10
-        docs = {}
 
         while True:
-            for i in range(MAX_NUMBER_OF_TASKS_FOR_ONE_PERIOD):
-                with self.listener_thread_lock:
-                    if not self.running:
-                        return
-                    doc = self.db.get_agent_task_from_firestore(task_name, runners_dict=self.task_running_listeners,
-                                                                listener=True, constant_monitoring=True)
-                if not doc:
-                    break
-                docs[self.db.get_doc_id(doc)] = doc
-
-                time.sleep(SLEEP_TIME)
-
-            for doc_id, doc in docs.copy().items():
-                docs.pop(doc_id)
-                threading.Thread(target=lambda: self.communication_handling(doc), daemon=True).start()
+            with self.listener_thread_lock:
+                if not self.running:
+                    return
+                docs = self.db.claim_agent_tasks(task_name, runners_dict=self.task_running_listeners,
+                                                 max_tasks=MAX_NUMBER_OF_TASKS_FOR_ONE_PERIOD,
+                                                 listener=True, constant_monitoring=True)
+
+            for doc in docs:
+                threading.Thread(target=self.communication_handling, args=(doc,), daemon=True).start()
 
             time.sleep(period_time)
 
@@ -659,6 +718,12 @@ class AgentService(metaclass=ABCMeta):
         :param period_time: amount of seconds to wait between checks
         :return: Nothing
         """
+        if TASK_SUBSCRIPTION_MODE and self.__serve_subscription(task_name, self.task_running_updaters,
+                                                                self.updater_thread_lock,
+                                                                lambda doc: self._run_update_for_task(doc, task_name),
+                                                                constant_monitoring=False, update=True):
+            return
+
         while True:
             with self.updater_thread_lock:
                 if not self.running:
@@ -670,6 +735,29 @@ class AgentService(metaclass=ABCMeta):
                                  daemon=True).start()
             time.sleep(period_time)
 
+    def __serve_subscription(self, task_name: str, runners_dict: Dict, lock: threading.Lock, handler,
+                             constant_monitoring: bool = True, listener: bool = None, update: bool = None) -> bool:
+        """
+        Claim tasks as soon as they arrive through a Firestore snapshot listener, until the service stops
+
+        :param task_name: a name of a task to claim
+        :param runners_dict: a dict to store doc references and clear them on exit
+        :param lock: a lock held while claiming
+        :param handler: a function to handle a claimed task's doc reference
+        :param constant_monitoring: whether a task is a constant monitoring one
+        :param listener: claim tasks for listener
+        :param update: claim tasks for update
+        :return: False if the subscription could not be started, so tasks should be polled instead
+        """
+        try:
+            subscription = TaskSubscription(self.db, task_name, listener=listener, update=update,
+                                            constant_monitoring=constant_monitoring).start()
+        except Exception as e:
+            logger.warning(self.name, f'Could not subscribe to {task_name} tasks, polling them instead. Error: {e}')
+            return False
+        subscription.serve(runners_dict, lock, lambda: self.running, handler)
+        return True
+
     def get_file_from_agent_and_send_to_element(self, file_url: str, filename: str, element: Element) -> bool:
         """
         Downloads a file from agent and uploads it to an element
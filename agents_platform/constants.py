@@ -1,3 +1,5 @@
+import os
+
 # === Settings configurations
 META_SECTION_KEY = 'meta'
 SERVICE_SECTION_KEY = 'service'
@@ -59,7 +61,22 @@ google_logger_enums = {
 HTML_REF_CODE = 'application/vnd.uberblik.htmlReference'
 
 NUM_THREADS_PER_SERVICE = 5
+
+# Websocket live updates dispatch: lower priority values are handled first
+WEBSOCKET_DISPATCH_QUEUE_SIZE = int(os.environ.get('WEBSOCKET_DISPATCH_QUEUE_SIZE', 1000))
+# Seconds the websocket's thread waits for room in a full queue, 0 not to hold up the websocket at all
+WEBSOCKET_DISPATCH_PUT_TIMEOUT = float(os.environ.get('WEBSOCKET_DISPATCH_PUT_TIMEOUT', 0))
+DEFAULT_WEBSOCKET_MESSAGE_PRIORITY = 5
+WEBSOCKET_MESSAGE_PRIORITIES = {
+    'liveUpdateElementPermanentlyDeleted+json': 0,
+    'liveUpdateElementDeleted+json': 0,
+    'liveUpdateAgentTaskElementDeleted+json': 0,
+    'liveUpdateBoardDeleted+json': 0,
+    'liveUpdateAgentTaskElementAnswersSaved+json': 10,
+}
 NUMBER_OF_TASKS_KEY = 'num_tasks'
+# Query parameter for agent handlers to send requests with equal values to the same agent
+STICKY_KEY = 'sticky_key'
 
 # CLI
 FILENAME_KEY = 'filename'
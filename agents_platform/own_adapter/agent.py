@@ -4,14 +4,16 @@ Basic functionality to work with an Agent
 Be ware of this is not a replication! I.e., there is no Agent class on a back-end
 """
 
+import asyncio
 import json
 from typing import Dict, List, Optional, Union
 
 import redis
 from requests import HTTPError
 
+from agents_platform.own_adapter.async_client import run_sync
 from agents_platform.own_adapter.board import Board
-from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME
+from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME, BOARDS_FETCH_CONCURRENCY
 from agents_platform.own_adapter.element import Element
 from agents_platform.own_adapter.platform_access import PlatformAccess
 from agents_platform.redis_handler import get_redis_connection
@@ -148,17 +150,18 @@ class Agent:
 
         return new_boards
 
-    def get_elements(self, regexp: str = '') -> List[Element]:
+    def get_elements(self, regexp: str = '',
+                     max_concurrent_boards: int = BOARDS_FETCH_CONCURRENCY) -> List[Element]:
         """
         Returns all the elements agent possesses that exist and are cached
 
         :param regexp: If given, filters elements' names with regular expression
+        :param max_concurrent_boards: Maximum number of boards requested at the same time
 
         :return: Elements that exist and are cached
         """
-        elements = []
-        for board in self.get_boards():
-            elements.extend(board.get_elements(regexp))
+        boards = self.get_boards() or []
+        elements = run_sync(self.__get_boards_elements_async(boards, regexp, max_concurrent_boards))
         # removing template elements
         # TODO: Refactor and stop using redis in favour of firestore
         agent_name = self.get_redis_name().replace('_agent', '')
@@ -184,6 +187,35 @@ class Agent:
 
         return existing_and_cached_elements
 
+    @staticmethod
+    async def __get_boards_elements_async(boards: List[Board], regexp: str,
+                                          max_concurrent_boards: int) -> List[Element]:
+        """
+        Requests the elements of all the given boards concurrently,
+        merging every board's elements as soon as its response arrives
+
+        :param boards: Boards to get the elements from
+        :param regexp: If given, filters elements' names with regular expression
+        :param max_concurrent_boards: Maximum number of boards requested at the same time
+
+        :return: Elements of all the boards (in order of arrival)
+        """
+        semaphore = asyncio.Semaphore(max_concurrent_boards)
+
+        async def get_board_elements(board: Board) -> List[Element]:
+            async with semaphore:
+                try:
+                    return await board.get_elements_async(regexp)
+                except Exception as error:
+                    logger.exception(OWN_ADAPTER_NAME,
+                                     f'Could not get elements of the board {board.get_id()}: {error}')
+                    return []
+
+        elements = []
+        for board_elements in asyncio.as_completed([get_board_elements(board) for board in boards]):
+            elements.extend(await board_elements)
+        return elements
+
     def cache_element_to_redis(self, element: Element) -> None:
         """
         Caches an element to Redis
@@ -227,9 +259,13 @@ class Agent:
         if connection is None:
             connection = get_redis_connection()
 
-        redis_elements = {}
+        # Fetch all the hashes in a single round trip
+        pipeline = connection.pipeline(transaction=False)
         for element in elements:
-            element_dict = connection.hgetall(f'{self.__redis_name}:elements:{element.get_id()}')
+            pipeline.hgetall(f'{self.__redis_name}:elements:{element.get_id()}')
+
+        redis_elements = {}
+        for element_dict in pipeline.execute():
             if element_dict:
                 redis_element = Element.from_dictionary(self.__platform_access, element_dict)
                 redis_elements[redis_element.get_id()] = redis_element
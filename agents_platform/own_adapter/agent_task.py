@@ -11,7 +11,7 @@ from requests import ConnectionError, RequestException, Response, HTTPError
 import utils.logger as logger
 from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME, AGENTS_SERVICES_PATH
 from agents_platform.own_adapter.platform_access import PlatformAccess
-from agents_platform.util.networking import make_request, compose_path
+from agents_platform.util.networking import make_request, make_request_async, compose_path
 
 
 def get_all_agent_tasks(platform_access: PlatformAccess,
@@ -106,6 +106,86 @@ def get_agent_task_answers_by_id(platform_access: PlatformAccess, agent_task_id:
     return None
 
 
+async def get_all_agent_tasks_async(platform_access: PlatformAccess,
+                                    agent_data_id: int) -> Optional[List[Dict]]:
+    """
+    Asyncio version of get_all_agent_tasks
+    :param platform_access:
+    :param agent_data_id:
+    :return:
+    """
+    if not (platform_access and agent_data_id):
+        return None
+
+    response = await make_request_async(platform_access=platform_access,
+                                        http_method='GET',
+                                        url_postfix=f'agentdata/{agent_data_id}/agenttasks',
+                                        detail='agentTask')
+    if response:
+        return response.json()
+    return None
+
+
+async def get_agent_task_by_id_async(platform_access: PlatformAccess, agent_task_id: int,
+                                     agent_data_id: int) -> Optional[Dict]:
+    """
+    Asyncio version of get_agent_task_by_id
+    :param agent_task_id: an agent task id
+    :param agent_data_id: an agent data id
+    :param platform_access: a platform access
+    :return: Response's data from a back-end if no error occurred, otherwise None
+    """
+    if not (agent_task_id and agent_data_id):
+        return None
+    try:
+        url = f'agentdata/{agent_data_id}/agenttasks/{agent_task_id}/configuration'
+        response = await make_request_async(platform_access=platform_access,
+                                            http_method='GET',
+                                            url_postfix=url,
+                                            detail='agentTaskConfiguration')
+        response.raise_for_status()
+        return response.json()
+    except ConnectionError as con_err:
+        logger.exception(OWN_ADAPTER_NAME, f'Connection error for Form: {con_err}')
+    except RequestException as req_excpt:
+        logger.exception(OWN_ADAPTER_NAME, f'During getting the data for Form, occurred: '
+                                           f'{req_excpt}')
+    except Exception as error:
+        logger.exception(OWN_ADAPTER_NAME, f'Could not prepare a request for Form: {error}')
+    return None
+
+
+async def get_agent_task_answers_by_id_async(platform_access: PlatformAccess, agent_task_id: int,
+                                             board_id: int, element_id: int,
+                                             agent_data_id: int) -> Optional[Dict]:
+    """
+    Asyncio version of get_agent_task_answers_by_id
+    :param element_id: an agent task id
+    :param board_id: an agent board id
+    :param agent_task_id: an agent task id
+    :param agent_data_id: an agent data id
+    :param platform_access: a platform access
+    :return: a dict containing response from the server
+    """
+    try:
+        url = f'agentdata/{agent_data_id}/agenttasks/' \
+              f'{agent_task_id}/boards/{board_id}/elements/{element_id}/answers'
+        response = await make_request_async(platform_access=platform_access,
+                                            http_method='GET',
+                                            url_postfix=url,
+                                            detail='agentTaskElement')
+        response.raise_for_status()
+        return response.json()
+    except ConnectionError as con_err:
+        logger.exception(OWN_ADAPTER_NAME, f'Connection error for Form: {con_err}')
+    except RequestException as req_excpt:
+        logger.exception(OWN_ADAPTER_NAME, f'During getting the data for Form, occurred: '
+                                           f'{req_excpt}')
+    except Exception as error:
+        logger.exception(OWN_ADAPTER_NAME, f'Could not prepare a request for Form: {error}')
+    return None
+
+
 def get_answer_from_agent_task_answers(agent_task_answers: Dict, answer_index: int) -> List:
     """
     A helper function to return a list of answers for a given index of a question
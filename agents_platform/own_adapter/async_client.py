@@ -0,0 +1,201 @@
+"""
+Asyncio transport of the own_adapter
+
+One AsyncClient (one aiohttp session with its connection pool) is kept per event loop.
+Responses mimic requests.Response, and transport errors are re-raised as requests' exceptions,
+so async adapter methods share their error handling with the synchronous ones.
+At exit, the sessions on the background event loop are closed and the loop is stopped.
+
+Basic usage:
+    elements = await board.get_elements_async()
+    # or, from synchronous code:
+    elements = run_sync(board.get_elements_async())
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import json
+import threading
+import weakref
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+import aiohttp
+from requests import ConnectionError, HTTPError, Timeout
+
+from utils.constants import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE
+
+SESSIONS_CLOSE_TIMEOUT = 5  # seconds to wait for the sessions to close at exit
+
+
+class AsyncResponse:
+    """
+    Fully read response of an AsyncClient request,
+    exposing the subset of requests.Response used by the adapter and the logger
+    """
+
+    def __init__(self, url: str, status_code: int, reason: str, headers: Dict, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        """Response's body decoded as UTF-8"""
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self) -> Any:
+        """Response's body parsed as JSON"""
+        return json.loads(self.text)
+
+    def read(self) -> bytes:
+        """Raw response's body (used by the logger)"""
+        return self.content
+
+    def raise_for_status(self) -> None:
+        """Raises requests.HTTPError for 4xx and 5xx status codes"""
+        if 400 <= self.status_code < 600:
+            raise HTTPError(f'{self.status_code} Error: {self.reason} for url: {self.url}', response=self)
+
+    def __bool__(self) -> bool:
+        return self.status_code < 400
+
+
+class AsyncClient:
+    """
+    aiohttp session bound to the event loop it was created in
+    """
+    # Clients with an open session, to close them when their loop shuts down
+    __open_clients = weakref.WeakSet()
+
+    def __init__(self, pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE):
+        """
+        :param pool_connections: Number of hosts to keep connections for
+        :param pool_maxsize: Maximum number of keep-alive connections per host
+        """
+        self.__limit = pool_connections * pool_maxsize
+        self.__limit_per_host = pool_maxsize
+        self.__session = None
+        self.__loop = None
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        """Returns the client's session, creating it on first use (must be called inside the loop)"""
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(limit=self.__limit, limit_per_host=self.__limit_per_host)
+            self.__session = aiohttp.ClientSession(connector=connector)
+            self.__loop = asyncio.get_event_loop()
+            AsyncClient.__open_clients.add(self)
+        return self.__session
+
+    async def request(self, method: str, url: str, headers: Dict = None, data: Any = None,
+                      files: Dict = None, params: Dict = None, timeout: float = None) -> AsyncResponse:
+        """
+        Makes an HTTP request and reads the whole response
+
+        :param method: {GET|POST|PUT|PATCH|DELETE}
+        :param url: Full URL of the request
+        :param headers: Request's headers
+        :param data: Payload (bytes or str)
+        :param files: requests-like multipart files: {field_name: (file_name, file_bytes)}
+        :param params: Query parameters
+        :param timeout: Total timeout of the request in seconds, None to wait forever
+
+        :return: AsyncResponse
+        """
+        if files:
+            data = aiohttp.FormData()
+            for field_name, (file_name, file_bytes) in files.items():
+                data.add_field(field_name, file_bytes, filename=file_name)
+
+        try:
+            async with self.__get_session().request(method, url, headers=headers, data=data, params=params,
+                                                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                content = await response.read()
+                return AsyncResponse(str(response.url), response.status, response.reason,
+                                     dict(response.headers), content)
+        except aiohttp.ClientConnectionError as error:
+            raise ConnectionError(error) from error
+        except asyncio.TimeoutError as error:
+            raise Timeout(error) from error
+
+    async def close(self) -> None:
+        """Closes the session and all its pooled connections"""
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+        self.__session = None
+        AsyncClient.__open_clients.discard(self)
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """Closes the sessions of all the clients bound to the running event loop"""
+        loop = asyncio.get_event_loop()
+        clients = [client for client in list(cls.__open_clients) if client.__loop is loop]
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+
+__background_loop = None
+__background_loop_lock = threading.Lock()
+
+
+def __get_background_loop() -> asyncio.AbstractEventLoop:
+    """Returns the process-wide event loop used by run_sync, starting its thread on first use"""
+    global __background_loop
+    with __background_loop_lock:
+        if __background_loop is None:
+            __background_loop = asyncio.new_event_loop()
+            threading.Thread(target=__background_loop.run_forever, name='own_adapter_async_loop',
+                             daemon=True).start()
+    return __background_loop
+
+
+def __shut_down_background_loop() -> None:
+    """Closes the sessions on the background event loop and stops it, at exit"""
+    with __background_loop_lock:
+        loop = __background_loop
+    if loop is None or not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(AsyncClient.close_all(), loop).result(SESSIONS_CLOSE_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        pass  # the connections are dropped with the process anyway
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(__shut_down_background_loop)
+
+
+def run_sync(coroutine: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Runs an async adapter call from synchronous code and waits for its result.
+    All such calls share one background event loop, thus one connection pool per PlatformAccess
+
+    :param coroutine: Coroutine to run, like board.get_elements_async()
+    :param timeout: Seconds to wait for the result, None to wait forever
+
+    :return: The coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, __get_background_loop()).result(timeout)
+
+
+def submit(coroutine: Coroutine) -> concurrent.futures.Future:
+    """
+    Schedules an async adapter call on the background event loop without waiting for it
+
+    :param coroutine: Coroutine to run, like board.put_message_async(message)
+
+    :return: Future of the coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, __get_background_loop())
+
+
+def call_soon(callback: Callable, *args) -> None:
+    """
+    Runs a callback in the background event loop's thread, e.g. to change state owned by the loop
+
+    :param callback: A function to call
+    :param args: Its arguments
+    """
+    __get_background_loop().call_soon_threadsafe(callback, *args)
@@ -5,15 +5,16 @@ Board class is only partially replicated
 
 import json
 import re
-from typing import List, Dict, Union, Optional
+import time
+from typing import List, Dict, Union, Optional, Tuple
 from http import HTTPStatus
 from requests import ConnectionError, HTTPError
 
-from requests import request
-
+from agents_platform.own_adapter.board_cache import get_board_snapshot_cache, parse_board_path
 from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME, PREFIX
 from agents_platform.own_adapter.element import Element
 from agents_platform.own_adapter.platform_access import PlatformAccess
+from agents_platform.util.geometry import OccupancyGrid, FIRST_FIT, ALL_FITS
 from agents_platform.util.networking import compose_path
 from utils import logger
 
@@ -46,19 +47,87 @@ class Board:
         """Returns board's ID"""
         return self.__id
 
-    def get_elements(self, regexp: str = '') -> List[Element]:
+    def get_elements(self, regexp: str = '', force_refresh: bool = False) -> List[Element]:
         """
         Returns all the board's elements
         If regexp is given will return only matched ones?..
 
         :param regexp: Elements caption-filter regular expression
+        :param force_refresh: Whether to refetch the elements instead of reading the board's snapshot
 
         :return: A list of parsed board's elements (filtered by regexp for caption if given)
         """
-        response_data = self.__elements_request()
-        elements = self.__create_elements(response_data, regexp)
+        snapshot = self.__get_snapshot(need_size=False, force_refresh=force_refresh)
+        elements = self.__create_elements(snapshot[1] if snapshot else None, regexp)
         return elements
 
+    async def get_elements_async(self, regexp: str = '', force_refresh: bool = False) -> List[Element]:
+        """
+        Asyncio version of get_elements
+
+        :param regexp: Elements caption-filter regular expression
+        :param force_refresh: Whether to refetch the elements instead of reading the board's snapshot
+
+        :return: A list of parsed board's elements (filtered by regexp for caption if given)
+        """
+        cache = get_board_snapshot_cache()
+        snapshot = None if force_refresh else cache.get(self.__id)
+        if snapshot and snapshot[1]['elements'] is not None:
+            return self.__create_elements(snapshot[1], regexp)
+
+        requested_at = time.monotonic()
+        response_data = await self.__elements_request_async()
+        if response_data is None:
+            return []
+        _, data = cache.put(self.__id, requested_at, elements=response_data['elements'])
+        elements = self.__create_elements(data, regexp)
+        return elements
+
+    def get_snapshot(self, force_refresh: bool = False) -> Optional[Tuple[int, Dict]]:
+        """
+        Returns the board's snapshot, cached and kept up to date by the live updates, see board_cache
+
+        :param force_refresh: Whether to refetch the board instead of reading the cache
+
+        :return: the snapshot's version (it changes with every change of the snapshot) and
+                 {'board': {'sizeX': int, 'sizeY': int}, 'elements': [raw elements]},
+                 or None if the board couldn't be fetched
+        """
+        return self.__get_snapshot(need_size=True, force_refresh=force_refresh)
+
+    def __get_snapshot(self, need_size: bool, need_elements: bool = True,
+                       force_refresh: bool = False) -> Optional[Tuple[int, Dict]]:
+        """
+        Returns the board's cached snapshot, fetching the parts which are needed but not cached
+
+        :param need_size: Whether the board's size is needed
+        :param need_elements: Whether the board's elements are needed
+        :param force_refresh: Whether to refetch the needed parts
+
+        :return: the snapshot's version and data (see get_snapshot), or None if a needed part couldn't be fetched
+        """
+        cache = get_board_snapshot_cache()
+        snapshot = None if force_refresh else cache.get(self.__id)
+        data = snapshot[1] if snapshot else {'board': None, 'elements': None}
+        fetch_size = need_size and data['board'] is None
+        fetch_elements = need_elements and data['elements'] is None
+        if not fetch_size and not fetch_elements:
+            return snapshot
+
+        requested_at = time.monotonic()
+        size = None
+        if fetch_size:
+            size = self.__board_size_request()
+            if size is None:
+                return None
+        elements = None
+        if fetch_elements:
+            response_data = self.__elements_request()
+            if response_data is None:
+                return None
+            elements = response_data['elements']
+        return cache.put(self.__id, requested_at, size=size, elements=elements)
+
     @staticmethod
     def get_board_by_id(board_id: str, platform_access: PlatformAccess,
                         need_name: bool = True) -> Optional['Board']:
@@ -81,7 +150,7 @@ class Board:
             headers = platform_access.get_headers(http_method, url, values, detail)
             response = None
             try:
-                response = request(method=http_method, url=url, headers=headers)
+                response = platform_access.request(method=http_method, url=url, headers=headers)
                 response.raise_for_status()
             except HTTPError as http_error:
                 logger.exception(OWN_ADAPTER_NAME,
@@ -111,7 +180,30 @@ class Board:
         values = {}
         headers = self.__platform_access.get_headers(http_method, url, values, detail)
         try:
-            response = request(method=http_method, url=url, headers=headers)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
+            response.raise_for_status()
+        except HTTPError as http_error:
+            logger.exception(OWN_ADAPTER_NAME, f'{http_error}')
+            return None
+        except ConnectionError as connect_error:
+            logger.exception(OWN_ADAPTER_NAME, f'{connect_error}')
+            return None
+        response_data = response.json()
+        return response_data
+
+    async def __elements_request_async(self) -> Optional[Dict]:
+        """
+        Asyncio version of __elements_request
+
+        :return: Data on/of board's elements if a request was successful, otherwise None
+        """
+        http_method = 'GET'
+        detail = 'elements'
+        url = compose_path(self.__url, 'elements')
+        values = {}
+        headers = self.__platform_access.get_headers(http_method, url, values, detail)
+        try:
+            response = await self.__platform_access.get_async_client().request(http_method, url, headers=headers)
             response.raise_for_status()
         except HTTPError as http_error:
             logger.exception(OWN_ADAPTER_NAME, f'{http_error}')
@@ -185,6 +277,8 @@ class Board:
         :return: Returns all the elements which names match regexp
         """
         elements = []
+        if not data:
+            return elements
         for element_response in data['elements']:
             new_elem = self.__create_elem_from_response(element_response, regexp)
             if new_elem is not None:
@@ -203,6 +297,49 @@ class Board:
         if not message:
             return None
 
+        http_method = 'POST'
+        url, headers, payload = self.__compose_message_request(message)
+        try:
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers,
+                                                      data=payload.encode())
+            return self.__check_message_response(response)
+        except Exception as error:
+            logger.exception(OWN_ADAPTER_NAME,
+                             f'Couldn\'t put new message in the {self.get_name()} board.'
+                             f'{error}')
+            return None
+
+    async def put_message_async(self, message: str) -> Optional[int]:
+        """
+        Asyncio version of put_message
+
+        :param message: Text to post
+
+        :return: Response's status code, or None
+        """
+        if not message:
+            return None
+
+        http_method = 'POST'
+        url, headers, payload = self.__compose_message_request(message)
+        try:
+            response = await self.__platform_access.get_async_client().request(http_method, url, headers=headers,
+                                                                               data=payload.encode())
+            return self.__check_message_response(response)
+        except Exception as error:
+            logger.exception(OWN_ADAPTER_NAME,
+                             f'Couldn\'t put new message in the {self.get_name()} board.'
+                             f'{error}')
+            return None
+
+    def __compose_message_request(self, message: str) -> Tuple[str, Dict, str]:
+        """
+        Composes URL, headers and payload to post a message on the board's activity chat
+
+        :param message: Text to post
+
+        :return: (url, headers, payload)
+        """
         http_method = 'POST'
         url = compose_path(self.__url, 'posts')
         detail = 'post'
@@ -214,23 +351,30 @@ class Board:
         values = {}
         headers = self.__platform_access.get_headers(http_method, url, values, detail,
                                                      payload=payload)
-        try:
-            response = request(method=http_method, url=url, headers=headers, data=payload.encode())
-            response_status = response.status_code
-            if response_status != HTTPStatus.CREATED:
-                logger.exception(OWN_ADAPTER_NAME,
-                                 f'Couldn\'t put new message in the {self.get_name()} board. '
-                                 f'{response.content}', response)
-            return response_status
-        except Exception as error:
+        return url, headers, payload
+
+    def __check_message_response(self, response) -> int:
+        """Logs a failed message post, and returns response's status code"""
+        response_status = response.status_code
+        if response_status != HTTPStatus.CREATED:
             logger.exception(OWN_ADAPTER_NAME,
-                             f'Couldn\'t put new message in the {self.get_name()} board.'
-                             f'{error}')
-            return None
+                             f'Couldn\'t put new message in the {self.get_name()} board. '
+                             f'{response.content}', response)
+        return response_status
 
-    def get_board_size(self) -> Optional[Dict[str, int]]:
+    def get_board_size(self, force_refresh: bool = False) -> Optional[Dict[str, int]]:
         """
         Gets the board's maximum columns and rows numbers
+        :param force_refresh: Whether to refetch the size instead of reading the board's snapshot
+        :return: dict: {'sizeX': board's max X size, 'sizeY': board's max Y size},
+                 or None due to exceptions (BadRequest, etc.)
+        """
+        snapshot = self.__get_snapshot(need_size=True, need_elements=False, force_refresh=force_refresh)
+        return dict(snapshot[1]['board']) if snapshot else None
+
+    def __board_size_request(self) -> Optional[Dict[str, int]]:
+        """
+        Requests the board's maximum columns and rows numbers
         :return: dict: {'sizeX': board's max X size, 'sizeY': board's max Y size},
                  or None due to exceptions (BadRequest, etc.)
         """
@@ -242,7 +386,7 @@ class Board:
         try:
             headers = self.__platform_access.get_headers(http_method, url, values, detail)
             # TODO: Bad request handling
-            response = request(method=http_method, url=url, headers=headers)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
             response.raise_for_status()
 
             response_data = response.json()
@@ -258,38 +402,37 @@ class Board:
 
     def get_elements_matrix(self) -> List[List]:
         """Returns board's grid as 2D matrix"""
-        board_size = self.get_board_size()
-        response_data = self.__elements_request()
-        elements_matrix = self.__create_elements_matrix(board_size, response_data)
-        return elements_matrix
+        return self.get_occupancy_grid().to_matrix()
+
+    def get_occupancy_grid(self, force_refresh: bool = False) -> OccupancyGrid:
+        """
+        Returns board's grid of occupied cells
+
+        :param force_refresh: Whether to refetch the board instead of reading the board's snapshot
+        """
+        snapshot = self.get_snapshot(force_refresh)
+        data = snapshot[1] if snapshot else {'board': None, 'elements': None}
+        return self.__create_occupancy_grid(data['board'], data)
 
     @staticmethod
-    def __create_elements_matrix(board_size: Dict,
-                                 response_data: Dict) -> Optional[List[List[int]]]:
+    def __create_occupancy_grid(board_size: Dict, response_data: Dict) -> OccupancyGrid:
         """
-        Forms 2D-occupation-matrix according board's elements
+        Forms the occupancy grid according board's elements
 
         :param board_size: {'sizeX': int, 'sizeY': int}
         :param response_data: Data from get_elements' response
         Reference: https://github.com/own-dev/own-agent-open/blob/master/docs/APIDescription.md#get-boardsboardidelements
 
-        :return: 2D-matrix where 1 means this [i;j] cell is occupied by some element,
-                                 0 otherwise
-                 If IndexError occurred, X-Y matrix filled with 1 is returned
-                 FIXME: None is returned instead
-        """
-        elements_matrix = [[0] * board_size['sizeX'] for _ in range(board_size['sizeY'])]
-        for element in response_data['elements']:
-            for i in range(1, element['sizeY'] + 1):
-                for j in range(1, element['sizeX'] + 1):
-                    try:
-                        elements_matrix[element['posY'] + i - 2][element['posX'] + j - 2] = 1
-                    except IndexError as error:
-                        logger.exception(OWN_ADAPTER_NAME,
-                                         f'Failed to create elements matrix. Error message: {error}')
-                        elements_matrix = [[1] * board_size['sizeX'] for _ in range(board_size['sizeY'])]
-                        return elements_matrix
-        return elements_matrix
+        :return: the grid where every cell covered by some element is occupied
+                 If an element is out of the board, the grid with all the cells occupied is returned
+        """
+        try:
+            return OccupancyGrid.from_elements(board_size['sizeX'], board_size['sizeY'], response_data['elements'])
+        except IndexError as error:
+            logger.exception(OWN_ADAPTER_NAME, f'Failed to create elements matrix. Error message: {error}')
+            grid = OccupancyGrid(board_size['sizeX'], board_size['sizeY'])
+            grid.occupy(0, 0, grid.size_x, grid.size_y)
+            return grid
 
     # put new element on the board
     # two steps: 1. add element with empty name (no message on the board chat);
@@ -330,11 +473,12 @@ class Board:
             headers = self.__platform_access.get_headers(http_method, url, values,
                                                          detail, payload=payload_data)
 
-            response = request(method=http_method, url=url, headers=headers,
-                               data=payload_data.encode())
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers,
+                                                      data=payload_data.encode())
             response.raise_for_status()
             response_data = response.json()
             new_element_link = response_data["element"]["_links"][0]["href"]
+            get_board_snapshot_cache().put_element(self.__id, response_data['element'])
         except HTTPError as http_error:
             logger.exception(OWN_ADAPTER_NAME, f'Error: add element to {self.get_name()} failed. '
                                                f'Error type: {http_error}', response)
@@ -369,9 +513,11 @@ class Board:
             headers = self.__platform_access.get_headers(http_method, url,
                                                          values, detail, payload=payload)
 
-            response = request(method=http_method, url=url, headers=headers, data=payload.encode())
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers,
+                                                      data=payload.encode())
             response.raise_for_status()
             response_data = response.json()
+            get_board_snapshot_cache().put_element(self.__id, response_data['element'])
 
             new_element = self.__create_elem_from_response(response_data['element'])
             return new_element
@@ -398,8 +544,11 @@ class Board:
             url = element_url
             values = {}
             headers = self.__platform_access.get_headers(http_method, url, values, detail)
-            response = request(method=http_method, url=url, headers=headers)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
             response.raise_for_status()
+            _, element_id = parse_board_path(element_url)
+            if element_id is not None:
+                get_board_snapshot_cache().remove_element(self.__id, element_id)
             return response.status_code
         except HTTPError as error:
             logger.exception(OWN_ADAPTER_NAME, f'Error: remove element {element_url} from'
@@ -415,6 +564,22 @@ class Board:
     # ––––––––––––––––––––
     # Layout allocation
     # ––––––––––––––––––––
+    def find_free_rect(self, size_x: int, size_y: int, mode: str = FIRST_FIT) \
+            -> Union[Optional[Tuple[int, int]], List[Tuple[int, int]]]:
+        """
+        Searchs for an empty area of size_x x size_y cells on the board
+
+        :param size_x: Number of columns
+        :param size_y: Number of rows
+        :param mode: FIRST_FIT, BEST_FIT or ALL_FITS, see OccupancyGrid.find_free_rect
+
+        :return: coordinates (x; y) from 1 of the area's top left cell, or None; a list of them for ALL_FITS
+        """
+        fits = self.get_occupancy_grid().find_free_rect(size_x, size_y, mode)
+        if mode == ALL_FITS:
+            return [(x + 1, y + 1) for x, y in fits]
+        return (fits[0] + 1, fits[1] + 1) if fits else None
+
     def find_first_empty_element(self, caller: str = OWN_ADAPTER_NAME) -> Optional[Dict[str, int]]:
         """
         Searchs for an empty element on the given board
@@ -424,15 +589,12 @@ class Board:
         :return: coordinates (x; y) of the first found empty element, or None
         """
         try:
-            grid = self.get_elements_matrix()
-            # TODO: extract to a method that finds an empty spot for an element
             # TODO: make saying hello a two step process. The OWN chat message is empty after 'hello'
             # TODO: or is it a frontend problem?
-
-            for pos_y, pos_x in ((y, x) for y in range(len(grid)) for x in range(len(grid[y]))):
-                if grid[pos_y][pos_x] == 0:
-                    return {'x': pos_x + 1, 'y': pos_y + 1}
-            return None
+            position = self.find_free_rect(1, 1)
+            if not position:
+                return None
+            return {'x': position[0], 'y': position[1]}
         except Exception as excpt:
             logger.exception(caller,
                              'Error occurred while searching an empty element (Board ID: {}). '
@@ -0,0 +1,283 @@
+"""
+Cache of board snapshots
+
+A snapshot is a board's size and raw elements (as in GET /boards/{boardId}/elements), shared by all
+the Board objects of the process, so listing elements and placing new ones doesn't refetch the board
+every time. Snapshots are kept up to date in place by the live updates the agent's websocket receives:
+moved, resized, renamed and deleted elements are changed in the snapshot, while a live update which
+doesn't carry the element (an added or merged one, or a change of its files) drops the snapshot's elements,
+so the next read refetches them. Every change gives the snapshot a new version. Fetched parts expire after ttl seconds,
+in case live updates were missed, and the least recently used snapshots are evicted beyond max_boards.
+
+Basic usage:
+    cache = get_board_snapshot_cache()
+    snapshot = cache.get(board_id)  # (version, {'board': size or None, 'elements': [..] or None}), or None
+    requested_at = time.monotonic()
+    ...fetch the missing parts...
+    version, data = cache.put(board_id, requested_at, size=size, elements=elements)
+    ...
+    cache.apply_live_update(message_type, message_dict)  # from the websocket, in order of arrival
+"""
+
+import itertools
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+from agents_platform.own_adapter.constants import BOARD_SNAPSHOT_TTL, BOARD_SNAPSHOT_CACHE_SIZE
+
+# Live updates
+ELEMENT_LIVE_UPDATE_PREFIXES = ('liveUpdateElement', 'liveUpdateFile')
+ELEMENT_ADDED = 'liveUpdateElementAdded+json'
+ELEMENT_DELETED = 'liveUpdateElementDeleted+json'
+ELEMENT_PERMANENTLY_DELETED = 'liveUpdateElementPermanentlyDeleted+json'
+BOARD_DELETED = 'liveUpdateBoardDeleted+json'
+# Live updates which change an element in place: element's field -> the live update's field
+ELEMENT_CHANGES = {
+    'liveUpdateElementMoved+json': {'posX': 'newPosX', 'posY': 'newPosY'},
+    'liveUpdateElementResized+json': {'sizeX': 'newSizeX', 'sizeY': 'newSizeY'},
+    'liveUpdateElementCaptionEdited+json': {'caption': 'newCaption'},
+}
+
+# '/boards/{boardId}', '/boards/{boardId}/elements/{elementId}' or its '/files/{fileId}', possibly in a full URL
+BOARD_PATH_PATTERN = re.compile(r'/boards/([^/]+)(?:/elements/([^/]+)(?:/files/[^/]+)?)?/?$')
+
+
+def parse_board_path(path: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Extracts IDs from a path of a board, an element or an element's file, like '/boards/1/elements/561'
+
+    :param path: The path or URL
+
+    :return: (board's ID, element's ID), None for the missing ones
+    """
+    match = BOARD_PATH_PATTERN.search(path or '')
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+class BoardSnapshotCache:
+    """
+    Thread-safe LRU of board snapshots.
+    Elements which are handed out are never changed: a change replaces the element in the snapshot
+    """
+
+    def __init__(self, ttl: float = BOARD_SNAPSHOT_TTL, max_boards: int = BOARD_SNAPSHOT_CACHE_SIZE):
+        """
+        :param ttl: Seconds a fetched size or list of elements is used for, 0 disables the cache
+        :param max_boards: Maximum number of boards to keep snapshots of
+        """
+        self.__ttl = ttl
+        self.__max_boards = max_boards
+
+        self.__lock = threading.Lock()
+        # board's ID -> {'version', 'board', 'board_fetched_at', 'elements', 'elements_fetched_at'},
+        # where 'elements' is an OrderedDict element's ID -> raw element; the least recently used board first
+        self.__snapshots: OrderedDict = OrderedDict()
+        # board's ID -> time of its last change, to tell fetches which have raced with a change.
+        # Beyond max_boards the oldest are forgotten, and any board counts as changed at the latest forgotten time
+        self.__changed_at: OrderedDict = OrderedDict()
+        self.__forgotten_changed_at = float('-inf')
+        self.__versions = itertools.count(1)
+
+    def get(self, board_id: Union[str, int]) -> Optional[Tuple[int, Dict]]:
+        """
+        Returns the board's snapshot
+
+        :param board_id: Board's ID
+
+        :return: the snapshot's version and {'board': {'sizeX': .., 'sizeY': ..}, 'elements': [..]},
+                 where a part which isn't cached or has expired is None; None if nothing of the board is cached
+        """
+        key = str(board_id)
+        with self.__lock:
+            snapshot = self.__snapshots.get(key)
+            if snapshot is None:
+                return None
+            data = self.__to_data(snapshot, time.monotonic())
+            if data['board'] is None and data['elements'] is None:
+                self.__snapshots.pop(key)
+                return None
+            self.__snapshots.move_to_end(key)
+            return snapshot['version'], data
+
+    def put(self, board_id: Union[str, int], requested_at: float,
+            size: Dict = None, elements: List[Dict] = None) -> Tuple[int, Dict]:
+        """
+        Stores fetched parts of the board's snapshot.
+        Elements requested before a change of the board are returned, but not cached, as they may predate it
+
+        :param board_id: Board's ID
+        :param requested_at: time.monotonic() time the parts were requested at
+        :param size: The board's size {'sizeX': .., 'sizeY': ..}, if it was fetched
+        :param elements: The board's raw elements, if they were fetched
+
+        :return: the snapshot's new version and its data (see get) with the given parts
+        """
+        key = str(board_id)
+        if self.__ttl <= 0:
+            return next(self.__versions), {'board': size, 'elements': elements}
+
+        with self.__lock:
+            snapshot = self.__snapshots.get(key)
+            if snapshot is None:
+                snapshot = {'board': None, 'board_fetched_at': 0.0, 'elements': None, 'elements_fetched_at': 0.0}
+            data = self.__to_data(snapshot, time.monotonic())
+
+            if size is not None:
+                snapshot['board'] = data['board'] = dict(size)
+                snapshot['board_fetched_at'] = requested_at
+            if elements is not None:
+                elements_by_id = OrderedDict((self.__get_element_id(element, index), element)
+                                             for index, element in enumerate(elements))
+                data['elements'] = list(elements_by_id.values())
+                if self.__changed_at.get(key, self.__forgotten_changed_at) < requested_at:
+                    snapshot['elements'] = elements_by_id
+                    snapshot['elements_fetched_at'] = requested_at
+
+            snapshot['version'] = next(self.__versions)
+            self.__snapshots[key] = snapshot
+            self.__snapshots.move_to_end(key)
+            while len(self.__snapshots) > self.__max_boards:
+                self.__snapshots.popitem(last=False)
+            return snapshot['version'], data
+
+    def put_element(self, board_id: Union[str, int], element: Dict) -> None:
+        """
+        Adds or replaces an element written by this process, if the board's elements are cached
+
+        :param board_id: Board's ID
+        :param element: The raw element from the platform's response
+        """
+        key = str(board_id)
+        with self.__lock:
+            snapshot = self.__touch(key)
+            if snapshot is not None:
+                snapshot['elements'][self.__get_element_id(element, len(snapshot['elements']))] = element
+                snapshot['version'] = next(self.__versions)
+
+    def remove_element(self, board_id: Union[str, int], element_id: str) -> None:
+        """
+        Removes an element deleted by this process, if the board's elements are cached
+
+        :param board_id: Board's ID
+        :param element_id: Element's ID
+        """
+        key = str(board_id)
+        with self.__lock:
+            snapshot = self.__touch(key)
+            if snapshot is not None and snapshot['elements'].pop(str(element_id), None) is not None:
+                snapshot['version'] = next(self.__versions)
+
+    def apply_live_update(self, message_type: str, message: Dict) -> bool:
+        """
+        Applies a websocket's live update to the snapshot of its board.
+        Live updates must be applied in order of arrival, as they are absolute
+
+        :param message_type: Live update's type, like 'liveUpdateElementMoved+json'
+        :param message: Live update's message
+
+        :return: True if a cached snapshot has changed
+        """
+        if message_type == BOARD_DELETED:
+            board_id, _ = parse_board_path(message.get('path'))
+            return board_id is not None and self.invalidate(board_id)
+        if not message_type.startswith(ELEMENT_LIVE_UPDATE_PREFIXES):
+            return False
+
+        board_id, element_id = parse_board_path(message.get('path') or message.get('targetPath'))
+        if board_id is None:
+            return False
+        with self.__lock:
+            snapshot = self.__touch(board_id)
+            if snapshot is None:
+                return False
+
+            elements = snapshot['elements']
+            element = elements.get(element_id)
+            changes = ELEMENT_CHANGES.get(message_type, {})
+            if message_type in (ELEMENT_DELETED, ELEMENT_PERMANENTLY_DELETED):
+                if elements.pop(element_id, None) is None:
+                    return False
+            elif message_type == ELEMENT_ADDED and element is not None:
+                # Added by this process, see put_element
+                return False
+            elif element is not None and changes and all(field in message for field in changes.values()):
+                elements[element_id] = {**element, **{field: message[field_update]
+                                                      for field, field_update in changes.items()}}
+            else:
+                # Can't be applied in place, the elements are refetched on the next read
+                snapshot['elements'] = None
+            snapshot['version'] = next(self.__versions)
+            return True
+
+    def invalidate(self, board_id: Union[str, int]) -> bool:
+        """
+        Drops the board's snapshot, so the next read refetches it
+
+        :param board_id: Board's ID
+
+        :return: True if the board had a snapshot
+        """
+        key = str(board_id)
+        with self.__lock:
+            self.__touch(key)
+            return self.__snapshots.pop(key, None) is not None
+
+    def clear(self) -> None:
+        """
+        Drops all the snapshots, e.g. when live updates may have been missed
+        """
+        with self.__lock:
+            self.__forgotten_changed_at = time.monotonic()
+            self.__changed_at.clear()
+            self.__snapshots.clear()
+
+    def __to_data(self, snapshot: Dict, now: float) -> Dict:
+        """Returns the snapshot's parts which have not expired (the lock must be held)"""
+        board = snapshot['board'] if now - snapshot['board_fetched_at'] < self.__ttl else None
+        elements = None
+        if snapshot['elements'] is not None and now - snapshot['elements_fetched_at'] < self.__ttl:
+            elements = list(snapshot['elements'].values())
+        return {'board': board, 'elements': elements}
+
+    def __touch(self, key: str) -> Optional[Dict]:
+        """
+        Records a change of the board (the lock must be held)
+        :return: the board's snapshot if its elements are cached, otherwise None
+        """
+        self.__changed_at[key] = time.monotonic()
+        self.__changed_at.move_to_end(key)
+        while len(self.__changed_at) > self.__max_boards:
+            _, changed_at = self.__changed_at.popitem(last=False)
+            self.__forgotten_changed_at = max(self.__forgotten_changed_at, changed_at)
+
+        snapshot = self.__snapshots.get(key)
+        if snapshot is None or snapshot['elements'] is None:
+            return None
+        return snapshot
+
+    @staticmethod
+    def __get_element_id(element: Dict, index: int) -> Union[str, int]:
+        """Returns the raw element's ID, or its index (which can't be equal to an ID) if it has none"""
+        if element.get('id') is not None:
+            return str(element['id'])
+        links = element.get('_links') or [{}]
+        _, element_id = parse_board_path(links[0].get('href'))
+        return element_id if element_id is not None else index
+
+
+__cache = None
+__cache_lock = threading.Lock()
+
+
+def get_board_snapshot_cache() -> BoardSnapshotCache:
+    """Returns the process-wide cache of board snapshots"""
+    global __cache
+    with __cache_lock:
+        if __cache is None:
+            __cache = BoardSnapshotCache()
+    return __cache
@@ -0,0 +1,173 @@
+"""
+Outbox of board messages
+
+Messages put to a board are collected over a short window and posted by one sender per board,
+so their order within the board is kept, while different boards are posted to concurrently
+over the pooled connections of the asyncio transport. A failed post is requeued at the front
+of its board's queue and retried up to BOARD_OUTBOX_MAX_RETRIES times. If coalescing is enabled,
+consecutive messages are joined into one post up to BOARD_MESSAGE_MAX_LENGTH characters.
+The messages still queued on exit are flushed for up to BOARD_OUTBOX_EXIT_TIMEOUT seconds.
+
+Basic usage:
+    outbox = BoardOutbox()
+    posted = outbox.put(board, 'Hello')  # returns at once
+    outbox.flush()  # waits until everything put so far is posted
+    posted.result()  # True if the message was posted
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+from http import HTTPStatus
+from typing import Dict, List, Tuple
+
+from agents_platform.own_adapter.async_client import call_soon, run_sync
+from agents_platform.own_adapter.board import Board
+from agents_platform.own_adapter.constants import BOARD_OUTBOX_WINDOW, BOARD_OUTBOX_COALESCE, \
+    BOARD_OUTBOX_MAX_RETRIES, BOARD_OUTBOX_RETRY_DELAY, BOARD_OUTBOX_EXIT_TIMEOUT, BOARD_MESSAGE_MAX_LENGTH, \
+    BOARD_MESSAGES_SEPARATOR, OWN_ADAPTER_NAME
+from utils import logger
+
+# A queued message, the future of its result, and the number of times posting it has failed
+QueuedMessage = Tuple[str, concurrent.futures.Future, int]
+
+
+class BoardOutbox:
+    """
+    Per-board queues of messages, sent from the background event loop of the asyncio transport.
+    All the queues are only touched from that loop's thread
+    """
+
+    def __init__(self, window: float = BOARD_OUTBOX_WINDOW, coalesce: bool = BOARD_OUTBOX_COALESCE,
+                 max_message_length: int = BOARD_MESSAGE_MAX_LENGTH, max_retries: int = BOARD_OUTBOX_MAX_RETRIES,
+                 retry_delay: float = BOARD_OUTBOX_RETRY_DELAY):
+        """
+        :param window: Seconds to collect messages of a board before posting them
+        :param coalesce: Whether consecutive messages may be joined into one post
+        :param max_message_length: Maximum length of a coalesced post
+        :param max_retries: Number of times a failed post is retried before its messages are given up
+        :param retry_delay: Seconds to wait before the first retry of a board's post, doubled on every next one
+        """
+        self.__window = window
+        self.__coalesce = coalesce
+        self.__max_message_length = max_message_length
+        self.__max_retries = max_retries
+        self.__retry_delay = retry_delay
+
+        # board's URL -> (board, messages waiting to be posted)
+        self.__pending: Dict[str, Tuple[Board, List[QueuedMessage]]] = {}
+        # board's URL -> the task posting the board's messages
+        self.__senders: Dict[str, asyncio.Task] = {}
+
+        atexit.register(self.flush, BOARD_OUTBOX_EXIT_TIMEOUT)
+
+    def put(self, board: Board, message: str) -> concurrent.futures.Future:
+        """
+        Queues a message to be posted on the board's activity chat, without waiting for it
+
+        :param board: Board to post to
+        :param message: Text to post
+
+        :return: Future which result is True once the message is posted, or False if posting it failed
+                 after all the retries
+        """
+        posted = concurrent.futures.Future()
+        if not message:
+            posted.set_result(True)
+            return posted
+        call_soon(self.__enqueue, board, [(message, posted, 0)])
+        return posted
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until all the messages queued so far are posted or given up
+
+        :param timeout: Seconds to wait, None to wait forever
+
+        :return: False if the timeout has passed first
+        """
+        try:
+            run_sync(self.__wait_for_senders(), timeout)
+        except concurrent.futures.TimeoutError:
+            logger.warning(OWN_ADAPTER_NAME, f'Board messages are still queued after {timeout} seconds')
+            return False
+        return True
+
+    def __enqueue(self, board: Board, messages: List[QueuedMessage], front: bool = False) -> None:
+        """
+        Adds messages to the board's queue and starts the board's sender if it's not running
+        :param front: Whether to add them before the queued ones, as failed messages are to keep their order
+        """
+        key = board.get_url()
+        if key not in self.__pending:
+            self.__pending[key] = (board, [])
+        if front:
+            self.__pending[key][1][:0] = messages
+        else:
+            self.__pending[key][1].extend(messages)
+
+        if key not in self.__senders:
+            self.__senders[key] = asyncio.ensure_future(self.__send_board_messages(key))
+
+    async def __send_board_messages(self, key: str) -> None:
+        """Posts the board's messages in order, collecting each batch over the window"""
+        posts = []
+        delay = self.__window
+        try:
+            while key in self.__pending:
+                await asyncio.sleep(delay)
+                delay = self.__window
+                board, messages = self.__pending.pop(key)
+                posts = self.__compose_posts(messages)
+                while posts:
+                    post, queued = posts.pop(0)
+                    if await board.put_message_async(post) == HTTPStatus.CREATED:
+                        for _, future, _ in queued:
+                            future.set_result(True)
+                        continue
+
+                    retried = [(message, future, failures + 1) for message, future, failures in queued
+                               if failures < self.__max_retries]
+                    for _, future, failures in queued:
+                        if failures >= self.__max_retries:
+                            future.set_result(False)
+                    if len(retried) < len(queued):
+                        logger.error(OWN_ADAPTER_NAME, f'Gave up posting {len(queued) - len(retried)} messages '
+                                                       f'to the board {key} after {self.__max_retries} retries')
+                    if retried:
+                        # The rest waits for the retry, so the board's messages stay in order
+                        self.__enqueue(board, retried + [entry for _, rest in posts for entry in rest], front=True)
+                        posts = []
+                        delay = self.__retry_delay * 2 ** (max(failures for _, _, failures in retried) - 1)
+        except Exception as error:
+            logger.exception(OWN_ADAPTER_NAME, f'Couldn\'t post queued messages to the board {key}. {error}')
+            for _, queued in posts:
+                for _, future, _ in queued:
+                    future.set_result(False)
+        finally:
+            self.__senders.pop(key, None)
+            # Messages queued after a failure get a new sender
+            if key in self.__pending:
+                self.__senders[key] = asyncio.ensure_future(self.__send_board_messages(key))
+
+    def __compose_posts(self, messages: List[QueuedMessage]) -> List[Tuple[str, List[QueuedMessage]]]:
+        """
+        Joins consecutive messages into posts not longer than the limit (a longer message is posted alone)
+        :return: the posts with the messages they contain
+        """
+        if not self.__coalesce:
+            return [(entry[0], [entry]) for entry in messages]
+
+        posts = []
+        for entry in messages:
+            message = entry[0]
+            if posts and len(posts[-1][0]) + len(BOARD_MESSAGES_SEPARATOR) + len(message) <= self.__max_message_length:
+                posts[-1] = (posts[-1][0] + BOARD_MESSAGES_SEPARATOR + message, posts[-1][1] + [entry])
+            else:
+                posts.append((message, [entry]))
+        return posts
+
+    async def __wait_for_senders(self) -> None:
+        """Waits for the running senders, including the ones started meanwhile"""
+        while self.__senders:
+            await asyncio.gather(*self.__senders.values(), return_exceptions=True)
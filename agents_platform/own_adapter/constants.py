@@ -49,6 +49,23 @@ STATUS = {
     'INACTIVE': 2,
 }
 TOKEN_EXPIRE_DAYS = 29
+# Maximum number of boards requested at the same time while scanning all the agent's boards
+BOARDS_FETCH_CONCURRENCY = 10
+
+# Board outbox: messages to a board are collected over a window and posted in order
+BOARD_OUTBOX_WINDOW = float(os.environ.get('BOARD_OUTBOX_WINDOW', 0.2))  # in seconds
+BOARD_OUTBOX_COALESCE = os.environ.get('BOARD_OUTBOX_COALESCE', 'False') == 'True'
+BOARD_OUTBOX_MAX_RETRIES = int(os.environ.get('BOARD_OUTBOX_MAX_RETRIES', 3))  # retries of a failed post
+BOARD_OUTBOX_RETRY_DELAY = float(os.environ.get('BOARD_OUTBOX_RETRY_DELAY', 1))  # in seconds, doubled every retry
+BOARD_OUTBOX_EXIT_TIMEOUT = float(os.environ.get('BOARD_OUTBOX_EXIT_TIMEOUT', 10))  # in seconds
+BOARD_MESSAGE_MAX_LENGTH = int(os.environ.get('BOARD_MESSAGE_MAX_LENGTH', 4000))  # coalesced message length limit
+BOARD_MESSAGES_SEPARATOR = '\n\n'
+
+# Board snapshots: boards' elements and sizes cached by the process, kept up to date by the live updates
+BOARD_SNAPSHOT_TTL = float(os.environ.get('BOARD_SNAPSHOT_TTL', 60))  # in seconds, 0 disables the cache
+BOARD_SNAPSHOT_CACHE_SIZE = int(os.environ.get('BOARD_SNAPSHOT_CACHE_SIZE', 256))  # boards
+# Seconds an element's known position and size are used for before the element is requested again
+ELEMENT_GEOMETRY_TTL = float(os.environ.get('ELEMENT_GEOMETRY_TTL', 60))
 
 # Element types
 ELEM_TYPE_HTML_REFERENCE = 'application/vnd.uberblik.htmlReference'
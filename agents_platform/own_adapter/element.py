@@ -4,14 +4,15 @@ Contains both data and logic
 """
 
 import json
+import time
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional, Union
 from urllib import parse
 
 import requests
-from requests import request, post, HTTPError
+from requests import HTTPError
 
-from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME, PREFIX, AdapterStatus
+from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME, PREFIX, ELEMENT_GEOMETRY_TTL, AdapterStatus
 from agents_platform.own_adapter.file import File
 from agents_platform.own_adapter.platform_access import PlatformAccess
 from agents_platform.util.networking import make_request, compose_path
@@ -37,7 +38,7 @@ class Element:
                  name: str = '', identifier: str = '', board: 'Board' = None,
                  pos_x: int = None, pos_y: int = None, size_x: int = None, size_y: int = None,
                  last_processing_time: datetime = DEFAULT_PROCESSING_DATETIME,
-                 agent_task_id: int = None, agent_data_id: int = None):
+                 agent_task_id: int = None, agent_data_id: int = None, geometry_time: float = None):
         """
         :param platform_access: PlatformAccess of a user
                                 who has access rights to it [board, i.e., boards]
@@ -52,6 +53,8 @@ class Element:
         :param agent_task_id: AgentTask's ID that is assigned to the element (if some)
         :param agent_data_id: AgentData's ID of an agent that is assigned to the element
                               (if there is some)
+        :param geometry_time: Time (since the epoch) the given position and size were received from the platform,
+                              now if None
         """
         self.__platform_access = platform_access
         self.__name = name
@@ -66,10 +69,14 @@ class Element:
         self.__pos_y = pos_y
         self.__size_x = size_x
         self.__size_y = size_y
+        self.__geometry_time = time.time() if geometry_time is None else geometry_time
 
         self.__agent_task_id = agent_task_id
         self.__agent_data_id = agent_data_id
 
+        # The element's response body, requested at most once per refresh()
+        self.__snapshot = None
+
     def get_agent_data_id(self) -> Optional[int]:
         """Returns this element's agent data ID if it was given [in ctor]"""
         # TODO: Request it from a platform instead
@@ -135,10 +142,12 @@ class Element:
         """Returns element's board if it was given (in ctor)"""
         return self.__board
 
-    def _get_elem_response(self) -> Optional[Dict]:
+    def _get_elem_response(self, refresh: bool = False) -> Optional[Dict]:
         """
-        Returns response body for the element
+        Returns response body for the element.
+        The body is requested once and kept as the element's snapshot until refresh() is called
 
+        :param refresh: Request the element again even if a snapshot is kept
         :return: The dictionary with the following fields:
       "sizeX": {int},
       "sizeY": {int},
@@ -171,6 +180,9 @@ class Element:
         }
       ]
         """
+        if self.__snapshot is not None and not refresh:
+            return self.__snapshot
+
         # Prepare request data
         http_method = 'GET'
         detail = 'element'
@@ -178,7 +190,7 @@ class Element:
         values = {}
         headers = self.__platform_access.get_headers(http_method, url, values, detail)
         try:
-            response = request(method=http_method, url=url, headers=headers)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
             response.raise_for_status()
             response_data = response.json()
         except HTTPError as error:
@@ -187,22 +199,51 @@ class Element:
             return None
 
         if response_data:
-            return response_data['element']
+            self.__apply_snapshot(response_data['element'])
+            return self.__snapshot
         return None
 
+    def refresh(self) -> bool:
+        """
+        Requests the element's remote state once and updates its caption, position and size from it
+
+        :return: True if the element's state was received, otherwise False
+        """
+        return self._get_elem_response(refresh=True) is not None
+
+    def __apply_snapshot(self, elem_response: Dict) -> None:
+        """Keeps the element's response body and takes the caption and geometry from it"""
+        self.__snapshot = elem_response
+        self.__name = elem_response.get('caption') or self.__name
+        self.__pos_x = elem_response.get('posX', self.__pos_x)
+        self.__pos_y = elem_response.get('posY', self.__pos_y)
+        self.__size_x = elem_response.get('sizeX', self.__size_x)
+        self.__size_y = elem_response.get('sizeY', self.__size_y)
+        self.__geometry_time = time.time()
+
+    def __has_geometry(self) -> bool:
+        """
+        Checks whether the element's position and size are known without a request,
+        and were received recently enough to still hold for an element which may be moved on the platform
+        """
+        return None not in (self.__pos_x, self.__pos_y, self.__size_x, self.__size_y) \
+            and time.time() - self.__geometry_time < ELEMENT_GEOMETRY_TTL
+
     def get_position(self) -> Tuple[int, int]:
         """Returns the element's position on the board"""
-        # Since response returns elements starting from 1, decrement them (BOARD_SHIFT==1)
-        response_body = self._get_elem_response()
-        x = int(response_body['posX']) - BOARD_SHIFT
-        y = int(response_body['posY']) - BOARD_SHIFT
+        if not self.__has_geometry():
+            self._get_elem_response(refresh=True)
+        # Since the platform counts positions starting from 1, decrement them (BOARD_SHIFT==1)
+        x = int(self.__pos_x) - BOARD_SHIFT
+        y = int(self.__pos_y) - BOARD_SHIFT
         return x, y
 
     def get_size(self) -> Tuple[int, int]:
         """Returns the element's size on the board"""
-        response_body = self._get_elem_response()
-        size_x = int(response_body['sizeX'])
-        size_y = int(response_body['sizeY'])
+        if not self.__has_geometry():
+            self._get_elem_response(refresh=True)
+        size_x = int(self.__size_x)
+        size_y = int(self.__size_y)
         return size_x, size_y
 
     def get_last_processing_time(self) -> datetime:
@@ -233,7 +274,8 @@ class Element:
             'size_x': sizes[0],
             'size_y': sizes[1],
             'agent_data_id': self.get_agent_data_id(),
-            'agent_task_id': self.get_agent_task_id()
+            'agent_task_id': self.get_agent_task_id(),
+            'geometry_time': self.__geometry_time
         }
         return element_data
 
@@ -255,8 +297,21 @@ class Element:
             if not str_last_processing_time \
             else datetime.strptime(str_last_processing_time, DEFAULT_PROCESSING_DATETIME_FORMAT)
 
+        # Keep the serialized geometry until it expires, so the element is not requested again for it meanwhile.
+        # Dictionaries without the geometry's time predate its expiry, so their geometry is requested again
+        geometry = {}
+        if all(element_dict.get(key) not in (None, '')
+               for key in ('pos_x', 'pos_y', 'size_x', 'size_y', 'geometry_time')):
+            geometry = {
+                'pos_x': int(element_dict['pos_x']) + BOARD_SHIFT,
+                'pos_y': int(element_dict['pos_y']) + BOARD_SHIFT,
+                'size_x': int(element_dict['size_x']),
+                'size_y': int(element_dict['size_y']),
+                'geometry_time': float(element_dict['geometry_time'])
+            }
+
         element = Element(platform_access, name, element_id,
-                          last_processing_time=last_processing_time, board=board)
+                          last_processing_time=last_processing_time, board=board, **geometry)
         return element
 
     def get_files(self) -> List[File]:
@@ -270,7 +325,7 @@ class Element:
         values = {}
         try:
             headers = self.__platform_access.get_headers(http_method, url, values, detail)
-            response = request(method=http_method, url=url, headers=headers)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
             response_data = response.json()
         except HTTPError as error:
             logger.exception(OWN_ADAPTER_NAME, f'Couldn\'t get the element\'s files: {error}')
@@ -314,43 +369,56 @@ class Element:
             return None
 
         link_url = parse.quote(link.get_url(), safe='%/:=&?~#+!$,;\'@()*[]')
-        title = link.get_title()
-        description = link.get_description()
         response = None
 
         try:
-            http_method = 'POST'
-            detail = 'htmlReference'
-            url = self.__url + '/files'
-            additional_headers = {'Content-Type': 'application/json; charset=UTF-8'}
-            payload = json.dumps({
-                'htmlReference': {
-                    'url': link_url,
-                    'defaultImageUrl': image_url,
-                    'title': title,
-                    'summary': description,
-                    'scrapeImagesFromUrl': scrape_images_from_url
-                }
-            }, separators=(',', ':'), ensure_ascii=False)
-            values = {}
-            headers = self.__platform_access.get_headers(http_method, url, values, detail,
-                                                         payload=payload,
-                                                         additional_headers=additional_headers)
+            url, headers, payload = self.__compose_link_request(link, link_url, image_url, scrape_images_from_url)
+            response = self.__platform_access.request('POST', url, headers=headers, data=payload.encode())
+            return self.__parse_link_response(response, url, return_url)
+        except HTTPError as http_error:
+            logger.exception(OWN_ADAPTER_NAME, f'Error: put link {link_url} to {self.get_name()} failed. '
+                                               f'Error type: {http_error}', response)
+            return response.status_code
+        except ConnectionError as connect_error:
+            logger.exception(OWN_ADAPTER_NAME,
+                             f'Connection-Error: put link {link_url} to {self.get_name()} failed: '
+                             f'{connect_error}', response)
+            return None
+        except Exception as error:
+            logger.exception(OWN_ADAPTER_NAME, f'Error: put link {link_url} to {self.get_name()} failed. '
+                                               f'Error type: {error}')
+            return None
 
-            response = post(url, headers=headers, data=payload.encode())
-            response_status = response.status_code
-            response.raise_for_status()
+    async def put_link_async(self, link: Link,
+                             image_url: str = DEFAULT_IMAGE_URL,
+                             return_url: bool = False,
+                             scrape_images_from_url: bool = True) -> Union[int, Tuple[int, str], None]:
+        """
+        Asyncio version of put_link
 
-            response_url = response.json().get('htmlReference').get('_links')[0].get('href')
-            full_url = url + '/' + response_url.split('/')[-1]
-            if return_url:
-                return response_status, full_url
-            return response_status
+        :param link: Link-object to put in this element
+        :param image_url: Link's image URL
+        :param return_url: Either return the link's address (URL) or not
+        :param scrape_images_from_url: if True, image will be taken from link, else from image_url
+
+        :return: Same as put_link
+        """
+        if not link:
+            return None
+
+        link_url = parse.quote(link.get_url(), safe='%/:=&?~#+!$,;\'@()*[]')
+        response = None
+
+        try:
+            url, headers, payload = self.__compose_link_request(link, link_url, image_url, scrape_images_from_url)
+            response = await self.__platform_access.get_async_client().request('POST', url, headers=headers,
+                                                                               data=payload.encode())
+            return self.__parse_link_response(response, url, return_url)
         except HTTPError as http_error:
             logger.exception(OWN_ADAPTER_NAME, f'Error: put link {link_url} to {self.get_name()} failed. '
                                                f'Error type: {http_error}', response)
             return response.status_code
-        except ConnectionError as connect_error:
+        except requests.ConnectionError as connect_error:
             logger.exception(OWN_ADAPTER_NAME,
                              f'Connection-Error: put link {link_url} to {self.get_name()} failed: '
                              f'{connect_error}', response)
@@ -360,6 +428,48 @@ class Element:
                                                f'Error type: {error}')
             return None
 
+    def __compose_link_request(self, link: Link, link_url: str, image_url: str,
+                               scrape_images_from_url: bool) -> Tuple[str, Dict, str]:
+        """
+        Composes URL, headers and payload to put a link to this element
+
+        :return: (url, headers, payload)
+        """
+        http_method = 'POST'
+        detail = 'htmlReference'
+        url = self.__url + '/files'
+        additional_headers = {'Content-Type': 'application/json; charset=UTF-8'}
+        payload = json.dumps({
+            'htmlReference': {
+                'url': link_url,
+                'defaultImageUrl': image_url,
+                'title': link.get_title(),
+                'summary': link.get_description(),
+                'scrapeImagesFromUrl': scrape_images_from_url
+            }
+        }, separators=(',', ':'), ensure_ascii=False)
+        values = {}
+        headers = self.__platform_access.get_headers(http_method, url, values, detail,
+                                                     payload=payload,
+                                                     additional_headers=additional_headers)
+        return url, headers, payload
+
+    @staticmethod
+    def __parse_link_response(response, url: str, return_url: bool) -> Union[int, Tuple[int, str]]:
+        """
+        Checks put_link's response
+
+        :return: Response code, and the link's URL if return_url is set
+        """
+        response_status = response.status_code
+        response.raise_for_status()
+
+        response_url = response.json().get('htmlReference').get('_links')[0].get('href')
+        full_url = url + '/' + response_url.split('/')[-1]
+        if return_url:
+            return response_status, full_url
+        return response_status
+
     def put_file(self, file_name: str, file_bytes: Union[bytearray, str],
                  get_file: bool = False) -> Union[int, File, None]:
         """
@@ -381,33 +491,47 @@ class Element:
         # https://stackoverflow.com/questions/4007969/application-x-www-form-urlencoded-or-multipart-form-data
         # to dump raw requests/responses you can use http://toolbelt.readthedocs.io/en/latest/dumputils.html
         response = None
-        http_method = 'POST'
-        detail = 'fileCreationResponse'
-        url = self.__url + '/files'
-        additional_headers = {}
-        payload = ''
-        values = {}
 
         try:
-            headers = self.__platform_access.get_headers(http_method, url, values, detail, payload=payload,
-                                                         additional_headers=additional_headers)
-            response = post(url, headers=headers, files={file_name: (file_name, file_bytes)})
-            response.raise_for_status()
+            url, headers = self.__compose_file_request()
+            response = self.__platform_access.request('POST', url, headers=headers,
+                                                      files={file_name: (file_name, file_bytes)})
+            return self.__parse_file_response(response, file_name, get_file)
 
-            if get_file:
-                r_json = response.json()
-                if 'href' in r_json['fileCreationResponse']['_links'][0]:
-                    ref = r_json['fileCreationResponse']['_links'][0]['href']
-                    file_id = ref.split('/')[-1]
-                    file = File(platform_access=self.__platform_access,
-                                identifier=file_id,
-                                name=file_name,
-                                file_type=r_json['fileCreationResponse']['fileType'],
-                                element=self)
-                    return file
-                # FIXME: Why don't we return status_code from the previous request?..
-                return None
-            return response.status_code
+        except requests.ConnectionError as connection_error:
+            logger.warning(OWN_ADAPTER_NAME,
+                           f'Warning: put file {file_name} to {self.get_name()} took too long.'
+                           f' Probably because file was too large. Error type: {connection_error}', response)
+            return AdapterStatus.CONNECTION_ABORTED
+        except HTTPError as error:
+            logger.exception(OWN_ADAPTER_NAME,
+                             f'Error: put file {file_name} to {self.get_name()} failed. '
+                             f'Error type: {error}', response)
+            return None if get_file else response.status_code
+        except Exception as error:
+            logger.exception(OWN_ADAPTER_NAME,
+                             f'Error: put file {file_name} to {self.get_name()} failed.'
+                             f'Error type: {error}')
+            return None
+
+    async def put_file_async(self, file_name: str, file_bytes: Union[bytearray, str],
+                             get_file: bool = False) -> Union[int, File, None]:
+        """
+        Asyncio version of put_file
+
+        :param file_name: file title to save as
+        :param file_bytes: File's bytes, or text to put
+        :param get_file: should a File for the uploaded file returned?
+
+        :return: Same as put_file
+        """
+        response = None
+
+        try:
+            url, headers = self.__compose_file_request()
+            response = await self.__platform_access.get_async_client().request(
+                'POST', url, headers=headers, files={file_name: (file_name, file_bytes)})
+            return self.__parse_file_response(response, file_name, get_file)
 
         except requests.ConnectionError as connection_error:
             logger.warning(OWN_ADAPTER_NAME,
@@ -425,6 +549,45 @@ class Element:
                              f'Error type: {error}')
             return None
 
+    def __compose_file_request(self) -> Tuple[str, Dict]:
+        """
+        Composes URL and headers to upload a multipart file to this element
+
+        :return: (url, headers)
+        """
+        http_method = 'POST'
+        detail = 'fileCreationResponse'
+        url = self.__url + '/files'
+        additional_headers = {}
+        payload = ''
+        values = {}
+        headers = self.__platform_access.get_headers(http_method, url, values, detail, payload=payload,
+                                                     additional_headers=additional_headers)
+        return url, headers
+
+    def __parse_file_response(self, response, file_name: str, get_file: bool) -> Union[int, File, None]:
+        """
+        Checks put_file's response
+
+        :return: File if get_file is set (None if the response has no file reference), status code otherwise
+        """
+        response.raise_for_status()
+
+        if get_file:
+            r_json = response.json()
+            if 'href' in r_json['fileCreationResponse']['_links'][0]:
+                ref = r_json['fileCreationResponse']['_links'][0]['href']
+                file_id = ref.split('/')[-1]
+                file = File(platform_access=self.__platform_access,
+                            identifier=file_id,
+                            name=file_name,
+                            file_type=r_json['fileCreationResponse']['fileType'],
+                            element=self)
+                return file
+            # FIXME: Why don't we return status_code from the previous request?..
+            return None
+        return response.status_code
+
     def put_chart(self, title: str, chart_type: str, data: Dict, get_file: bool = False) -> Union[int, File, None]:
         """
         Puts a chart to the element
@@ -441,38 +604,41 @@ class Element:
         """
         response = None
         try:
-            http_method = 'POST'
-            detail = 'chart'
-            url = self.__url + '/files'
-            additional_headers = {'Content-Type': 'application/json; charset=UTF-8'}
-            payload = json.dumps({
-                'chart': {
-                    'title': title,
-                    'type': chart_type,
-                    'data': data,
-                }
-            }, separators=(',', ':'), ensure_ascii=False)
-            for line in data['series']:
-                if len(line['data']) < 2:
-                    logger.warning(OWN_ADAPTER_NAME, f'Error: put chart {title} to {self.get_name()} failed. '
-                                                     f'Error type: data {line["name"]} has less than 2 points')
-                    return -1
+            if not self.__check_chart_data(title, data):
+                return -1
 
-            values = {}
-            headers = self.__platform_access.get_headers(http_method, url, values, detail, payload=payload,
-                                                         additional_headers=additional_headers)
+            url, headers, payload = self.__compose_chart_request(title, chart_type, data)
+            response = self.__platform_access.request('POST', url, headers=headers, data=payload.encode())
+            return self.__parse_chart_response(response, get_file)
+        except requests.HTTPError as error:
+            logger.exception(OWN_ADAPTER_NAME, f'Error: put chart {title} to {self.get_name()} failed. '
+                                               f'Error type: {error}', response)
+            return response.status_code
+        except Exception as error:
+            logger.exception(OWN_ADAPTER_NAME, f'Error: put chart {title} to {self.get_name()} failed. '
+                                               f'Error type: {error}', response or None)
+            return None
 
-            response = post(url, headers=headers, data=payload.encode())
-            response.raise_for_status()
-            response_status = response.status_code
-            if get_file:
-                r_json = response.json()
-                chart = r_json.get('chart', {})
-                file_id = chart.get('fileId', 0)
-                file = File(platform_access=self.__platform_access, identifier=str(file_id), element=self)
-                return file
-            else:
-                return response_status
+    async def put_chart_async(self, title: str, chart_type: str, data: Dict,
+                              get_file: bool = False) -> Union[int, File, None]:
+        """
+        Asyncio version of put_chart
+
+        :param title: a title of the chart
+        :param chart_type: a type of the chart
+        :param data: data to show in the chart
+
+        :return: Same as put_chart
+        """
+        response = None
+        try:
+            if not self.__check_chart_data(title, data):
+                return -1
+
+            url, headers, payload = self.__compose_chart_request(title, chart_type, data)
+            response = await self.__platform_access.get_async_client().request('POST', url, headers=headers,
+                                                                               data=payload.encode())
+            return self.__parse_chart_response(response, get_file)
         except requests.HTTPError as error:
             logger.exception(OWN_ADAPTER_NAME, f'Error: put chart {title} to {self.get_name()} failed. '
                                                f'Error type: {error}', response)
@@ -482,6 +648,53 @@ class Element:
                                                f'Error type: {error}', response or None)
             return None
 
+    def __check_chart_data(self, title: str, data: Dict) -> bool:
+        """Checks that every chart's line has at least 2 points"""
+        for line in data['series']:
+            if len(line['data']) < 2:
+                logger.warning(OWN_ADAPTER_NAME, f'Error: put chart {title} to {self.get_name()} failed. '
+                                                 f'Error type: data {line["name"]} has less than 2 points')
+                return False
+        return True
+
+    def __compose_chart_request(self, title: str, chart_type: str, data: Dict) -> Tuple[str, Dict, str]:
+        """
+        Composes URL, headers and payload to put a chart to this element
+
+        :return: (url, headers, payload)
+        """
+        http_method = 'POST'
+        detail = 'chart'
+        url = self.__url + '/files'
+        additional_headers = {'Content-Type': 'application/json; charset=UTF-8'}
+        payload = json.dumps({
+            'chart': {
+                'title': title,
+                'type': chart_type,
+                'data': data,
+            }
+        }, separators=(',', ':'), ensure_ascii=False)
+        values = {}
+        headers = self.__platform_access.get_headers(http_method, url, values, detail, payload=payload,
+                                                     additional_headers=additional_headers)
+        return url, headers, payload
+
+    def __parse_chart_response(self, response, get_file: bool) -> Union[int, File]:
+        """
+        Checks put_chart's response
+
+        :return: File of the chart if get_file is set, status code otherwise
+        """
+        response.raise_for_status()
+        response_status = response.status_code
+        if get_file:
+            r_json = response.json()
+            chart = r_json.get('chart', {})
+            file_id = chart.get('fileId', 0)
+            file = File(platform_access=self.__platform_access, identifier=str(file_id), element=self)
+            return file
+        return response_status
+
     def update_chart(self, title: str, chart_type: str, file_id: str, data: Dict) -> Optional[int]:
         """
         Updates existing chart in element by adding new data
@@ -511,7 +724,7 @@ class Element:
             values = {}
             headers = self.__platform_access.get_headers(http_method, url, values, detail)
 
-            response = request(method=http_method, url=url, headers=headers)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
             response_status = response.status_code
 
             logger.debug(OWN_ADAPTER_NAME, response_status)
@@ -566,7 +779,7 @@ class Element:
 
         values = {}
         headers = platform_access.get_headers(http_method, url, values, detail)
-        response = request(method=http_method, url=url, headers=headers)
+        response = platform_access.request(method=http_method, url=url, headers=headers)
         response.raise_for_status()
         response_data = response.json()
 
@@ -574,4 +787,5 @@ class Element:
         name = response_data['element']['caption']
 
         element = Element(platform_access, name, href, board)
+        element.__apply_snapshot(response_data['element'])
         return element
@@ -1,18 +1,15 @@
 """
 Basic functionality to work with back-end's File
 * put_comment
-* get_download_link
+* get_download_link (and its asyncio version)
 """
 
 import json
 import sys
 from http import HTTPStatus
-from typing import Optional, Dict, Union
-from urllib import request
-
+from typing import Optional, Dict, Union, Tuple
 import requests
 from deprecation import deprecated
-from requests import request
 
 from agents_platform.own_adapter.chart_formatter import format_chart_data
 from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME, TYPE_KEY, LINE_CHART_TYPE, BAR_CHART_TYPE, \
@@ -81,19 +78,38 @@ class File:
         if self.__type == 'application/vnd.uberblik.htmlReference':
             return None
         http_method = 'POST'
-        detail = 'downloadLink'
-        # FIXME: Change to the utility function of urljoin from Andrew
-        url = f'{self.__url}/downloadLink'
-        values = {}
+        url, headers = self.__compose_download_link_request()
+        if not headers:
+            return None
+
         try:
-            headers = self.__platform_access.get_headers(http_method, url, values, detail)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
+            response_data = response.json()
+            download_link = response_data['downloadLink']['url']
+            return download_link
+        except KeyError as key_error:
+            logger.exception(OWN_ADAPTER_NAME,
+                             f'Key was not found in response\'s data for file\'s download URL: {key_error}')
         except Exception as error:
             logger.exception(OWN_ADAPTER_NAME,
                              f'Error occurred while retrieving file\'s download URL: {error}')
             return None
 
+    async def get_download_link_async(self) -> Optional[str]:
+        """
+        Asyncio version of get_download_link
+        :return: Download URL if request was successful, otherwise None
+        """
+        # there is no download link to files with type "htmlReference"
+        if self.__type == 'application/vnd.uberblik.htmlReference':
+            return None
+        http_method = 'POST'
+        url, headers = self.__compose_download_link_request()
+        if not headers:
+            return None
+
         try:
-            response = request(method=http_method, url=url, headers=headers)
+            response = await self.__platform_access.get_async_client().request(http_method, url, headers=headers)
             response_data = response.json()
             download_link = response_data['downloadLink']['url']
             return download_link
@@ -105,6 +121,24 @@ class File:
                              f'Error occurred while retrieving file\'s download URL: {error}')
             return None
 
+    def __compose_download_link_request(self) -> Tuple[str, Optional[Dict]]:
+        """
+        Composes URL and headers to retrieve a download link
+        :return: (url, headers), headers are None if they couldn't be generated
+        """
+        http_method = 'POST'
+        detail = 'downloadLink'
+        # FIXME: Change to the utility function of urljoin from Andrew
+        url = f'{self.__url}/downloadLink'
+        values = {}
+        try:
+            headers = self.__platform_access.get_headers(http_method, url, values, detail)
+        except Exception as error:
+            logger.exception(OWN_ADAPTER_NAME,
+                             f'Error occurred while retrieving file\'s download URL: {error}')
+            return url, None
+        return url, headers
+
     @deprecated(details='Use Element.remove_file(file_url) instead')
     def remove(self) -> Optional[int]:
         """
@@ -124,7 +158,7 @@ class File:
 
         response = None
         try:
-            response = request(method=http_method, url=url, headers=headers)
+            response = self.__platform_access.request(method=http_method, url=url, headers=headers)
             response_code = response.status_code
             response.raise_for_status()
         except Exception as error:
@@ -157,7 +191,7 @@ class File:
             headers = self.__platform_access.get_headers(http_method, url, values, detail, payload=payload,
                                                          additional_headers=additional_headers)
 
-            response = requests.post(url=url, headers=headers, data=payload.encode())
+            response = self.__platform_access.request('POST', url=url, headers=headers, data=payload.encode())
             response_status = response.status_code
             response.raise_for_status()
             return response_status
@@ -196,7 +230,7 @@ class File:
                 }
                 headers = self.__platform_access.get_headers(http_method, self.get_url(), values, detail,
                                                              additional_headers=additional_headers)
-                response = requests.get(self.get_url(), headers=headers)
+                response = self.__platform_access.request('GET', self.get_url(), headers=headers)
                 response.raise_for_status()
 
                 file_dict = json.loads(response.content)
@@ -230,7 +264,7 @@ class File:
                 values = {}
                 headers = self.__platform_access.get_headers(http_method, self.get_url(), values, detail,
                                                              additional_headers=additional_headers)
-                response = requests.get(self.get_url(), headers=headers)
+                response = self.__platform_access.request('GET', self.get_url(), headers=headers)
                 response.raise_for_status()
 
                 result = json.loads(response.content)
@@ -383,7 +417,7 @@ class File:
             headers = self.__platform_access.get_headers(http_method, url, values, detail, payload=payload,
                                                          additional_headers=additional_headers)
 
-            response = requests.patch(url, headers=headers, data=payload.encode())
+            response = self.__platform_access.request('PATCH', url, headers=headers, data=payload.encode())
             response_status = response.status_code
             response.raise_for_status()
             return response_status
@@ -420,7 +454,7 @@ class File:
             headers = self.__platform_access.get_headers(http_method, url, values, detail, payload=payload,
                                                          additional_headers={})
 
-            response = requests.patch(url, headers=headers, data=payload)
+            response = self.__platform_access.request('PATCH', url, headers=headers, data=payload)
             response_status = response.status_code
             response.raise_for_status()
 
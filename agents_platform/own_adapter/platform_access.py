@@ -3,16 +3,22 @@ This module's responsible for accessing the back-end's platform
 Basically, access tokens, and headers generation
 """
 
+import asyncio
 import base64
 import datetime
 import os
 import sys
+import threading
 from typing import Dict
+from weakref import WeakKeyDictionary
 
-from requests import request
+from requests import Response, Session
 
+from agents_platform.own_adapter.async_client import AsyncClient
 from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME, PREFIX, TOKEN_EXPIRE_DAYS
 from utils import logger
+from utils.constants import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE
+from utils.http_session import create_pooled_session
 
 
 class PlatformAccess:
@@ -22,7 +28,10 @@ class PlatformAccess:
 
     Basic usage:
     platform_access = PlatformAccess(agent_login, agent_password)
+    response = platform_access.request('GET', url, headers=headers)
 
+    Every request made through the same PlatformAccess shares one keep-alive session,
+    so consecutive back-end calls don't pay a new TCP/TLS handshake each
     """
     __platform_url = ''
     __access_token = ''
@@ -31,15 +40,24 @@ class PlatformAccess:
     __password = ''
     __user_id = ''
 
-    def __init__(self, login: str, password: str):
+    def __init__(self, login: str, password: str,
+                 pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE):
         """
         :param login: User's login
         :param password: User's password
+        :param pool_connections: Number of hosts to keep a connection pool for
+        :param pool_maxsize: Maximum number of keep-alive connections per host
         Note that Agent is a User with AgentData "assigned" to it
         """
         self.__login = login
         self.__password = password
         self.__token_creation_time = None
+        self.__pool_connections = pool_connections
+        self.__pool_maxsize = pool_maxsize
+        self.__session = None
+        self.__session_lock = threading.Lock()
+        self.__async_clients = WeakKeyDictionary()  # event loop -> AsyncClient
         self.__access_token_request()
 
     def get_access_token(self) -> str:
@@ -58,6 +76,48 @@ class PlatformAccess:
         """Returns User's ID"""
         return str(self.__user_id)
 
+    def get_session(self) -> Session:
+        """Returns the keep-alive session shared by all the requests of this user (created on first use)"""
+        if self.__session is None:
+            with self.__session_lock:
+                if self.__session is None:
+                    self.__session = create_pooled_session(pool_connections=self.__pool_connections,
+                                                           pool_maxsize=self.__pool_maxsize)
+        return self.__session
+
+    def request(self, method: str, url: str, **kwargs) -> Response:
+        """
+        Makes an HTTP request through the pooled session
+
+        :param method: {GET|POST|PUT|PATCH|DELETE}
+        :param url: Full URL of the request
+        :param kwargs: Any other requests.request parameter (headers, data, files, params, timeout...)
+
+        :return: requests.Response
+        """
+        return self.get_session().request(method=method, url=url, **kwargs)
+
+    def get_async_client(self) -> AsyncClient:
+        """
+        Returns the asyncio client of this user for the running event loop
+        (aiohttp sessions can't be shared between loops, so each loop gets its own pool)
+        """
+        loop = asyncio.get_event_loop()
+        with self.__session_lock:
+            client = self.__async_clients.get(loop)
+            if client is None:
+                client = AsyncClient(pool_connections=self.__pool_connections,
+                                     pool_maxsize=self.__pool_maxsize)
+                self.__async_clients[loop] = client
+        return client
+
+    def close(self) -> None:
+        """Closes all the pooled connections; a new session is created on the next request"""
+        with self.__session_lock:
+            if self.__session is not None:
+                self.__session.close()
+                self.__session = None
+
     def get_headers(self, method: str, url: str, values,
                     detail: str, environment: str = 'development',
                     payload: str = '', additional_headers: Dict = None) -> Dict:
@@ -126,9 +186,9 @@ class PlatformAccess:
         }
 
         try:
-            token_response = request(url=f'{address}/{url_postfix}',
-                                     method=http_method,
-                                     data=values, headers=headers)
+            token_response = self.request(url=f'{address}/{url_postfix}',
+                                          method=http_method,
+                                          data=values, headers=headers)
             token_response.raise_for_status()
         except Exception as error:
             logger.exception(OWN_ADAPTER_NAME,
@@ -1,23 +1,94 @@
+"""
+Process-wide Redis connection pool
+
+All the clients returned by get_redis_connection() share one pool, so a connection is only opened
+when every pooled one is busy. Beyond REDIS_MAX_CONNECTIONS, callers wait up to REDIS_POOL_TIMEOUT seconds
+for a connection to be freed. The server is PINGed lazily: at most once per REDIS_HEALTH_CHECK_INTERVAL
+seconds, and again right after a failure.
+"""
 import os
+import threading
+import time
 
 import redis
 
 from utils import logger
 
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_HEALTH_CHECK_INTERVAL = float(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))  # in seconds
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 10))  # in seconds
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 20))  # in seconds, to wait for a free connection
 
-def get_redis_connection():
-    try:
-        address = os.environ['REDIS_ADDRESS']
-        port = os.environ['REDIS_PORT']
-    except KeyError as e:
-        logger.exception('engine',
-                         'REDIS_ADDRESS or REDIS_PORT variable is undefined. Error message: {}'.format(str(e)))
-        raise Exception('Could not connect to Redis. Needed environment variables are not set.')
+__pool = None
+__pool_lock = threading.Lock()
+__last_health_check = 0.0
 
-    try:
-        connection = redis.StrictRedis(host=address, port=port, db=0, decode_responses=True)
-        response = connection.client_list()  # execute query to check if redis is connected
-    except Exception as e:
-        logger.exception('engine', 'Could not connect to Redis. Exception message: {}'.format(str(e)))
-        raise Exception('Could not connect to Redis. Please check logs.')
+
+def get_redis_connection() -> redis.StrictRedis:
+    """
+    Returns a Redis client backed by the process-wide connection pool
+    :return: StrictRedis with decode_responses=True
+    """
+    connection = redis.StrictRedis(connection_pool=__get_pool())
+    __check_health(connection)
     return connection
+
+
+def reset_redis_pool() -> None:
+    """
+    Swaps the pool for a new one: the next get_redis_connection() reconnects and checks the server.
+    The old pool isn't disconnected, as other threads may be running commands on its connections;
+    it drains as the clients using it finish, and its connections are closed once it's garbage collected
+    :return: Nothing
+    """
+    global __pool, __last_health_check
+    with __pool_lock:
+        __pool = None
+        __last_health_check = 0.0
+
+
+def __get_pool() -> redis.BlockingConnectionPool:
+    """Returns the process-wide pool, creating it on first use"""
+    global __pool
+    if __pool is None:
+        with __pool_lock:
+            if __pool is None:
+                try:
+                    address = os.environ['REDIS_ADDRESS']
+                    port = os.environ['REDIS_PORT']
+                except KeyError as e:
+                    logger.exception('engine',
+                                     'REDIS_ADDRESS or REDIS_PORT variable is undefined. Error message: {}'
+                                     .format(str(e)))
+                    raise Exception('Could not connect to Redis. Needed environment variables are not set.')
+
+                # Blocking, so threads wait for a free connection instead of failing with 'Too many connections'
+                __pool = redis.BlockingConnectionPool(host=address, port=port, db=0, decode_responses=True,
+                                                      max_connections=REDIS_MAX_CONNECTIONS,
+                                                      timeout=REDIS_POOL_TIMEOUT,
+                                                      socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                                      retry_on_timeout=True)
+    return __pool
+
+
+def __check_health(connection: redis.StrictRedis) -> None:
+    """
+    PINGs the server if the last successful check is older than REDIS_HEALTH_CHECK_INTERVAL.
+    On failure the pool is reset and the check is retried once on fresh connections
+    """
+    global __last_health_check
+    if time.monotonic() - __last_health_check < REDIS_HEALTH_CHECK_INTERVAL:
+        return
+
+    try:
+        connection.ping()
+    except redis.RedisError as e:
+        logger.warning('engine', 'Redis health check failed, reconnecting. Exception message: {}'.format(str(e)))
+        reset_redis_pool()
+        try:
+            connection.connection_pool = __get_pool()
+            connection.ping()
+        except Exception as e:
+            logger.exception('engine', 'Could not connect to Redis. Exception message: {}'.format(str(e)))
+            raise Exception('Could not connect to Redis. Please check logs.')
+    __last_health_check = time.monotonic()
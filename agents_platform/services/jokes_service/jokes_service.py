@@ -7,6 +7,7 @@ from typing import List, Dict, Optional
 
 import utils.logger as logger
 from agents_platform.base_service import AgentService
+from agents_platform.constants import STICKY_KEY
 from agents_platform.own_adapter.agent_task import get_answer_from_agent_task_answers
 from agents_platform.own_adapter.element import Element
 from agents_platform.services.jokes_service.constants import *
@@ -45,7 +46,7 @@ class JokesAgentService(AgentService):
             request_flask_endpoint = ''
             jokes_response = self.send_request_to_agent_handler(method=request_method,
                                                                 url=request_flask_endpoint,
-                                                                params={}, data=data)
+                                                                params={STICKY_KEY: element.get_id()}, data=data)
 
             # Check if we get successful response.
             if not jokes_response or jokes_response.status_code != HTTPStatus.OK:
@@ -87,7 +88,7 @@ class JokesAgentService(AgentService):
         start_msg = f'Time to find a joke for thee.'
         if topic:
             start_msg += f' "{topic}" you say? Let\'s see...'
-        board.put_message(start_msg)
+        self.board_outbox.put(board, start_msg)
 
         try:
             # Get the jokes from the agent.
@@ -97,7 +98,7 @@ class JokesAgentService(AgentService):
                 message = f'I could not find any jokes on "{topic}".' \
                     if topic \
                     else 'There are no more jokes in this world.'
-                board.put_message(message)
+                self.board_outbox.put(board, message)
                 return None
 
             # Compose successful report message.
@@ -106,7 +107,7 @@ class JokesAgentService(AgentService):
             if randint(-3, 10) < 0:
                 prefix = 'I haven\'t found a thing. Just joking, here you go:\n'
                 message = prefix + message
-            board.put_message(message)
+            self.board_outbox.put(board, message)
 
         except AttributeError as attr_err:
             logger.exception(self.name,
@@ -133,12 +134,8 @@ class JokesAgentService(AgentService):
         agent_task_answers = agent_task['agentTaskElement']['agentTask']
         agent_task_config_id = agent_task_answers['id']
 
-        # Get all the agent-tasks
-        possible_files = self.get_agent_tasks_names()
-
         # Find the AgentTask to run
-        for filename in possible_files:
-            if self.get_agent_task_config_from_file(filename)['agentTask']['id'] == agent_task_config_id:
-                return self.get_jokes(element, agent_task_answers)
+        if self.agent_task_registry.get_task_name(agent_task_config_id):
+            return self.get_jokes(element, agent_task_answers)
 
         return None
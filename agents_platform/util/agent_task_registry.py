@@ -0,0 +1,111 @@
+"""
+Registry of a service's agent-task configs
+
+The agent_tasks/*.json files are parsed when the registry is built and indexed by agent-task config ID.
+They are reloaded when a file is added, removed or modified, which is checked
+by mtime at most once per check_period seconds.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils import logger
+
+AGENT_TASK_FILE_EXTENSION = '.json'
+
+
+class AgentTaskRegistry:
+    """
+    Agent-task configs of a service indexed by ID and by task name
+    """
+
+    def __init__(self, tasks_path: str, logger_name: str, check_period: float = 5):
+        """
+        :param tasks_path: Path to the directory with agent-task configs
+        :param logger_name: Name to log with
+        :param check_period: Minimum number of seconds between checks of the files for changes
+        """
+        self.__tasks_path = tasks_path
+        self.__logger_name = logger_name
+        self.__check_period = check_period
+
+        self.__lock = threading.Lock()
+        self.__configs: Dict[str, Dict] = {}  # task name -> config
+        self.__names_by_id: Dict[int, str] = {}  # agent-task config ID -> task name
+        self.__load(self.__get_files_state())
+        self.__last_check = time.monotonic()
+
+    def get_task_name(self, agent_task_config_id: int) -> str:
+        """
+        Returns the name of the task by its agent-task config ID
+        :param agent_task_config_id: ID of the agentTask in the config
+        :return: The task name (the config's file name without extension), or '' if there is no such task
+        """
+        self.__reload_if_changed()
+        return self.__names_by_id.get(agent_task_config_id, '')
+
+    def get_config(self, task_name: str) -> Optional[Dict]:
+        """
+        Returns the parsed config of the task
+        :param task_name: The task name, the config's file name with or without extension
+        :return: The config, or None if there is no such task. It's shared, don't change it
+        """
+        self.__reload_if_changed()
+        if task_name.endswith(AGENT_TASK_FILE_EXTENSION):
+            task_name = task_name[:-len(AGENT_TASK_FILE_EXTENSION)]
+        return self.__configs.get(task_name)
+
+    def get_file_names(self) -> List[str]:
+        """Returns the file names of all the task configs"""
+        self.__reload_if_changed()
+        return [f'{task_name}{AGENT_TASK_FILE_EXTENSION}' for task_name in self.__configs]
+
+    def __reload_if_changed(self) -> None:
+        """Re-reads the configs if the files have changed since the last reading"""
+        if time.monotonic() - self.__last_check < self.__check_period:
+            return
+
+        with self.__lock:
+            if time.monotonic() - self.__last_check < self.__check_period:
+                return
+            files_state = self.__get_files_state()
+            if files_state != self.__files_state:
+                self.__load(files_state)
+            self.__last_check = time.monotonic()
+
+    def __get_files_state(self) -> Tuple:
+        """Returns the names, modification times and sizes of the config files"""
+        if not os.path.isdir(self.__tasks_path):
+            return ()
+        files_state = []
+        for entry in os.scandir(self.__tasks_path):
+            if entry.is_file() and entry.name.endswith(AGENT_TASK_FILE_EXTENSION):
+                stat = entry.stat()
+                files_state.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(files_state))
+
+    def __load(self, files_state: Tuple) -> None:
+        """Parses all the config files and swaps the indexes"""
+        configs = {}
+        names_by_id = {}
+        for file_name, _, _ in files_state:
+            task_name = file_name[:-len(AGENT_TASK_FILE_EXTENSION)]
+            try:
+                with open(os.path.join(self.__tasks_path, file_name), 'r') as file:
+                    config = json.load(file)
+            except Exception as e:
+                logger.error(self.__logger_name, f'Agent task config in {file_name} could not be read. Exception {e}.')
+                continue
+
+            configs[task_name] = config
+            agent_task_config_id = config.get('agentTask', {}).get('id', None)
+            if agent_task_config_id is not None:
+                names_by_id[agent_task_config_id] = task_name
+
+        self.__configs = configs
+        self.__names_by_id = names_by_id
+        self.__files_state = files_state
+        logger.debug(self.__logger_name, f'Loaded {len(configs)} agent task configs from {self.__tasks_path}')
@@ -0,0 +1,140 @@
+"""
+Bounded priority dispatch of incoming events to a fixed set of worker threads
+
+Events with a lower priority value are handled first, FIFO within a priority.
+An event whose key matches a queued, not yet started one replaces that one's payload in place
+instead of being queued again. When the queue is full, the least important queued event is dropped
+in favour of a more important one; otherwise the producer waits up to put_timeout seconds
+(back-pressure) and then the event is dropped.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from utils import logger
+
+
+class PriorityDispatcher:
+    """
+    Bounded, deduplicating priority queue served by worker threads
+    """
+
+    def __init__(self, name: str, handler: Callable, num_workers: int, max_size: int,
+                 put_timeout: Optional[float] = None):
+        """
+        :param name: Name used for the worker threads and in logs
+        :param handler: Function called with the arguments of every dispatched event
+        :param num_workers: Number of worker threads
+        :param max_size: Maximum number of queued events
+        :param put_timeout: Seconds a producer waits for room in a full queue, None to wait forever
+        """
+        self.__name = name
+        self.__handler = handler
+        self.__max_size = max_size
+        self.__put_timeout = put_timeout
+
+        self.__heap = []  # (priority, sequence number, key), keys of dropped events are skipped
+        self.__queued: Dict[Hashable, Tuple[Tuple, float]] = {}  # key -> (handler's args, enqueue time)
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+
+        self.__metrics = {
+            'enqueued': 0,
+            'deduplicated': 0,
+            'dropped': 0,
+            'processed': 0,
+            'failed': 0,
+            'max_depth': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0,
+        }
+
+        for i in range(num_workers):
+            threading.Thread(target=self.__work, name=f'{name}_dispatcher_{i}', daemon=True).start()
+
+    def put(self, args: Tuple, priority: int = 0, key: Hashable = None) -> bool:
+        """
+        Queues an event
+
+        :param args: Arguments to call the handler with
+        :param priority: Lower values are handled first
+        :param key: Events with equal keys are deduplicated while queued, None to never deduplicate
+        :return: False if the event was dropped because the queue stayed full
+        """
+        with self.__condition:
+            if key is not None and key in self.__queued:
+                # Keep the position in the queue, but handle the latest payload
+                self.__queued[key] = (args, self.__queued[key][1])
+                self.__metrics['deduplicated'] += 1
+                return True
+
+            if len(self.__queued) >= self.__max_size:
+                self.__drop_less_important(priority)
+            if not self.__condition.wait_for(lambda: len(self.__queued) < self.__max_size, self.__put_timeout):
+                self.__metrics['dropped'] += 1
+                logger.warning(self.__name, f'Dispatch queue is full ({self.__max_size}), an event is dropped')
+                return False
+
+            if key is None:
+                key = object()
+            self.__queued[key] = (args, time.monotonic())
+            heapq.heappush(self.__heap, (priority, next(self.__sequence), key))
+            self.__metrics['enqueued'] += 1
+            self.__metrics['max_depth'] = max(self.__metrics['max_depth'], len(self.__queued))
+            self.__condition.notify_all()
+            return True
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Returns the queue's counters: current and maximum depth, numbers of enqueued, deduplicated,
+        dropped, processed and failed events, average and maximum queue wait time in seconds
+        """
+        with self.__condition:
+            metrics = dict(self.__metrics)
+            metrics['depth'] = len(self.__queued)
+        started = metrics['processed'] + metrics['failed']
+        metrics['average_wait_time'] = metrics.pop('total_wait_time') / started if started else 0.0
+        return metrics
+
+    def __drop_less_important(self, priority: int) -> None:
+        """
+        Drops the latest of the least important queued events, if it's less important than the given priority
+        (the condition must be held)
+        """
+        queued = [entry for entry in self.__heap if entry[2] in self.__queued]
+        if not queued:
+            return
+        least_important = max(queued)
+        if least_important[0] <= priority:
+            return
+        self.__queued.pop(least_important[2])
+        self.__metrics['dropped'] += 1
+        logger.warning(self.__name, f'Dispatch queue is full ({self.__max_size}), '
+                                    f'an event of priority {least_important[0]} is dropped for one of {priority}')
+
+    def __work(self) -> None:
+        """Handles the queued events one by one"""
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__queued)
+                _, _, key = heapq.heappop(self.__heap)
+                while key not in self.__queued:
+                    _, _, key = heapq.heappop(self.__heap)
+                args, enqueued_at = self.__queued.pop(key)
+                wait_time = time.monotonic() - enqueued_at
+                self.__metrics['total_wait_time'] += wait_time
+                self.__metrics['max_wait_time'] = max(self.__metrics['max_wait_time'], wait_time)
+                self.__condition.notify_all()
+
+            try:
+                self.__handler(*args)
+                succeeded = True
+            except Exception as e:
+                logger.exception(self.__name, f'Could not handle a dispatched event. Error: {e}')
+                succeeded = False
+
+            with self.__condition:
+                self.__metrics['processed' if succeeded else 'failed'] += 1
@@ -1,6 +1,11 @@
 """
 Describes elements' geometry for boards
 """
+import numpy as np
+
+FIRST_FIT = 'first'
+BEST_FIT = 'best'
+ALL_FITS = 'all'
 
 
 class Point:
@@ -186,6 +191,165 @@ class Rectangle:
         return self._y_shift
 
 
+class OccupancyGrid:
+    """
+    Occupancy of a board's cells as a boolean NumPy matrix, indexed [y, x] from 0
+
+    Occupied cells are counted in any rectangle in O(1) with a summed-area table,
+    which is rebuilt lazily after the grid changes.
+    """
+
+    def __init__(self, size_x, size_y):
+        self._cells = np.zeros((size_y, size_x), dtype=bool)
+        self._sat = None
+
+    @classmethod
+    def from_elements(cls, size_x, size_y, elements):
+        """
+        Creates the grid of a board with elements
+        :param size_x: Board's number of columns
+        :param size_y: Board's number of rows
+        :param elements: Dicts with posX, posY (from 1), sizeX and sizeY, as the platform returns them
+        :return: OccupancyGrid
+        :raise IndexError: if an element is out of the board
+        """
+        grid = cls(size_x, size_y)
+        for element in elements:
+            grid.occupy(element['posX'] - 1, element['posY'] - 1, element['sizeX'], element['sizeY'])
+        return grid
+
+    @property
+    def size_x(self):
+        """Number of columns"""
+        return self._cells.shape[1]
+
+    @property
+    def size_y(self):
+        """Number of rows"""
+        return self._cells.shape[0]
+
+    @property
+    def cells(self):
+        """
+        Read-only view of the cells, True – occupied
+        :return: np.ndarray of shape (size_y, size_x)
+        """
+        view = self._cells.view()
+        view.flags.writeable = False
+        return view
+
+    def to_matrix(self):
+        """
+        :return: List of rows, 1 – occupied, 0 – free
+        """
+        return self._cells.astype(int).tolist()
+
+    def occupy(self, x, y, width=1, height=1):
+        """
+        Marks a rectangle occupied
+        :raise IndexError: if it's out of the grid
+        """
+        self._check_area(x, y, width, height)
+        self._cells[y:y + height, x:x + width] = True
+        self._sat = None
+
+    def free(self, x, y, width=1, height=1):
+        """
+        Marks a rectangle free
+        :raise IndexError: if it's out of the grid
+        """
+        self._check_area(x, y, width, height)
+        self._cells[y:y + height, x:x + width] = False
+        self._sat = None
+
+    def count_occupied(self, x, y, width=1, height=1):
+        """
+        Counts occupied cells of a rectangle in O(1)
+        :raise IndexError: if it's out of the grid
+        """
+        self._check_area(x, y, width, height)
+        sat = self._get_sat()
+        return int(sat[y + height, x + width] - sat[y, x + width] - sat[y + height, x] + sat[y, x])
+
+    def is_area_free(self, x, y, width=1, height=1):
+        """
+        Checks if every cell of a rectangle is free, in O(1)
+        :return: True if free, False if occupied or out of the grid
+        """
+        if not self._is_inside(x, y, width, height):
+            return False
+        return self.count_occupied(x, y, width, height) == 0
+
+    def find_free_rect(self, width, height, mode=FIRST_FIT):
+        """
+        Looks for free width x height rectangles, checking all the positions at once
+        :param width: Number of columns
+        :param height: Number of rows
+        :param mode: FIRST_FIT – the topmost, then leftmost position;
+                     BEST_FIT – the position which touches most occupied cells and board's borders,
+                                so free space stays in one piece (ties go to the first fit);
+                     ALL_FITS – all positions
+        :return: (x, y) of the top left cell, or None if nothing fits; a list of them for ALL_FITS
+        """
+        if mode not in (FIRST_FIT, BEST_FIT, ALL_FITS):
+            raise ValueError('Mode should be one of {}, {}, {}, but current value is {}'
+                             .format(FIRST_FIT, BEST_FIT, ALL_FITS, mode))
+        if width < 1 or height < 1 or width > self.size_x or height > self.size_y:
+            return [] if mode == ALL_FITS else None
+
+        fits = _window_sums(self._get_sat(), width, height) == 0
+        if mode == ALL_FITS:
+            return [(int(x), int(y)) for y, x in np.argwhere(fits)]
+        if not fits.any():
+            return None
+
+        if mode == FIRST_FIT:
+            y, x = np.unravel_index(np.argmax(fits), fits.shape)
+            return int(x), int(y)
+
+        # Occupied cells and borders around every position: sums of (width+2) x (height+2) windows
+        # of the grid padded with occupied cells, the free inside adds nothing
+        padded = np.pad(self._cells, 1, mode='constant', constant_values=True)
+        contacts = _window_sums(_summed_area_table(padded), width + 2, height + 2)
+        y, x = np.unravel_index(np.argmax(np.where(fits, contacts, -1)), fits.shape)
+        return int(x), int(y)
+
+    def _get_sat(self):
+        """Returns the summed-area table, (size_y + 1) x (size_x + 1) with a zero first row and column"""
+        if self._sat is None:
+            self._sat = _summed_area_table(self._cells)
+        return self._sat
+
+    def _is_inside(self, x, y, width, height):
+        """Checks if a rectangle is within the grid"""
+        return width >= 1 and height >= 1 and 0 <= x and 0 <= y \
+            and x + width <= self.size_x and y + height <= self.size_y
+
+    def _check_area(self, x, y, width, height):
+        """Raises IndexError if a rectangle is out of the grid"""
+        if not self._is_inside(x, y, width, height):
+            raise IndexError('Area ({}; {}) of {}x{} is out of the grid {}x{}'
+                             .format(x, y, width, height, self.size_x, self.size_y))
+
+
+def _summed_area_table(cells):
+    """
+    :param cells: 2D boolean matrix
+    :return: Its summed-area table with a zero first row and column
+    """
+    sat = np.zeros((cells.shape[0] + 1, cells.shape[1] + 1), dtype=np.int32)
+    sat[1:, 1:] = cells.cumsum(axis=0, dtype=np.int32).cumsum(axis=1)
+    return sat
+
+
+def _window_sums(sat, width, height):
+    """
+    :param sat: Summed-area table with a zero first row and column
+    :return: Sums of all width x height windows, indexed by their top left cell
+    """
+    return sat[height:, width:] - sat[:-height, width:] - sat[height:, :-width] + sat[:-height, :-width]
+
+
 class AllocationGrid:
     """
     Allocation grid representing free/occupied board's elements
@@ -195,18 +359,15 @@ class AllocationGrid:
     """
 
     def __init__(self, board):
-        sizes = board.get_board_size()
-        self._max_size_x = sizes['sizeX']
-        self._max_size_y = sizes['sizeY']
-
-        # TODO: Make it booleans
-        self._grid = board.get_elements_matrix()
+        self._grid = board.get_occupancy_grid()
+        self._max_size_x = self._grid.size_x
+        self._max_size_y = self._grid.size_y
 
     @property
     def grid(self):
         """
         Getter
-        :return:
+        :return: OccupancyGrid
         """
         return self._grid
 
@@ -223,139 +384,116 @@ class AllocationGrid:
     def is_free(self, i, j):
         """
         Checks if ij-th element is free
-        :param i: Column-number, integer interval is [1; max_x]
-        :param j: Row-number, integer interval is [1; max_y]
-        :return: True if free, False if occupied, None if out of borders
+        :param i: Column-number, integer interval is [0; max_x)
+        :param j: Row-number, integer interval is [0; max_y)
+        :return: True if free, False if occupied
         """
-        if i < 0 or j < 0:
-            raise IndexError('There is no cell ({}; {}) on the board. Indices start with 0.'
-                             .format(i, j))
-        if i > self.max_x or j > self.max_y:
-            raise IndexError('There is no cell ({}; {}) on the board. Maximums are {} and {}'
-                             .format(i, j, self._max_size_x, self._max_size_y))
-        if self._grid[i][j]:
-            return False
-        return True
+        return not self.is_occupied(i, j)
 
     def is_occupied(self, i, j):
         """
         Checks whether ij-th element is occupied
-        :param i: Column-number, integer interval is [1; max_x]
-        :param j: Row-number, integer interval is [1; max_y]
-        :return: True if occupied, False if free, None if out of borders
+        :param i: Column-number, integer interval is [0; max_x)
+        :param j: Row-number, integer interval is [0; max_y)
+        :return: True if occupied, False if free
         """
         if i < 0 or j < 0:
             raise IndexError('There is no cell ({}; {}) on the board. Indices start with 0.'
                              .format(i, j))
-        if i > self.max_x or j > self.max_y:
+        if i >= self.max_x or j >= self.max_y:
             raise IndexError('There is no cell ({}; {}) on the board. Maximums are {} and {}'
                              .format(i, j, self._max_size_x, self._max_size_y))
-        if self._grid[i][j]:
-            return True
-        return False
+        return bool(self._grid.cells[j, i])
 
     def cell_state(self, i, j):
         """
         Returns the state of the ij-th grid's cell
-        :param i: Column-number, integer interval is [1; max_x]
-        :param j: Row-number, integer interval is [1; max_y]
+        :param i: Column-number, integer interval is [0; max_x)
+        :param j: Row-number, integer interval is [0; max_y)
         :return: True – occupied, False – free, None – out of border
         """
-        if i > self.max_x or j > self.max_y:
+        if not 0 <= i < self.max_x or not 0 <= j < self.max_y:
             return None
-        return True if self._grid[i][j] else False
+        return bool(self._grid.cells[j, i])
 
     def is_area_free(self, start, end):
         """
         Checks if given rectangular area is free
-        :param start: Point:
-        :param end: Point:
-        :return: True, if every single-piece element is free, False otherwise;
-                 None, if input data is incorrect
+        :param start: Point: the top left cell
+        :param end: Point: the cell after the bottom right one
+        :return: True, if every single-piece element is free, False otherwise
         """
         assert isinstance(start, Point), 'Start parameter {} is not a Point'.format(start)
         assert isinstance(end, Point), 'End parameter {} is not a Point'.format(end)
 
-        # TODO: rework it to Rect.is_free()
-        for i in range(start.x, end.x):
-            for j in range(start.y, end.y):
-                if self.is_occupied(i, j):
-                    return False
-        return True
-
-    def _free(self, i, j):
-        """
-        Frees the ij-th element
-        :param i:
-        :param j:
-        :return:
-        """
-        self._grid[i][j] = False
-        return True
+        if end.x <= start.x or end.y <= start.y:
+            return True
+        return self._grid.is_area_free(start.x, start.y, end.x - start.x, end.y - start.y)
 
-    def _occupy(self, i, j):
+    def find_free_rect(self, width, height, mode=FIRST_FIT):
         """
-        Occupies the ij-th element
-        :param i:
-        :param j:
-        :return:
+        Looks for a free area, see OccupancyGrid.find_free_rect
+        :return: (i, j) of the top left cell, or None; a list of them for ALL_FITS
         """
-        if not self._grid[i][j]:
-            self._grid[i][j] = True
-            return True
-        return False
+        return self._grid.find_free_rect(width, height, mode)
 
     def allocate(self, start, end=None):
         """
         Occupies the certain rectangle area
-        :param start:
-        :param end:
-        :return: True if succeeded, False otherwise; None – out of borders
+        :param start: Point: the top left cell
+        :param end: Point: the cell after the bottom right one
+        :return: True if succeeded, False if some cell is already occupied; None – out of borders
         """
         # Check if the Points are correct
-        if not check_point_correct(start):
+        if not self._is_point_inside(start, start.x + 1, start.y + 1):
             return None
 
         if end is None:
-            return self._occupy(start.x, start.y)
-        elif not check_point_correct(end):
+            end = Point(start.x + 1, start.y + 1, max_x=self.max_x, max_y=self.max_y)
+        elif not self._is_point_inside(end, end.x, end.y):
             return None
 
-        for i in range(start.x, end.x):
-            for j in range(start.y, end.y):
-                if not self._occupy(i, j):
-                    return False
+        if end.x <= start.x or end.y <= start.y:
+            return True
+        width, height = end.x - start.x, end.y - start.y
+        if not self._grid.is_area_free(start.x, start.y, width, height):
+            return False
+        self._grid.occupy(start.x, start.y, width, height)
         return True
 
     def deallocate(self, start, end=None):
         """
         Frees either single-piece element, or the given area
-        :param start:
-        :param end:
+        :param start: Point: the top left cell
+        :param end: Point: the cell after the bottom right one
         :return: True if succeded, False otherwise
         """
         # Check if the Points are correct
-        if not check_point_correct(start):
+        if not self._is_point_inside(start, start.x + 1, start.y + 1):
             return False
 
         if end is None:
-            self._free(start.x, start.y)
+            self._grid.free(start.x, start.y)
             return True
-        else:
-            if not check_point_correct(end):
-                return False
+        elif not self._is_point_inside(end, end.x, end.y):
+            return False
 
-        for i in range(start.x, end.x):
-            for j in range(start.y, end.y):
-                self._free(i, j)
+        if end.x > start.x and end.y > start.y:
+            self._grid.free(start.x, start.y, end.x - start.x, end.y - start.y)
         return True
 
+    def _is_point_inside(self, point, x_end, y_end):
+        """Checks if the point is correct and the area up to (x_end; y_end) is on the grid"""
+        return check_point_correct(point, self.max_x, self.max_y) and x_end <= self.max_x and y_end <= self.max_y
+
 
-def check_point_correct(point):
+def check_point_correct(point, max_x=7, max_y=9):
     """
     Checks whether the point_i_j exists on the grid
     I.e., correct indices
     :param point:
+    :param max_x: Maximum column-number
+    :param max_y: Maximum row-number
     :return: True if everything's correct, False otherwise
     """
     assert isinstance(point, Point), '{} is not a Point'.format(point)
@@ -363,8 +501,7 @@ def check_point_correct(point):
     if point.x < 0 or point.y < 0:
         return False
 
-    # TODO: Grab constrains from the Board
-    if point.x > 7 or point.y > 9:
+    if point.x > max_x or point.y > max_y:
         return False
 
     return True
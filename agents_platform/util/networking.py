@@ -3,11 +3,12 @@ This module is responsible for requests
 """
 import json
 import sys
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple, Union
 from urllib.error import URLError
 
-from requests import request, Response, HTTPError, ConnectionError
+from requests import Response, HTTPError, ConnectionError
 
+from agents_platform.own_adapter.async_client import AsyncResponse
 from agents_platform.own_adapter.constants import OWN_ADAPTER_NAME
 from agents_platform.own_adapter.platform_access import PlatformAccess
 from utils.logger import exception, debug
@@ -32,11 +33,84 @@ def make_request(platform_access: PlatformAccess,
     :param logger_name: Name for logging, default is OWN_ADAPTER_NAME
     :return: requests.Response
     """
+    if not logger_name:
+        logger_name = OWN_ADAPTER_NAME
+
+    prepared_request = _prepare_request(platform_access, http_method, url_postfix, detail,
+                                        data, values, logger_name)
+    if prepared_request is None:
+        return None
+    url, headers, payload = prepared_request
+
+    try:
+        # Make a request
+        if http_method != 'DELETE':
+            response = platform_access.request(url=url, method=http_method, headers=headers,
+                                               data=payload)
+        else:
+            response = platform_access.request(url=url, method=http_method, headers=headers)
+
+    except HTTPError as http_error:
+        exception(logger_name, f'HTTP error ({http_error.errno}) while making request: {http_error}')
+        return None
+    except ConnectionError as con_error:
+        exception(logger_name, f'HTTP error ({con_error.errno}) while making request: {con_error}')
+        return None
+    except URLError as url_error:
+        exception(logger_name, f'URL error, failed to reach server: {url_error.reason}')
+        return None
+    else:
+        debug(logger_name, f'Successfully made a request, code {response.status_code}, {response}')
+        return response
+
+
+async def make_request_async(platform_access: PlatformAccess,
+                             http_method: str,
+                             url_postfix: Optional[str],
+                             detail: str,
+                             data: Dict = None,
+                             values: Dict = None,
+                             logger_name: str = None) -> Optional[AsyncResponse]:
+    """
+    Asyncio version of make_request, sent through platform_access.get_async_client()
+
+    :return: AsyncResponse, or None if the request couldn't be made
+    """
+    if not logger_name:
+        logger_name = OWN_ADAPTER_NAME
+
+    prepared_request = _prepare_request(platform_access, http_method, url_postfix, detail,
+                                        data, values, logger_name)
+    if prepared_request is None:
+        return None
+    url, headers, payload = prepared_request
+
+    try:
+        response = await platform_access.get_async_client().request(
+            http_method, url, headers=headers, data=payload if http_method != 'DELETE' else None)
+    except ConnectionError as con_error:
+        exception(logger_name, f'HTTP error ({con_error.errno}) while making request: {con_error}')
+        return None
+    else:
+        debug(logger_name, f'Successfully made a request, code {response.status_code}, {response}')
+        return response
+
+
+def _prepare_request(platform_access: PlatformAccess,
+                     http_method: str,
+                     url_postfix: Optional[str],
+                     detail: str,
+                     data: Optional[Dict],
+                     values: Optional[Dict],
+                     logger_name: str) -> Optional[Tuple[str, Dict, Union[bytes, str]]]:
+    """
+    Composes URL, signed headers and payload for make_request and make_request_async
+
+    :return: (url, headers, payload), or None if headers couldn't be generated
+    """
     # Set default values
     if values is None:
         values = dict()
-    if not logger_name:
-        logger_name = OWN_ADAPTER_NAME
 
     try:
         # Generate the payload
@@ -73,26 +147,7 @@ def make_request(platform_access: PlatformAccess,
     else:
         debug(logger_name, f'Successfully generated headers:\n{headers}')
 
-    try:
-        # Make a request
-        if http_method != 'DELETE':
-            response = request(url=url, method=http_method, headers=headers,
-                               data=payload)
-        else:
-            response = request(url=url, method=http_method, headers=headers)
-
-    except HTTPError as http_error:
-        exception(logger_name, f'HTTP error ({http_error.errno}) while making request: {http_error}')
-        return None
-    except ConnectionError as con_error:
-        exception(logger_name, f'HTTP error ({con_error.errno}) while making request: {con_error}')
-        return None
-    except URLError as url_error:
-        exception(logger_name, f'URL error, failed to reach server: {url_error.reason}')
-        return None
-    else:
-        debug(logger_name, f'Successfully made a request, code {response.status_code}, {response}')
-        return response
+    return url, headers, payload
 
 
 def compose_path(*path_pieces) -> str:
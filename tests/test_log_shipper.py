@@ -0,0 +1,183 @@
+import glob
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from utils import log_shipper
+from utils.log_shipper import LocalFileSink, LogShipper, REPLAYING_FILE_EXTENSION, SPILL_FILE_EXTENSION
+
+
+class RecordingSink:
+    """Sink which keeps the sent records, and fails while failing is True"""
+
+    def __init__(self, failing=False):
+        self.failing = failing
+        self.records = []
+
+    def write_batch(self, records):
+        if self.failing:
+            raise ConnectionError('sink is down')
+        self.records.extend(records)
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def write_spill_file(path, lines):
+    with open(path, 'w', encoding='utf-8') as file:
+        for line in lines:
+            print(line, file=file)
+
+
+class LocalFileSinkTest(unittest.TestCase):
+
+    def test_appends_records_as_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'logs', 'google_logs.jsonl')
+            sink = LocalFileSink(path)
+            sink.write_batch([({'message': 'first'}, 'INFO')])
+            sink.write_batch([({'message': 'second'}, 'ERROR')])
+
+            with open(path, encoding='utf-8') as file:
+                lines = [json.loads(line) for line in file]
+            self.assertEqual(lines, [{'severity': 'INFO', 'struct': {'message': 'first'}},
+                                     {'severity': 'ERROR', 'struct': {'message': 'second'}}])
+
+
+class LogShipperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spill_directory = os.path.join(self.directory.name, 'spill')
+        retry_period = mock.patch.object(log_shipper, 'LOG_SHIPPER_RETRY_PERIOD', 0.05)
+        retry_period.start()
+        self.addCleanup(retry_period.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def create_shipper(self, sink, **kwargs):
+        kwargs.setdefault('max_batch_size', 3)
+        kwargs.setdefault('max_batch_delay', 0.02)
+        return LogShipper(sink, self.spill_directory, **kwargs)
+
+    def get_files(self, extension):
+        return glob.glob(os.path.join(self.spill_directory, f'*{extension}'))
+
+    def test_ships_records_in_batches(self):
+        sink = RecordingSink()
+        shipper = self.create_shipper(sink)
+        for index in range(7):
+            shipper.ship({'index': index}, 'INFO')
+        shipper.flush(timeout=5)
+
+        self.assertTrue(wait_until(lambda: len(sink.records) == 7))
+        self.assertEqual([struct['index'] for struct, _ in sink.records], list(range(7)))
+
+    def test_spills_records_while_sink_fails_and_replays_them(self):
+        sink = RecordingSink(failing=True)
+        shipper = self.create_shipper(sink)
+        for index in range(5):
+            shipper.ship({'index': index}, 'WARNING')
+        shipper.flush(timeout=5)
+
+        self.assertTrue(wait_until(lambda: self.get_files(SPILL_FILE_EXTENSION)))
+        self.assertEqual(sink.records, [])
+
+        sink.failing = False
+        shipper.ship({'index': 5}, 'WARNING')
+        self.assertTrue(wait_until(lambda: len(sink.records) == 6))
+        self.assertEqual(sorted(struct['index'] for struct, _ in sink.records), list(range(6)))
+        self.assertTrue(wait_until(lambda: not self.get_files(SPILL_FILE_EXTENSION)
+                                   and not self.get_files(REPLAYING_FILE_EXTENSION)))
+
+    def test_spills_records_beyond_the_buffer(self):
+        sink = RecordingSink(failing=True)
+        shipper = self.create_shipper(sink, max_buffered=2, max_batch_delay=60)
+        for index in range(4):
+            shipper.ship({'index': index}, 'INFO')
+
+        spill_files = self.get_files(SPILL_FILE_EXTENSION)
+        self.assertEqual(len(spill_files), 1)
+        with open(spill_files[0], encoding='utf-8') as file:
+            self.assertEqual([json.loads(line)[0]['index'] for line in file], [2, 3])
+
+    def test_replays_files_of_previous_runs_skipping_corrupt_lines(self):
+        os.makedirs(self.spill_directory)
+        write_spill_file(os.path.join(self.spill_directory, f'1{SPILL_FILE_EXTENSION}'), [
+            json.dumps([{'index': 0}, 'INFO']),
+            '{"truncated',
+            json.dumps({'not': 'a record'}),
+            '',
+            json.dumps([{'index': 1}, 'ERROR']),
+        ])
+
+        sink = RecordingSink()
+        self.create_shipper(sink)
+
+        self.assertTrue(wait_until(lambda: len(sink.records) == 2))
+        self.assertEqual(sink.records, [({'index': 0}, 'INFO'), ({'index': 1}, 'ERROR')])
+        self.assertTrue(wait_until(lambda: not self.get_files(SPILL_FILE_EXTENSION)
+                                   and not self.get_files(REPLAYING_FILE_EXTENSION)))
+
+    def test_keeps_the_rest_of_a_file_if_sink_fails_during_replay(self):
+        os.makedirs(self.spill_directory)
+        write_spill_file(os.path.join(self.spill_directory, f'1{SPILL_FILE_EXTENSION}'),
+                         [json.dumps([{'index': index}, 'INFO']) for index in range(8)])
+
+        class FailingAfterFirstBatch(RecordingSink):
+            def write_batch(self, records):
+                if self.records:
+                    self.failing = True
+                super().write_batch(records)
+
+        sink = FailingAfterFirstBatch()
+        self.create_shipper(sink)
+
+        self.assertTrue(wait_until(lambda: sink.failing and self.get_files(SPILL_FILE_EXTENSION)))
+        self.assertTrue(wait_until(lambda: not self.get_files(REPLAYING_FILE_EXTENSION)))
+        self.assertEqual([struct['index'] for struct, _ in sink.records], [0, 1, 2])
+        with open(self.get_files(SPILL_FILE_EXTENSION)[0], encoding='utf-8') as file:
+            self.assertEqual([json.loads(line)[0]['index'] for line in file], list(range(3, 8)))
+
+    def test_replays_files_left_by_processes_which_are_gone(self):
+        os.makedirs(self.spill_directory)
+        dead_pid = 2 ** 22 + 1  # above the default pid_max
+        orphan_path = os.path.join(self.spill_directory, f'{dead_pid}-1{REPLAYING_FILE_EXTENSION}')
+        write_spill_file(orphan_path, [json.dumps([{'index': 0}, 'INFO'])])
+
+        sink = RecordingSink()
+        self.create_shipper(sink)
+
+        self.assertTrue(wait_until(lambda: sink.records == [({'index': 0}, 'INFO')]))
+        self.assertTrue(wait_until(lambda: not os.path.exists(orphan_path)
+                                   and not self.get_files(REPLAYING_FILE_EXTENSION)))
+
+    def test_keeps_a_short_name_for_a_file_which_fails_to_replay_again_and_again(self):
+        os.makedirs(self.spill_directory)
+        write_spill_file(os.path.join(self.spill_directory, f'1{SPILL_FILE_EXTENSION}'),
+                         [json.dumps([{'index': 0}, 'INFO'])])
+
+        replay_file = mock.patch.object(LogShipper, '_LogShipper__replay_file', side_effect=OSError('disk error'))
+        replay_file.start()
+        self.addCleanup(replay_file.stop)
+        shipper = self.create_shipper(RecordingSink())
+        for index in range(3):
+            shipper.ship({'index': index}, 'INFO')
+            shipper.flush(timeout=5)
+            self.assertTrue(wait_until(lambda: self.get_files(SPILL_FILE_EXTENSION)))
+
+        replay_file.stop()
+        for path in self.get_files(SPILL_FILE_EXTENSION) + self.get_files(REPLAYING_FILE_EXTENSION):
+            self.assertRegex(os.path.basename(path), r'^\d+(-\d+)?\.jsonl$')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Local directory of agent handlers
+
+A Firestore snapshot listener keeps a copy of the agent handlers collection, so a service picks
+the least loaded handler locally instead of querying Firestore on every dispatch.
+The handlers' numbers of tasks in Firestore lag behind (handlers write them lazily), so the requests
+this service has sent to a handler since its last snapshot are added to its number of tasks.
+
+Basic usage:
+    directory = AgentHandlerDirectory(db).start()
+    handler_id, handler_info = directory.acquire(black_list)
+    ...send the request...
+    directory.release(handler_id)
+"""
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from google.cloud.firestore_v1beta1 import DocumentSnapshot
+
+from utils import logger
+from utils.cloud_firestore_communication import Firestore
+from utils.constants import *
+
+
+class AgentHandlerDirectory:
+    """
+    Agent handlers with their optimistically accounted loads, fed by a Firestore snapshot listener
+    """
+
+    def __init__(self, db: Firestore):
+        """
+        :param db: Firestore of the agent
+        """
+        self.__db = db
+        self.__lock = threading.Lock()
+        self.__handlers: Dict[str, Dict] = {}  # handler id -> its document
+        self.__pending: Dict[str, int] = {}  # handler id -> requests sent since its last snapshot
+        self.__synced = threading.Event()
+        self.__snapshots = 0  # number of snapshots received
+        self.__snapshot_received = threading.Condition(self.__lock)
+        self.__watch = None
+
+    def start(self) -> 'AgentHandlerDirectory':
+        """
+        Subscribes to the agent handlers
+        :return: the directory itself
+        """
+        self.__watch = self.__db.get_agent_handlers_query().on_snapshot(self.__on_snapshot)
+        return self
+
+    def stop(self) -> None:
+        """
+        Unsubscribes, the directory falls back to querying Firestore then
+        :return: Nothing
+        """
+        if self.__watch is not None:
+            try:
+                self.__watch.unsubscribe()
+            except Exception as e:
+                logger.warning(UTILS, f'Could not unsubscribe from agent handlers. Error: {e}')
+            self.__watch = None
+        self.__synced.clear()
+
+    def acquire(self, black_list: Iterable[str] = ()) -> Optional[Tuple[str, Dict]]:
+        """
+        Picks the least loaded agent handler and counts a request to it
+        :param black_list: ids of handlers which are not suitable
+        :return: the handler's id and info, with its number of tasks including the counted requests,
+                 or None if there is no suitable handler
+        """
+        if not self.__synced.is_set():
+            # The first snapshot hasn't arrived (or the listener is stopped)
+            return self.__db.get_agent_handler_with_least_amount_of_tasks(list(black_list))
+
+        black_list = set(black_list)
+        with self.__lock:
+            candidates = [handler_id for handler_id in self.__handlers if handler_id not in black_list]
+            if not candidates:
+                return None
+            handler_id = min(candidates, key=self.__get_number_of_tasks)
+            handler_info = dict(self.__handlers[handler_id])
+            handler_info[AGENT_HANDLER_NUM_TASKS_KEY] = self.__get_number_of_tasks(handler_id)
+            self.__pending[handler_id] = self.__pending.get(handler_id, 0) + 1
+        return handler_id, handler_info
+
+    def release(self, handler_id: str) -> None:
+        """
+        Uncounts a finished request to the handler, unless a snapshot has already accounted for it
+        :param handler_id: the handler's id
+        :return: Nothing
+        """
+        with self.__lock:
+            if self.__pending.get(handler_id, 0) > 0:
+                self.__pending[handler_id] -= 1
+
+    def get_snapshot_number(self) -> int:
+        """
+        Returns the number of snapshots received so far, see wait_for_snapshot
+        """
+        with self.__lock:
+            return self.__snapshots
+
+    def wait_for_snapshot(self, snapshot_number: int, timeout: float) -> bool:
+        """
+        Waits for a snapshot newer than the given one, e.g. after a handler has rejected a request as its number
+        of tasks was out of date
+        :param snapshot_number: the number of snapshots received, as returned by get_snapshot_number
+        :param timeout: seconds to wait
+        :return: True if a newer snapshot has arrived, False on timeout or if the listener isn't running
+        """
+        if not self.__synced.is_set():
+            return False
+        with self.__lock:
+            return self.__snapshot_received.wait_for(lambda: self.__snapshots > snapshot_number, max(timeout, 0))
+
+    def __get_number_of_tasks(self, handler_id: str) -> int:
+        """Returns the handler's number of tasks in its last snapshot plus the requests since (the lock must be held)"""
+        return self.__handlers[handler_id].get(AGENT_HANDLER_NUM_TASKS_KEY, 0) + self.__pending.get(handler_id, 0)
+
+    def __on_snapshot(self, docs, changes, read_time) -> None:
+        """
+        Applies the changed handlers (runs in the listener's thread)
+        """
+        with self.__lock:
+            for change in changes:
+                doc: DocumentSnapshot = change.document
+                self.__pending.pop(doc.id, None)
+                if change.type.name == 'REMOVED':
+                    self.__handlers.pop(doc.id, None)
+                else:
+                    self.__handlers[doc.id] = doc.to_dict() or {}
+            self.__snapshots += 1
+            self.__snapshot_received.notify_all()
+        self.__synced.set()
@@ -1,6 +1,10 @@
 """
 Method to access Cloud Firestore
 """
+import socket
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple, Optional
 
@@ -49,6 +53,17 @@ class Firestore:
         self.common_db = self.firestore.collection(AGENTS_PLATFORM_KEY)
         self.db = self.common_db.document(collection_key)
 
+        # Leases on claimed tasks are taken in the name of this instance and renewed in the background
+        self.lease_owner = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.__kept_leases: Dict[str, Dict] = {}  # lease key -> runners dict of the tasks holding it
+        self.__lease_keeper_lock = threading.Lock()
+        self.__lease_keeper = None
+
+        # Message IDs are "{microseconds}-{writer}", increasing for each writer
+        self.__message_writer_id = uuid.uuid4().hex[:8]
+        self.__last_message_time = 0
+        self.__message_index_lock = threading.Lock()
+
     def get_available_agent_ports(self) -> List[int]:
         """
         Get available ports for agents to run on
@@ -108,6 +123,13 @@ class Firestore:
 
         update_in_transaction(query_transaction, handler_ref)
 
+    def get_agent_handlers_query(self):
+        """
+        Return a query of all agent handlers, e.g. to listen to their changes
+        :return: the query
+        """
+        return self.db.collection(AGENT_HANDLERS)
+
     def get_agent_handler_with_least_amount_of_tasks(self, black_list: List[str]) -> Optional[Tuple[str, Dict]]:
         """
         Get an agent handler with a least number of tasks running on it
@@ -200,9 +222,11 @@ class Firestore:
 
     def create_new_doc_for_task(self, board_identifier: str, element_id: str, query_id: str, task_name: str,
                                 update_period: int, constant_monitoring: bool = False,
-                                agent_task: Dict = None) -> DocumentReference:
+                                agent_task: Dict = None, runners: Dict[str, Dict] = None) -> DocumentReference:
         """
         Create a new document to handle information necessary for an agent task execution
+        :param runners: lease key -> runners dict, for the leases this instance takes on the new task at once.
+                        They are renewed until the task is removed from the dict, the other leases are free
         :param agent_task: an agent task info
         :param update_period: time in seconds for periodical update of the task
         :param query_id: an id of agent task query
@@ -212,22 +236,24 @@ class Firestore:
         :param board_identifier: a board identifier to post a message
         :return: reference to the document
         """
+        runners = runners or {}
         doc_ref = self.db.collection(AGENT_TASKS_KEY).document()
         doc_ref.set({
             TASK_NAME_KEY: task_name,
             BOARD_IDENTIFIER_KEY: board_identifier,
             ELEMENT_ID_KEY: element_id,
             QUERY_ID_KEY: query_id,
-            MESSAGES_KEY: [],
+            HAS_NEW_MESSAGES_KEY: False,
             CONSTANT_MONITORING_KEY: constant_monitoring,
-            LISTENER_SET_KEY: True,
-            WORKER_SET_KEY: True,
-            LAST_MESSAGE_READ_KEY: 0,
+            **{lease_key: self.__new_lease() if lease_key in runners else self.__released_lease()
+               for lease_key in (LISTENER_LEASE_KEY, WORKER_LEASE_KEY, UPDATING_LEASE_KEY)},
             UPDATE_PERIOD_KEY: update_period,
             TIME_TO_UPDATE_KEY: datetime.now(pytz.UTC) + timedelta(seconds=update_period),
             AGENT_TASK_KEY: agent_task,
-            UPDATING_KEY: False,
         })
+        for lease_key, runners_dict in runners.items():
+            runners_dict[doc_ref.id] = doc_ref
+            self.__keep_leases(lease_key, runners_dict)
         return doc_ref
 
     def delete_old_agent_tasks(self, element_id: str, board_id: Optional[int] = None):
@@ -239,11 +265,96 @@ class Firestore:
         """
         if element_id:
             for doc in self.db.collection(AGENT_TASKS_KEY).where(ELEMENT_ID_KEY, '==', element_id).get():
+                self.__delete_messages(doc.reference)
                 doc.reference.delete()
         elif board_id:
             for doc in self.db.collection(AGENT_TASKS_KEY).where(BOARD_IDENTIFIER_KEY, '==', board_id).get():
+                self.__delete_messages(doc.reference)
                 doc.reference.delete()
 
+    @staticmethod
+    def get_task_lease_key(listener: bool = None, worker: bool = None, update: bool = None) -> str:
+        """
+        Return a name of the field which holds a lease on a task
+        :param listener: if a task is taken by listener
+        :param worker: if a task is taken by worker
+        :param update: if a task is taken for update
+        :return: the field name
+        """
+        lease_key = None
+        if listener:
+            lease_key = LISTENER_LEASE_KEY
+        if worker:
+            lease_key = WORKER_LEASE_KEY
+        if update:
+            lease_key = UPDATING_LEASE_KEY
+        if not lease_key:
+            raise Exception('Either listener, worker or update param should be set for get_constant_monitoring_task')
+        return lease_key
+
+    def get_claimable_tasks_query(self, task_name: str, constant_monitoring: bool = True,
+                                  listener: bool = None, due_only: bool = False):
+        """
+        Return a query of tasks which may be claimed.
+        Leases of listeners are filtered by expiry. The other leases can't be (Firestore can't compare two fields
+        with the current time), so claimed tasks are left out of due_only queries by moving their
+        TIME_TO_UPDATE_KEY to lease expiry. Leases are checked again on claim
+        :param task_name: a name of an agent task
+        :param constant_monitoring: whether a task is a constant monitoring one
+        :param listener: if a task is asked for listener, i.e., it should have messages
+        :param due_only: only tasks which update time has come (not for snapshot listeners, the time is fixed)
+        :return: the query
+        """
+        query = self.db.collection(AGENT_TASKS_KEY) \
+            .where(TASK_NAME_KEY, '==', task_name) \
+            .where(CONSTANT_MONITORING_KEY, '==', constant_monitoring)
+        if listener:
+            #  We don't need to check TIME_TO_UPDATE_KEY here, as listener should check for new messages
+            #  independently of that parameter
+            query = query.where(HAS_NEW_MESSAGES_KEY, '==', True)
+            if due_only:
+                query = query.where(f'{LISTENER_LEASE_KEY}.{LEASE_EXPIRES_AT_KEY}', '<=', datetime.now(pytz.UTC)) \
+                    .order_by(f'{LISTENER_LEASE_KEY}.{LEASE_EXPIRES_AT_KEY}')
+        elif due_only:
+            query = query.where(TIME_TO_UPDATE_KEY, '<=', datetime.now(pytz.UTC)).order_by(TIME_TO_UPDATE_KEY)
+        return query
+
+    def claim_agent_tasks(self, task_name: str, runners_dict: Dict, max_tasks: int = TASK_CLAIM_BATCH_SIZE,
+                          listener: bool = None, worker: bool = None, update: bool = None,
+                          constant_monitoring: bool = True) -> List[DocumentReference]:
+        """
+        Take leases on up to max_tasks tasks in one transaction
+        :param task_name: a name of an agent task to claim
+        :param runners_dict: a dict to store doc references of the claimed tasks, their leases are renewed
+        :param max_tasks: max number of tasks to claim
+        :param listener: claim tasks for listener
+        :param worker: claim tasks for worker
+        :param update: claim tasks for update
+        :param constant_monitoring: whether a task is a constant monitoring one
+        :return: references of the claimed tasks
+        """
+        lease_key = self.get_task_lease_key(listener=listener, worker=worker, update=update)
+        # Leased tasks are left out of the query, so only tasks claimed by someone else meanwhile are skipped
+        candidates = [doc.reference for doc in
+                      self.get_claimable_tasks_query(task_name, constant_monitoring=constant_monitoring,
+                                                     listener=listener, due_only=True)
+                          .limit(max_tasks).get()]
+        if not candidates:
+            return []
+        return self.__claim_in_transaction(candidates, lease_key, runners_dict, max_tasks)
+
+    def claim_agent_task(self, doc_ref: DocumentReference, lease_key: str,
+                         runners_dict: Dict) -> Optional[DocumentReference]:
+        """
+        Take a lease on a task, unless someone holds an unexpired one
+        :param doc_ref: a reference to the task's document
+        :param lease_key: a name of the field which holds the lease
+        :param runners_dict: a dict to store doc references of the claimed tasks, their leases are renewed
+        :return: the document reference if the task was claimed, otherwise None
+        """
+        claimed = self.__claim_in_transaction([doc_ref], lease_key, runners_dict, max_tasks=1)
+        return claimed[0] if claimed else None
+
     def get_agent_task_from_firestore(self, task_name: str, runners_dict: Dict, listener: bool = None,
                                       worker: bool = None, update=None,
                                       constant_monitoring: bool = True) \
@@ -258,88 +369,164 @@ class Firestore:
         :param task_name: a name of an agent task to get
         :return: a document reference of this task
         """
-        field_name = None
-        if listener:
-            field_name = LISTENER_SET_KEY
-        if worker:
-            field_name = WORKER_SET_KEY
-        if update:
-            field_name = UPDATING_KEY
-        if not field_name:
-            raise Exception('Either listener, worker or update param should be set for get_constant_monitoring_task')
+        claimed = self.claim_agent_tasks(task_name, runners_dict, max_tasks=1, listener=listener, worker=worker,
+                                         update=update, constant_monitoring=constant_monitoring)
+        return claimed[0] if claimed else None
 
+    def __claim_in_transaction(self, doc_refs: List[DocumentReference], lease_key: str, runners_dict: Dict,
+                               max_tasks: int) -> List[DocumentReference]:
+        """
+        Take leases on up to max_tasks of the given tasks which are not leased by anyone
+        :return: references of the claimed tasks
+        """
         query_transaction = self.firestore.transaction()
 
+        @firestore.transactional
+        def update_in_transaction(transaction: Transaction, doc_refs: List[DocumentReference]):
+            # All the reads of a transaction must go before its writes
+            contents = [(doc_ref, doc_ref.get(transaction=transaction).to_dict()) for doc_ref in doc_refs]
+
+            claimed = []
+            for doc_ref, content in contents:
+                if len(claimed) == max_tasks:
+                    break
+                #  Deleted, or leased by someone
+                if not content or not self.__is_lease_free(content.get(lease_key)):
+                    continue
+                transaction.update(doc_ref, self.__lease_update(lease_key))
+                claimed.append(doc_ref)
+            return claimed
+
+        claimed = update_in_transaction(query_transaction, doc_refs)
+        for doc_ref in claimed:
+            runners_dict[doc_ref.id] = doc_ref
+        if claimed:
+            self.__keep_leases(lease_key, runners_dict)
+        return claimed
+
+    def __new_lease(self) -> Dict:
+        """Returns a lease of this instance which expires in TASK_LEASE_DURATION"""
+        return {
+            LEASE_OWNER_KEY: self.lease_owner,
+            LEASE_EXPIRES_AT_KEY: datetime.now(pytz.UTC) + timedelta(seconds=TASK_LEASE_DURATION),
+        }
+
+    @staticmethod
+    def __released_lease() -> Dict:
+        """
+        Returns a lease which nobody holds. It's kept in the document, rather than deleted,
+        so queries can filter tasks by the expiry of their leases
+        """
+        return {
+            LEASE_OWNER_KEY: None,
+            LEASE_EXPIRES_AT_KEY: datetime.now(pytz.UTC),
+        }
+
+    def __lease_update(self, lease_key: str) -> Dict:
+        """
+        Returns the fields to take or renew a lease. Tasks with an update time are hidden from
+        due queries until the lease expires, when they become claimable again
+        """
+        lease = self.__new_lease()
+        update_dict = {lease_key: lease}
+        if lease_key != LISTENER_LEASE_KEY:
+            update_dict[TIME_TO_UPDATE_KEY] = lease[LEASE_EXPIRES_AT_KEY]
+        return update_dict
+
+    @staticmethod
+    def __is_lease_free(lease: Optional[Dict]) -> bool:
+        """Checks if a lease is released or expired"""
+        if not lease or not lease.get(LEASE_OWNER_KEY):
+            return True
+        expires_at = lease.get(LEASE_EXPIRES_AT_KEY)
+        return expires_at is None or expires_at <= datetime.now(pytz.UTC)
+
+    def __keep_leases(self, lease_key: str, runners_dict: Dict) -> None:
+        """
+        Renews the leases on the tasks in runners_dict until they are removed from it.
+        A task which lease is lost is removed from the dict, its runner should stop when it's not there
+        """
+        with self.__lease_keeper_lock:
+            self.__kept_leases[lease_key] = runners_dict
+            if self.__lease_keeper is None:
+                self.__lease_keeper = threading.Thread(target=self.__renew_leases_periodically,
+                                                       name='firestore_lease_keeper', daemon=True)
+                self.__lease_keeper.start()
+
+    def __renew_leases_periodically(self) -> None:
+        """Renews the kept leases every TASK_LEASE_RENEWAL_PERIOD"""
         while True:
-            if listener:
-                #  We don't need to check TIME_TO_UPDATE_KEY here, as listener should check for new messages
-                #  independently of that parameter
-                task = [
-                    doc for doc in self.db.collection(AGENT_TASKS_KEY)
-                        .where(TASK_NAME_KEY, '==', task_name)
-                        .where(CONSTANT_MONITORING_KEY, '==', constant_monitoring)
-                        .where(MESSAGES_KEY, '>', [])
-                        .where(field_name, '==', False)
-                        .limit(1).get()
-                ]
-            else:
-                task = [
-                    doc for doc in self.db.collection(AGENT_TASKS_KEY)
-                        .where(TASK_NAME_KEY, '==', task_name)
-                        .where(CONSTANT_MONITORING_KEY, '==', constant_monitoring)
-                        .where(TIME_TO_UPDATE_KEY, '<=', datetime.now(pytz.UTC))
-                        .where(field_name, '==', False)
-                        .limit(1).get()
-                ]
-
-            if not task:
-                return None
-            task_ref: DocumentSnapshot = task[0]
-
-            @firestore.transactional
-            def update_in_transaction(transaction: Transaction, doc_ref: DocumentReference):
-                already_processed = doc_ref.get(transaction=transaction).to_dict()[field_name]
-                if already_processed:
-                    return None
-
-                transaction.update(doc_ref, {
-                    field_name: True
-                })
-                runners_dict[doc_ref.id] = doc_ref
-                return doc_ref
+            time.sleep(TASK_LEASE_RENEWAL_PERIOD)
+            with self.__lease_keeper_lock:
+                kept_leases = list(self.__kept_leases.items())
+            for lease_key, runners_dict in kept_leases:
+                doc_refs = list(runners_dict.copy().values())
+                if not doc_refs:
+                    continue
+                try:
+                    lost = self.renew_task_leases(doc_refs, lease_key)
+                except Exception as e:
+                    logger.warning(UTILS, f'Could not renew task leases. Error: {e}')
+                    continue
+                for doc_ref in lost:
+                    runners_dict.pop(doc_ref.id, None)
+
+    def renew_task_leases(self, doc_refs: List[DocumentReference], lease_key: str) -> List[DocumentReference]:
+        """
+        Extend the leases this instance holds on the given tasks, in one transaction
+        :param doc_refs: references of the tasks
+        :param lease_key: a name of the field which holds the lease
+        :return: references of the tasks which leases were lost (released, expired and taken, or deleted)
+        """
+        query_transaction = self.firestore.transaction()
 
-            res = update_in_transaction(query_transaction, task_ref.reference)
-            if res:
-                return res
+        @firestore.transactional
+        def update_in_transaction(transaction: Transaction, doc_refs: List[DocumentReference]):
+            contents = [(doc_ref, doc_ref.get(transaction=transaction).to_dict()) for doc_ref in doc_refs]
+
+            lost = []
+            for doc_ref, content in contents:
+                lease = (content or {}).get(lease_key) or {}
+                if lease.get(LEASE_OWNER_KEY) != self.lease_owner:
+                    lost.append(doc_ref)
+                    continue
+                transaction.update(doc_ref, self.__lease_update(lease_key))
+            return lost
+
+        lost = update_in_transaction(query_transaction, doc_refs)
+        for doc_ref in lost:
+            logger.warning(UTILS, f'Lease {lease_key} on task {doc_ref.id} is not held anymore')
+        return lost
 
     def finish_monitoring_task(self, doc_ref: DocumentReference, listener: bool = None,
                                worker: bool = None, update: bool = None):
         """
-        Set proper keys after finishing work with a task
-        :param update: set update key to false
+        Release a lease on a task after finishing work with it, and schedule its next update.
+        If the lease has expired and was taken by someone else, nothing is written:
+        the new holder schedules the next update when it finishes
+        :param update: release a task from update
         :param worker: release a task from worker
         :param listener: release a task from listener
         :param doc_ref: a reference to the document
         :return: Nothing
         """
         try:
+            lease_key = self.get_task_lease_key(listener=listener, worker=worker, update=update)
+            content = doc_ref.get().to_dict()
+            lease = content.get(lease_key) or {}
+            if lease.get(LEASE_OWNER_KEY) == self.lease_owner:
+                update_dict = {lease_key: self.__released_lease()}
+            elif self.__is_lease_free(lease):
+                update_dict = {}
+            else:
+                #  The lease has expired and was taken by someone else, who owns the task's schedule now
+                return None
+
             if not listener:
-                doc_ref.update({
-                    TIME_TO_UPDATE_KEY: datetime.now(pytz.UTC) +
-                                        timedelta(seconds=doc_ref.get().to_dict()[UPDATE_PERIOD_KEY])
-                })
-            if listener:
-                doc_ref.update({
-                    LISTENER_SET_KEY: False,
-                })
-            if worker:
-                doc_ref.update({
-                    WORKER_SET_KEY: False,
-                })
-            if update:
-                doc_ref.update({
-                    UPDATING_KEY: False,
-                })
+                update_dict[TIME_TO_UPDATE_KEY] = datetime.now(pytz.UTC) + \
+                                                  timedelta(seconds=content[UPDATE_PERIOD_KEY])
+            if update_dict:
+                doc_ref.update(update_dict)
         except Exception as e:
             # Document doesn't exist
             logger.warning(UTILS, f'Unsuccessful finish to task monitoring. Error: {e}')
@@ -376,32 +563,71 @@ class Firestore:
 
     def add_new_message_to_doc_ref(self, agent_task_doc_ref: DocumentReference, message: str):
         """
-        Add a message to agentTask document
+        Append a message to agentTask's message log. Nothing is read, so concurrent writers don't contend
         :param agent_task_doc_ref: a reference to the document
         :param message: a message to add
         :return: Nothing
         """
-        query_transaction = self.firestore.transaction()
-
-        @firestore.transactional
-        def update_in_transaction(transaction: Transaction, doc_ref: DocumentReference):
-            content = doc_ref.get(transaction=transaction).to_dict()
-            messages = content[MESSAGES_KEY]
-            messages.append({
-                INDEX_KEY: max(content[LAST_MESSAGE_READ_KEY] + 1, messages[-1][INDEX_KEY] + 1 if messages else 0),
-                MESSAGE_KEY: message,
-            })
-            transaction.update(doc_ref, {
-                MESSAGES_KEY: messages,
-            })
+        index = self.__next_message_index()
+        batch = self.firestore.batch()
+        batch.set(agent_task_doc_ref.collection(MESSAGES_KEY).document(index), {
+            INDEX_KEY: index,
+            MESSAGE_KEY: message,
+        })
+        batch.update(agent_task_doc_ref, {
+            HAS_NEW_MESSAGES_KEY: True,
+        })
 
         try:
-            update_in_transaction(query_transaction, agent_task_doc_ref)
+            batch.commit()
         except Exception as e:
             #  This is only a warning, as usually it happens when doc was deleted while running
             #  two same tasks in parallel
             logger.warning(UTILS, f'Failed to add new messages. Error: {e}')
 
+    def get_messages(self, agent_task_doc_ref: DocumentReference, limit: int = MESSAGES_PAGE_SIZE) -> List[Dict]:
+        """
+        Read the messages of agentTask which are not acknowledged yet, in the order of their IDs.
+        There's no read cursor: the IDs only increase per writer, so a message of another writer
+        may be committed behind the ones already read
+        :param agent_task_doc_ref: a reference to the document
+        :param limit: max number of messages to read
+        :return: a list of dicts with INDEX_KEY and MESSAGE_KEY
+        """
+        query = agent_task_doc_ref.collection(MESSAGES_KEY).order_by(INDEX_KEY)
+        return [doc.to_dict() for doc in query.limit(limit).get()]
+
+    def acknowledge_messages(self, agent_task_doc_ref: DocumentReference, messages: List[Dict]) -> None:
+        """
+        Delete the given messages once they are delivered, in one batch
+        :param agent_task_doc_ref: a reference to the document
+        :param messages: messages returned by get_messages
+        :return: Nothing
+        """
+        if not messages:
+            return
+        batch = self.firestore.batch()
+        for message in messages:
+            batch.delete(agent_task_doc_ref.collection(MESSAGES_KEY).document(message[INDEX_KEY]))
+        batch.commit()
+
+    def __next_message_index(self) -> str:
+        """Returns a message ID greater than the previous ones of this writer, sortable as a string"""
+        with self.__message_index_lock:
+            self.__last_message_time = max(int(time.time() * 1000000), self.__last_message_time + 1)
+            return f'{self.__last_message_time:020d}-{self.__message_writer_id}'
+
+    def __delete_messages(self, agent_task_doc_ref: DocumentReference) -> None:
+        """Deletes agentTask's message log, as Firestore doesn't delete subcollections with their document"""
+        while True:
+            docs = list(agent_task_doc_ref.collection(MESSAGES_KEY).limit(MESSAGES_PAGE_SIZE).get())
+            if not docs:
+                return
+            batch = self.firestore.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            batch.commit()
+
     def get_lambda_to_put_message_on_board(self, doc_ref: DocumentReference):
         """
         Get a function to put a message to a specified document. It will be posted on a board by listener from
@@ -419,6 +645,7 @@ class Firestore:
         :return: Nothing
         """
         try:
+            self.__delete_messages(doc_ref)
             doc_ref.delete()
         except Exception as e:
             logger.exception(UTILS, f'Error while trying to delete document. Error {e}')
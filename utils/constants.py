@@ -47,16 +47,12 @@ AGENT_HANDLER_NUM_FAILS_KEY = 'numberOfFails'
 TASK_NAME_KEY = 'task'
 CONSTANT_MONITORING_KEY = 'constant_monitoring'
 DOC_LAYER_NAME = 'docBecauseFirestoreCantHandleNestedCollections'
-LISTENER_SET_KEY = 'listener_set'
-WORKER_SET_KEY = 'worker_set'
 ELEMENT_ID_KEY = 'elementId'
 QUERY_ID_KEY = 'queryId'
 INDEX_KEY = 'index'
-LAST_MESSAGE_READ_KEY = 'lastMessageRead'
 UPDATE_PERIOD_KEY = 'updatePeriod'
 TIME_TO_UPDATE_KEY = 'timeToUpdate'
 AGENT_TASK_KEY = 'agentTask'
-UPDATING_KEY = 'updating'
 SOCIAL_MEDIA_ACTIVITY_CHART = 'socialMediaActivityChart'
 FILE_ID_KEY = 'fileId'
 CHART_UNTIL_DATE_KEY = 'chartUntilDate'
@@ -64,4 +60,36 @@ POSTS_UNTIL_DATE = 'postsUntilDate'
 REPORT_KEY = 'report'
 
 MAX_NUMBER_OF_HANDLER_FAILS = 3
+# Seconds left to a task request, passed from services to handlers and agents. Relative rather than absolute,
+# so the hosts' clocks don't have to agree
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout'
+AGENT_HANDLER_REQUEST_TIMEOUT = float(os.environ.get('AGENT_HANDLER_REQUEST_TIMEOUT', 600))  # in seconds
 DOWNLOADS_DIR = 'downloads'
+
+# Keep-alive HTTP connection pools
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))  # number of hosts to keep a pool for
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))  # keep-alive connections per host
+HTTP_POOL_BLOCK = os.environ.get('HTTP_POOL_BLOCK', 'False') == 'True'
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 0))
+# Number of upstreams (agents of a handler, handlers of a service) to keep a pool for, above their expected number
+UPSTREAM_SESSIONS_MAX = int(os.environ.get('UPSTREAM_SESSIONS_MAX', 256))
+HTTP_POOL_IDLE_TIMEOUT = float(os.environ.get('HTTP_POOL_IDLE_TIMEOUT', 60))  # in seconds, to close an unused pool
+HTTP_POOL_EVICTION_PERIOD = 10  # in seconds, how often idle pools are looked for
+
+# Event-driven task claiming: claimable tasks arrive through Firestore snapshot listeners instead of polling
+TASK_SUBSCRIPTION_MODE = os.environ.get('TASK_SUBSCRIPTION_MODE', 'True') == 'True'
+TASK_SUBSCRIPTION_WAIT_TIMEOUT = 1  # in seconds, how often a waiting claimer checks if it should stop
+
+# Task leases: a claimed task belongs to one process until the lease is released or expires
+LISTENER_LEASE_KEY = 'listenerLease'
+WORKER_LEASE_KEY = 'workerLease'
+UPDATING_LEASE_KEY = 'updatingLease'
+LEASE_OWNER_KEY = 'owner'
+LEASE_EXPIRES_AT_KEY = 'expiresAt'
+TASK_LEASE_DURATION = int(os.environ.get('TASK_LEASE_DURATION', 300))  # in seconds
+TASK_LEASE_RENEWAL_PERIOD = TASK_LEASE_DURATION / 3  # in seconds
+TASK_CLAIM_BATCH_SIZE = 10  # max number of tasks claimed in one transaction
+
+# Task messages: an append-only subcollection (MESSAGES_KEY), messages are deleted once posted
+HAS_NEW_MESSAGES_KEY = 'hasNewMessages'
+MESSAGES_PAGE_SIZE = 400  # messages read and acknowledged at once, Firestore batches hold up to 500 writes
@@ -0,0 +1,187 @@
+"""
+Local reserve of leased API credentials
+
+A background thread keeps up to reserve_size credentials leased from Firestore ahead of need,
+so getting a key is a local pop instead of a query and a transaction. Leases are heartbeated
+(LEASE_EXPIRES_AT_KEY is moved forward) while this process holds the credentials, and released
+or rate-limited credentials are written to Firestore in batches. Released credentials go back
+to the reserve if it's not full, so they are not released and leased again.
+
+It's used by utils.credentials_store.CredentialsStore, which writes and claims the documents.
+"""
+import atexit
+import collections
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from agents.agents_utils.utils_constants import AGENT_UTILS_NAME
+from utils import logger
+
+CREDENTIALS_RESERVE_SIZE = int(os.environ.get('CREDENTIALS_RESERVE_SIZE', 2))  # credentials leased ahead of need
+CREDENTIALS_LEASE_DURATION = 300  # in seconds, a lease which isn't heartbeated expires after it
+CREDENTIALS_HEARTBEAT_PERIOD = 60  # in seconds
+CREDENTIALS_FLUSH_INTERVAL = 1  # in seconds, max time a release or a limit waits to be written
+CREDENTIALS_REFILL_PERIOD = 30  # in seconds, how often to look for credentials after none were free
+CREDENTIALS_TAKE_TIMEOUT = 5  # in seconds, how long to wait for credentials while the reserve is being filled
+MAX_BATCH_SIZE = 500  # Firestore's limit of writes in a batch
+
+
+class CredentialsReserve:
+    """
+    Credentials leased by this process, some of them ready to be handed out
+    """
+
+    def __init__(self, store, used_by: str, size: int = CREDENTIALS_RESERVE_SIZE):
+        """
+        :param store: CredentialsStore to lease and write the credentials with
+        :param used_by: ip address of the agent which leases the credentials
+        :param size: number of credentials to keep ready
+        """
+        self.__store = store
+        self.__used_by = used_by
+        self.__size = size
+
+        self.__condition = threading.Condition()
+        self.__ready = collections.deque()  # ids of credentials which are leased and not handed out
+        self.__held: Dict[str, Dict] = {}  # id -> content, of all the credentials leased by this process
+        self.__writes: Dict[str, Dict] = {}  # id -> fields to write with the next batch
+        self.__exhausted_at = None  # when no free credentials were found
+        self.__last_heartbeat = time.monotonic()
+
+        threading.Thread(target=self.__run, name=f'credentials_reserve_{used_by}', daemon=True).start()
+        atexit.register(self.close)
+
+    def take(self, timeout: float = CREDENTIALS_TAKE_TIMEOUT) -> Optional[Tuple[str, Dict]]:
+        """
+        Hands out leased credentials
+        :param timeout: seconds to wait if the reserve is empty but may still be filled
+        :return: id of credentials, the credentials document; None if there are no free credentials
+        """
+        with self.__condition:
+            self.__condition.notify_all()
+            self.__condition.wait_for(lambda: self.__ready or self.__is_exhausted(), timeout)
+            if not self.__ready:
+                return None
+            credentials_id = self.__ready.popleft()
+            # The background thread refills the reserve
+            self.__condition.notify_all()
+            return credentials_id, self.__held[credentials_id]
+
+    def give_back(self, credentials_id: str) -> bool:
+        """
+        Takes handed out credentials back, releasing them if the reserve is full
+        :param credentials_id: an id of credentials
+        :return: False if the credentials were not leased by this reserve
+        """
+        with self.__condition:
+            if credentials_id not in self.__held:
+                return False
+            if credentials_id in self.__ready:
+                return True
+            if len(self.__ready) < self.__size:
+                self.__ready.append(credentials_id)
+            else:
+                self.__held.pop(credentials_id)
+                self.__writes.setdefault(credentials_id, {}).update(self.__store.get_release_fields())
+            self.__condition.notify_all()
+            return True
+
+    def limit(self, credentials_id: str) -> bool:
+        """
+        Releases credentials which reached their rate limit, limiting them for their limit period.
+        They are never handed out again, so the next call goes to another key at once
+        :param credentials_id: an id of credentials
+        :return: False if the credentials were not leased by this reserve
+        """
+        with self.__condition:
+            credentials = self.__held.pop(credentials_id, None)
+            if credentials is None:
+                return False
+            if credentials_id in self.__ready:
+                self.__ready.remove(credentials_id)
+            fields = self.__writes.setdefault(credentials_id, {})
+            fields.update(self.__store.get_release_fields())
+            fields.update(self.__store.get_limit_fields(credentials))
+            self.__condition.notify_all()
+            return True
+
+    def close(self) -> None:
+        """
+        Releases all the credentials leased by this process, e.g. on exit
+        :return: Nothing
+        """
+        with self.__condition:
+            for credentials_id in self.__held:
+                self.__writes.setdefault(credentials_id, {}).update(self.__store.get_release_fields())
+            self.__held.clear()
+            self.__ready.clear()
+            self.__size = 0
+        self.__flush()
+
+    def __is_exhausted(self) -> bool:
+        """Checks if no free credentials were found during the last CREDENTIALS_REFILL_PERIOD"""
+        return self.__exhausted_at is not None and time.monotonic() - self.__exhausted_at < CREDENTIALS_REFILL_PERIOD
+
+    def __run(self) -> None:
+        """Writes the batches, refills the reserve and heartbeats the leases"""
+        while True:
+            # Releases and limits gather for CREDENTIALS_FLUSH_INTERVAL, an emptied reserve is refilled at once
+            with self.__condition:
+                self.__condition.wait_for(self.__needs_refill, CREDENTIALS_FLUSH_INTERVAL)
+            try:
+                self.__flush()
+                self.__refill()
+                if time.monotonic() - self.__last_heartbeat >= CREDENTIALS_HEARTBEAT_PERIOD:
+                    self.__heartbeat()
+            except Exception as e:
+                logger.exception(AGENT_UTILS_NAME, f'Credentials reserve failed. Error {e}')
+
+    def __needs_refill(self) -> bool:
+        """Checks if the reserve isn't full and credentials may be found (the condition must be held)"""
+        return len(self.__ready) < self.__size and not self.__is_exhausted()
+
+    def __refill(self) -> None:
+        """Leases credentials until the reserve is full or there are no free ones"""
+        while True:
+            with self.__condition:
+                if not self.__needs_refill():
+                    return
+
+            credentials = self.__store.claim_credentials(self.__used_by)
+            with self.__condition:
+                if not credentials:
+                    self.__exhausted_at = time.monotonic()
+                    self.__condition.notify_all()
+                    return
+                credentials_id, content = credentials
+                self.__exhausted_at = None
+                self.__held[credentials_id] = content
+                self.__ready.append(credentials_id)
+                self.__condition.notify_all()
+
+    def __heartbeat(self) -> None:
+        """Extends the leases of all the held credentials"""
+        self.__last_heartbeat = time.monotonic()
+        fields = self.__store.get_lease_fields(CREDENTIALS_LEASE_DURATION)
+        with self.__condition:
+            for credentials_id in self.__held:
+                self.__writes.setdefault(credentials_id, {}).update(fields)
+        self.__flush()
+
+    def __flush(self) -> None:
+        """Writes the queued fields, in batches"""
+        with self.__condition:
+            writes, self.__writes = self.__writes, {}
+        items = list(writes.items())
+        for start in range(0, len(items), MAX_BATCH_SIZE):
+            batch = items[start:start + MAX_BATCH_SIZE]
+            try:
+                self.__store.write_credentials_batch(dict(batch))
+            except Exception as e:
+                logger.warning(AGENT_UTILS_NAME, f'Failed to write {len(batch)} credentials. Error {e}')
+                with self.__condition:
+                    for credentials_id, fields in batch:
+                        # Newer fields win
+                        self.__writes[credentials_id] = {**fields, **self.__writes.get(credentials_id, {})}
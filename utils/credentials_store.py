@@ -3,6 +3,7 @@ Class to access credentials stored in Firestore
 """
 import datetime
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, Dict
 
 import pytz
@@ -13,19 +14,27 @@ from google.cloud.firestore_v1beta1 import DocumentSnapshot, Transaction, Docume
 from agents.agents_utils.utils_constants import AGENT_UTILS_NAME
 from utils import logger
 from utils.cloud_firestore_communication import Firestore
+from utils.credentials_reserve import CredentialsReserve, CREDENTIALS_RESERVE_SIZE, CREDENTIALS_LEASE_DURATION, \
+    MAX_BATCH_SIZE
 
 NAME_KEY = 'name'
 LIMITED_UNTIL_KEY = 'limitedUntil'
 LIMIT_PERIOD_KEY = 'limitPeriod'
 IN_USE_KEY = 'inUse'
 USED_BY_KEY = 'usedBy'
+LEASE_EXPIRES_AT_KEY = 'leaseExpiresAt'
 VALUE_KEY = 'value'
 CREDENTIALS_APIS = ['epo', 'twitter', 'news']
+CREDENTIALS_SWEEP_PING_TIMEOUT = 3  # in seconds
+CREDENTIALS_SWEEP_WORKERS = 32
+CREDENTIALS_EXPIRED_LEASES_PAGE_SIZE = 10  # credentials with expired leases looked at in one claim
 
 
 def set_in_use_parameters_to_false():
     """
     Used to check all inUse parameters and set them to False
+    Every distinct agent which uses credentials is pinged once, all of them at once,
+    and the credentials of silent agents are released in batches
     :return: Nothing
     """
 
@@ -35,25 +44,35 @@ def set_in_use_parameters_to_false():
         :param ip: an ip address of an agent with port for request
         :return: True if the request was successful, false otherwise
         """
+        if not ip:
+            return False
         response = None
         try:
-            response = requests.get(f'{ip}/ping')
+            response = requests.get(f'{ip}/ping', timeout=CREDENTIALS_SWEEP_PING_TIMEOUT)
             response.raise_for_status()
         except requests.RequestException as e:
-            logger.warning(f'Could not ping agent instance {ip}. Error {e}', response)
+            logger.warning(AGENT_UTILS_NAME, f'Could not ping agent instance {ip}. Error {e}', response)
             return False
         return True
 
     credentials_key = os.environ['CREDENTIALS_DB_KEY']
 
     credential_db = Firestore(credentials_key)
-    for api in CREDENTIALS_APIS:
-        for doc in credential_db.db.collection(api).get():
-            content = credential_db.get_doc_content(doc.reference)
-            if content[IN_USE_KEY]:
-                if not ping_agent_ip(content.get(USED_BY_KEY)):
-                    credential_db.update_document(doc.reference, {IN_USE_KEY: False,
-                                                                  USED_BY_KEY: None})
+    with ThreadPoolExecutor(max_workers=CREDENTIALS_SWEEP_WORKERS) as executor:
+        collections = executor.map(lambda api: list(credential_db.db.collection(api).get()), CREDENTIALS_APIS)
+        docs_in_use = [doc for docs in collections for doc in docs if (doc.to_dict() or {}).get(IN_USE_KEY)]
+
+        hosts = {doc.to_dict().get(USED_BY_KEY) for doc in docs_in_use}
+        alive_hosts = {host for host, alive in zip(hosts, executor.map(ping_agent_ip, hosts)) if alive}
+
+    refs_to_release = [doc.reference for doc in docs_in_use if doc.to_dict().get(USED_BY_KEY) not in alive_hosts]
+    for start in range(0, len(refs_to_release), MAX_BATCH_SIZE):
+        batch = credential_db.firestore.batch()
+        for doc_ref in refs_to_release[start:start + MAX_BATCH_SIZE]:
+            batch.update(doc_ref, {IN_USE_KEY: False, USED_BY_KEY: None})
+        batch.commit()
+    logger.info(AGENT_UTILS_NAME, f'Pinged {len(hosts)} agents using {len(docs_in_use)} credentials,'
+                                  f' released {len(refs_to_release)} credentials')
 
 
 class CredentialsStore(Firestore):
@@ -61,10 +80,12 @@ class CredentialsStore(Firestore):
     Class for credentials management
     """
 
-    def __init__(self, service_name: str):
+    def __init__(self, service_name: str, used_by_id: str = None, reserve_size: int = CREDENTIALS_RESERVE_SIZE):
         """
         Initialise a store
         :param service_name: a name of a service for which credentials are needed
+        :param used_by_id: ip address of agent which get credentials, to lease them ahead of need
+        :param reserve_size: number of credentials to lease ahead of need, if used_by_id is given
         """
         try:
             credentials_key = os.environ['CREDENTIALS_DB_KEY']
@@ -73,21 +94,45 @@ class CredentialsStore(Firestore):
             raise Exception(f'CREDENTIALS_DB_KEY is undefined')
         super().__init__(credentials_key)
         self.db = self.db.collection(service_name)
+        self.__reserve = CredentialsReserve(self, used_by_id, reserve_size) if used_by_id and reserve_size else None
 
     def get_credentials_for_service(self, used_by_id: str = '') -> Optional[Tuple[str, Dict]]:
         """
         Get an API credentials for a 3rd party service. Mark it as used
-        
+        Credentials are taken from the local reserve if the store has one
+
         You would need to create an index for each new service in Firestore
         :param used_by_id: ip address of agent which get credentials
         :return: id of credentials, credentials values
         """
+        credentials = self.__reserve.take() if self.__reserve else self.claim_credentials(used_by_id)
+        if not credentials:
+            return None
+        credentials_id, content = credentials
+        return credentials_id, content[VALUE_KEY]
+
+    def claim_credentials(self, used_by_id: str = '') -> Optional[Tuple[str, Dict]]:
+        """
+        Lease free API credentials in Firestore
+        Credentials which lease has expired (the process which leased them stopped heartbeating it) are free too
+        :param used_by_id: ip address of agent which get credentials
+        :return: id of credentials, the credentials document
+        """
+        now = datetime.datetime.now(pytz.UTC)
         credentials_query = self.db \
-            .where(LIMITED_UNTIL_KEY, '<=', datetime.datetime.now(pytz.UTC)) \
+            .where(LIMITED_UNTIL_KEY, '<=', now) \
             .where(IN_USE_KEY, '==', False) \
             .limit(1)
         credentials_obj = [key for key in credentials_query.get()]
 
+        if not credentials_obj:
+            # Firestore can't filter on two fields with inequalities, the limit is checked here
+            expired_leases_query = self.db \
+                .where(LEASE_EXPIRES_AT_KEY, '<=', now) \
+                .where(IN_USE_KEY, '==', True) \
+                .limit(CREDENTIALS_EXPIRED_LEASES_PAGE_SIZE)
+            credentials_obj = [key for key in expired_leases_query.get() if self.__is_free(key.to_dict(), now)]
+
         if not credentials_obj:
             return None
 
@@ -97,12 +142,16 @@ class CredentialsStore(Firestore):
         @firestore.transactional
         def update_in_transaction(transaction: Transaction, doc_ref: DocumentReference):
             credentials_doc = doc_ref.get(transaction=transaction)
+            if not self.__is_free(credentials_doc.to_dict(), datetime.datetime.now(pytz.UTC)):
+                # Leased by someone else since the query
+                return None
             transaction.update(doc_ref, {
                 IN_USE_KEY: True,
-                USED_BY_KEY: used_by_id
+                USED_BY_KEY: used_by_id,
+                **self.get_lease_fields(),
             })
 
-            return credentials_doc.id, credentials_doc.to_dict()[VALUE_KEY]
+            return credentials_doc.id, credentials_doc.to_dict()
 
         try:
             return update_in_transaction(query_transaction, credentials_obj.reference)
@@ -113,22 +162,72 @@ class CredentialsStore(Firestore):
     def release_credentials_for_service(self, credentials_id: str):
         """
         Make credentials available for usage
+        With a local reserve they are kept in it if it's not full, or released with the next batch
         :param credentials_id: an id of credentials
         :return: Nothing
         """
-        self.db.document(credentials_id).update({
-            IN_USE_KEY: False
-        })
+        if self.__reserve and self.__reserve.give_back(credentials_id):
+            return
+        self.db.document(credentials_id).update(self.get_release_fields())
 
     def limit_credentials_for_service_usage(self, credentials_id: str):
         """
-        Limit credentials usage for a period of time
+        Limit credentials usage for a period of time and release them, in one write,
+        so they are never free and not limited. They must not be released again
+        With a local reserve they are never handed out again and limited with the next batch
         :param credentials_id: an id of the key
         :return: Nothing
         """
+        if self.__reserve and self.__reserve.limit(credentials_id):
+            return
         credentials_ref = self.db.document(credentials_id)
-        limit_period = credentials_ref.get().to_dict()[LIMIT_PERIOD_KEY]
-        limited_until = datetime.datetime.now(pytz.UTC) + datetime.timedelta(seconds=limit_period)
         credentials_ref.update({
-            LIMITED_UNTIL_KEY: limited_until,
+            **self.get_release_fields(),
+            **self.get_limit_fields(credentials_ref.get().to_dict()),
         })
+
+    def write_credentials_batch(self, updates: Dict[str, Dict]):
+        """
+        Update several credentials in one batch
+        :param updates: id of credentials -> fields to update
+        :return: Nothing
+        """
+        batch = self.firestore.batch()
+        for credentials_id, fields in updates.items():
+            batch.update(self.db.document(credentials_id), fields)
+        batch.commit()
+
+    @staticmethod
+    def __is_free(credentials: Dict, now: datetime.datetime) -> bool:
+        """
+        Checks if credentials may be leased: they are not limited, and not in use or their lease has expired
+        :param credentials: the credentials document
+        :param now: current time, in UTC
+        """
+        limited_until = credentials.get(LIMITED_UNTIL_KEY)
+        if limited_until and limited_until > now:
+            return False
+        lease_expires_at = credentials.get(LEASE_EXPIRES_AT_KEY)
+        return not credentials.get(IN_USE_KEY) or bool(lease_expires_at and lease_expires_at <= now)
+
+    @staticmethod
+    def get_release_fields() -> Dict:
+        """Returns fields to make credentials available for usage"""
+        return {IN_USE_KEY: False}
+
+    @staticmethod
+    def get_limit_fields(credentials: Dict) -> Dict:
+        """
+        Returns fields to limit credentials usage for their limit period
+        :param credentials: the credentials document
+        """
+        limit_period = credentials[LIMIT_PERIOD_KEY]
+        return {LIMITED_UNTIL_KEY: datetime.datetime.now(pytz.UTC) + datetime.timedelta(seconds=limit_period)}
+
+    @staticmethod
+    def get_lease_fields(lease_duration: float = CREDENTIALS_LEASE_DURATION) -> Dict:
+        """
+        Returns fields to extend the lease of credentials
+        :param lease_duration: seconds the lease lasts if it's not extended again
+        """
+        return {LEASE_EXPIRES_AT_KEY: datetime.datetime.now(pytz.UTC) + datetime.timedelta(seconds=lease_duration)}
@@ -0,0 +1,182 @@
+"""
+Event-driven claiming of agent tasks
+
+A Firestore snapshot listener keeps every claimable task of one kind in a local ready queue,
+so a new or released task is picked up in milliseconds instead of after a poll period, and no query is re-run.
+Tasks that have a TIME_TO_UPDATE_KEY become ready at that time, tasks for listeners are ready at once;
+a task leased by someone becomes ready when the lease expires.
+
+Basic usage:
+    subscription = TaskSubscription(db, task_name, listener=True).start()
+    doc_ref = subscription.next_ready(timeout=1)
+    if doc_ref:
+        doc_ref = db.claim_agent_task(doc_ref, LISTENER_LEASE_KEY, runners_dict)
+"""
+import heapq
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from google.cloud.firestore_v1beta1 import DocumentReference, DocumentSnapshot
+
+from utils import logger
+from utils.cloud_firestore_communication import Firestore
+from utils.constants import *
+
+
+class TaskSubscription:
+    """
+    Local ready queue of claimable tasks, fed by a Firestore snapshot listener
+    """
+
+    def __init__(self, db: Firestore, task_name: str, listener: bool = None, worker: bool = None,
+                 update: bool = None, constant_monitoring: bool = True):
+        """
+        :param db: Firestore of the agent
+        :param task_name: a name of an agent task to subscribe to
+        :param listener: if tasks are claimed by listeners
+        :param worker: if tasks are claimed by workers
+        :param update: if tasks are claimed for update
+        :param constant_monitoring: whether tasks are constant monitoring ones
+        """
+        self.__db = db
+        self.__task_name = task_name
+        self.__listener = listener
+        self.__lease_key = db.get_task_lease_key(listener=listener, worker=worker, update=update)
+        self.__constant_monitoring = constant_monitoring
+
+        # doc_id -> (time it becomes ready, reference); the heap may hold outdated entries, skipped on pop
+        self.__tasks: Dict[str, Tuple[float, DocumentReference]] = {}
+        self.__ready_heap = []
+        self.__condition = threading.Condition()
+        self.__watch = None
+
+    def start(self) -> 'TaskSubscription':
+        """
+        Subscribes to the claimable tasks
+        :return: the subscription itself
+        """
+        query = self.__db.get_claimable_tasks_query(self.__task_name, constant_monitoring=self.__constant_monitoring,
+                                                    listener=self.__listener)
+        self.__watch = query.on_snapshot(self.__on_snapshot)
+        return self
+
+    def stop(self) -> None:
+        """
+        Unsubscribes and wakes up the threads waiting for tasks
+        :return: Nothing
+        """
+        if self.__watch is not None:
+            try:
+                self.__watch.unsubscribe()
+            except Exception as e:
+                logger.warning(UTILS, f'Could not unsubscribe from {self.__task_name} tasks. Error: {e}')
+            self.__watch = None
+        with self.__condition:
+            self.__tasks.clear()
+            self.__ready_heap.clear()
+            self.__condition.notify_all()
+
+    def next_ready(self, timeout: float = None) -> Optional[DocumentReference]:
+        """
+        Waits for a task which is ready to be claimed.
+        The task is not claimed yet, as another instance may take it first, use Firestore.claim_agent_task
+        :param timeout: seconds to wait, None to wait until a task is ready
+        :return: a reference to the task's document, or None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            while True:
+                now = time.time()
+                while self.__ready_heap:
+                    ready_at, doc_id = self.__ready_heap[0]
+                    task = self.__tasks.get(doc_id)
+                    if task is None or task[0] != ready_at:
+                        heapq.heappop(self.__ready_heap)
+                        continue
+                    if ready_at <= now:
+                        heapq.heappop(self.__ready_heap)
+                        return self.__tasks.pop(doc_id)[1]
+                    break
+
+                wait_time = self.__ready_heap[0][0] - now if self.__ready_heap else None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                self.__condition.wait(wait_time)
+
+    def serve(self, runners_dict: Dict, lock: threading.Lock, is_running: Callable[[], bool],
+              handler: Callable[[DocumentReference], None]) -> None:
+        """
+        Claims ready tasks while is_running() is True and handles every claimed one in a new thread.
+        Unsubscribes when stopped
+        :param runners_dict: a dict to store doc references and clear them on process exit
+        :param lock: a lock to hold while claiming, the one used to release the tasks on exit
+        :param is_running: a function telling if the claiming should go on
+        :param handler: a function to handle a claimed task
+        :return: Nothing
+        """
+        try:
+            while True:
+                doc_ref = self.next_ready(timeout=TASK_SUBSCRIPTION_WAIT_TIMEOUT)
+                with lock:
+                    if not is_running():
+                        return
+                    if doc_ref is None:
+                        continue
+                    try:
+                        claimed_doc_ref = self.__db.claim_agent_task(doc_ref, self.__lease_key, runners_dict)
+                    except Exception as e:
+                        logger.warning(UTILS, f'Could not claim {self.__task_name} task. Error: {e}')
+                        self.__requeue(doc_ref, delay=TASK_SUBSCRIPTION_WAIT_TIMEOUT)
+                        claimed_doc_ref = None
+                    doc_ref = claimed_doc_ref
+                if doc_ref:
+                    threading.Thread(target=handler, args=(doc_ref,), daemon=True).start()
+        finally:
+            self.stop()
+
+    def __requeue(self, doc_ref: DocumentReference, delay: float) -> None:
+        """Puts back a task which could not be claimed, unless a newer snapshot of it has arrived"""
+        with self.__condition:
+            if doc_ref.id in self.__tasks:
+                return
+            ready_at = time.time() + delay
+            self.__tasks[doc_ref.id] = (ready_at, doc_ref)
+            heapq.heappush(self.__ready_heap, (ready_at, doc_ref.id))
+            self.__condition.notify_all()
+
+    def __on_snapshot(self, docs, changes, read_time) -> None:
+        """
+        Moves the changed tasks into the ready queue (runs in the listener's thread)
+        """
+        with self.__condition:
+            for change in changes:
+                doc: DocumentSnapshot = change.document
+                if change.type.name == 'REMOVED':
+                    self.__tasks.pop(doc.id, None)
+                    continue
+
+                ready_at = self.__get_ready_time(doc)
+                self.__tasks[doc.id] = (ready_at, doc.reference)
+                heapq.heappush(self.__ready_heap, (ready_at, doc.id))
+            self.__condition.notify_all()
+
+    def __get_ready_time(self, doc: DocumentSnapshot) -> float:
+        """Returns the epoch time the task should be claimed at"""
+        content = doc.to_dict() or {}
+        ready_at = time.time()
+
+        #  Listeners check for new messages independently of the update time
+        time_to_update = content.get(TIME_TO_UPDATE_KEY)
+        if not self.__listener and isinstance(time_to_update, datetime):
+            ready_at = max(ready_at, time_to_update.timestamp())
+
+        lease = content.get(self.__lease_key) or {}
+        expires_at = lease.get(LEASE_EXPIRES_AT_KEY)
+        if lease.get(LEASE_OWNER_KEY) and isinstance(expires_at, datetime):
+            ready_at = max(ready_at, expires_at.timestamp())
+        return ready_at
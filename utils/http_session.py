@@ -0,0 +1,259 @@
+"""
+Keep-alive HTTP sessions with bounded per-host connection pools
+
+Requests to upstreams can be aborted from another thread with a RequestCanceller, e.g. the losing one
+of hedged requests:
+    canceller = RequestCanceller()
+    ...in one thread: sessions.request('GET', url, canceller=canceller)  # raises requests.ConnectionError
+    ...in another one: canceller.cancel()
+"""
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from utils.constants import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_POOL_BLOCK, HTTP_MAX_RETRIES, \
+    HTTP_POOL_IDLE_TIMEOUT, HTTP_POOL_EVICTION_PERIOD, UPSTREAM_SESSIONS_MAX
+
+
+class RequestCanceller:
+    """
+    Aborts requests in flight from another thread by shutting down the sockets of their connections.
+    Only the connections taken by the requests made with the canceller are shut down, and only until
+    they are returned to their pool, so the other requests sharing the pool are not affected.
+    A request whose connection isn't established yet when it's cancelled runs to the end
+    """
+    __local = threading.local()  # the canceller of the request the thread is making
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__connections = set()
+        self.__cancelled = False
+
+    def cancel(self) -> None:
+        """
+        Aborts the requests made with the canceller which are in flight, and the ones made afterwards
+        :return: Nothing
+        """
+        with self.__lock:
+            self.__cancelled = True
+            for connection in self.__connections:
+                self.__shut_down(connection)
+
+    def is_cancelled(self) -> bool:
+        """Checks whether cancel() was called"""
+        return self.__cancelled
+
+    @contextmanager
+    def activate(self):
+        """Makes the connections taken by the thread meanwhile belong to the canceller"""
+        RequestCanceller.__local.canceller = self
+        try:
+            yield
+        finally:
+            RequestCanceller.__local.canceller = None
+
+    @classmethod
+    def on_connection_taken(cls, connection) -> None:
+        """Called by a pool when a connection is taken, to track it by the thread's canceller if any"""
+        canceller = getattr(cls.__local, 'canceller', None)
+        if canceller is None:
+            return
+        with canceller.__lock:
+            connection.request_canceller = canceller
+            canceller.__connections.add(connection)
+            if canceller.__cancelled:
+                canceller.__shut_down(connection)
+
+    @staticmethod
+    def on_connection_returned(connection) -> None:
+        """Called by a pool when a connection is returned to it, so its canceller doesn't touch it anymore"""
+        canceller = getattr(connection, 'request_canceller', None)
+        if canceller is None:
+            return
+        with canceller.__lock:
+            canceller.__connections.discard(connection)
+            connection.request_canceller = None
+
+    @staticmethod
+    def __shut_down(connection) -> None:
+        """Shuts the connection's socket down, which wakes up the thread blocked on it with an error"""
+        sock = getattr(connection, 'sock', None)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # closed already
+
+
+class CancellableHTTPConnectionPool(HTTPConnectionPool):
+    """HTTP connection pool whose connections can be shut down by a RequestCanceller"""
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        RequestCanceller.on_connection_taken(connection)
+        return connection
+
+    def _put_conn(self, conn):
+        RequestCanceller.on_connection_returned(conn)
+        super()._put_conn(conn)
+
+
+class CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    """HTTPS connection pool whose connections can be shut down by a RequestCanceller"""
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        RequestCanceller.on_connection_taken(connection)
+        return connection
+
+    def _put_conn(self, conn):
+        RequestCanceller.on_connection_returned(conn)
+        super()._put_conn(conn)
+
+
+class CancellableHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose requests can be aborted with a RequestCanceller"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CancellableHTTPConnectionPool,
+            'https': CancellableHTTPSConnectionPool,
+        }
+
+
+def create_pooled_session(pool_connections: int = HTTP_POOL_CONNECTIONS,
+                          pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                          pool_block: bool = HTTP_POOL_BLOCK,
+                          max_retries: int = HTTP_MAX_RETRIES,
+                          cancellable: bool = False) -> Session:
+    """
+    Creates a requests.Session which reuses TCP (and TLS) connections between calls.
+    The underlying urllib3 pools are thread-safe, so one session can be shared by all the threads of a process
+
+    :param pool_connections: Number of hosts to keep a connection pool for
+    :param pool_maxsize: Maximum number of keep-alive connections per host
+    :param pool_block: Either to wait for a free connection when a host's pool is exhausted,
+                       or to open a throwaway one
+    :param max_retries: Number of retries on connection errors (never on read errors)
+    :param cancellable: Whether the session's requests can be aborted with a RequestCanceller
+
+    :return: Session with the pooled adapter mounted for both http and https
+    """
+    session = Session()
+    adapter = (CancellableHTTPAdapter if cancellable else HTTPAdapter)(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=pool_block,
+                          max_retries=max_retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class UpstreamSessions:
+    """
+    Keep-alive sessions to a changing set of upstreams (agents, agent handlers), one pool per upstream
+
+    Each upstream gets its own bounded pool. Pools idle for more than idle_timeout seconds are closed,
+    as well as the least recently used ones above max_upstreams, so connections to upstreams
+    which went away are not kept forever
+    """
+
+    def __init__(self, max_upstreams: int = UPSTREAM_SESSIONS_MAX,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 idle_timeout: float = HTTP_POOL_IDLE_TIMEOUT):
+        """
+        :param max_upstreams: Maximum number of upstreams to keep a pool for
+        :param pool_maxsize: Maximum number of keep-alive connections per upstream
+        :param idle_timeout: Seconds after which an unused upstream's pool is closed
+        """
+        self.__max_upstreams = max_upstreams
+        self.__pool_maxsize = pool_maxsize
+        self.__idle_timeout = idle_timeout
+
+        self.__lock = threading.Lock()
+        self.__sessions: OrderedDict = OrderedDict()  # upstream -> [session, last use time, requests in flight]
+        self.__last_eviction = time.monotonic()
+
+    def request(self, method: str, url: str, canceller: RequestCanceller = None, **kwargs) -> Response:
+        """
+        Makes an HTTP request through the pool of the URL's upstream
+
+        :param method: {GET|POST|PUT|PATCH|DELETE}
+        :param url: Full URL of the request
+        :param canceller: RequestCanceller to abort the request with from another thread, if any
+        :param kwargs: Any other requests.request parameter (params, data, timeout...)
+
+        :return: requests.Response
+        """
+        upstream = self.__get_upstream(url)
+        entry = self.__acquire(upstream)
+        try:
+            if canceller is None:
+                return entry[0].request(method=method, url=url, **kwargs)
+            with canceller.activate():
+                return entry[0].request(method=method, url=url, **kwargs)
+        finally:
+            with self.__lock:
+                entry[1] = time.monotonic()
+                entry[2] -= 1
+
+    def close(self, url: str) -> None:
+        """
+        Closes the pool of the URL's upstream, e.g. when it's known to be gone
+        :param url: The upstream's address or any URL of it
+        :return: Nothing
+        """
+        with self.__lock:
+            entry = self.__sessions.pop(self.__get_upstream(url), None)
+        if entry:
+            entry[0].close()
+
+    def __acquire(self, upstream: str) -> list:
+        """Returns the upstream's entry, creating its pool if needed, and counts a request in flight"""
+        evicted = []
+        with self.__lock:
+            entry = self.__sessions.get(upstream)
+            if entry is None:
+                entry = [create_pooled_session(pool_connections=1, pool_maxsize=self.__pool_maxsize, cancellable=True),
+                         0.0, 0]
+                self.__sessions[upstream] = entry
+            self.__sessions.move_to_end(upstream)
+            entry[1] = time.monotonic()
+            entry[2] += 1
+            evicted = self.__evict()
+
+        for session in evicted:
+            session.close()
+        return entry
+
+    def __evict(self) -> list:
+        """Removes idle pools and the least recently used ones above the limit (the lock must be held)"""
+        now = time.monotonic()
+        evicted = []
+        if now - self.__last_eviction >= min(self.__idle_timeout, HTTP_POOL_EVICTION_PERIOD):
+            self.__last_eviction = now
+            for upstream, (session, last_used, in_flight) in list(self.__sessions.items()):
+                if not in_flight and now - last_used > self.__idle_timeout:
+                    evicted.append(self.__sessions.pop(upstream)[0])
+
+        for upstream, (session, _, in_flight) in list(self.__sessions.items()):
+            if len(self.__sessions) <= self.__max_upstreams:
+                break
+            if not in_flight:
+                evicted.append(self.__sessions.pop(upstream)[0])
+        return evicted
+
+    @staticmethod
+    def __get_upstream(url: str) -> str:
+        """Returns scheme://host:port of a URL, or the URL itself if it has no scheme"""
+        parsed = urlsplit(url)
+        return f'{parsed.scheme}://{parsed.netloc}' if parsed.netloc else url
@@ -114,7 +114,7 @@ class Link:
 
             headers = platform_access.get_headers(http_method, url, values, detail, payload=payload,
                                                   additional_headers=additional_headers)
-            response = requests.post(url=url, headers=headers, data=payload.encode())
+            response = platform_access.request('POST', url=url, headers=headers, data=payload.encode())
             response_status = response.status_code
             response.raise_for_status()
             return response_status
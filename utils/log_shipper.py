@@ -0,0 +1,282 @@
+"""
+Batching shipper of structured log records
+
+Records are buffered in memory (up to max_buffered) and sent by a background thread
+in batches of max_batch_size, or whatever has been gathered after max_batch_delay seconds.
+When the sink fails, or the buffer is full, records are appended to a local spill file
+and replayed once the sink accepts batches again, including files left by previous runs.
+
+It's used by utils.logger, so it reports its own problems with print only.
+
+Basic usage:
+    shipper = LogShipper(GoogleCloudLoggingSink(google_logger), spill_directory)
+    shipper.ship({'message': 'Hello'}, severity='INFO')
+"""
+
+import collections
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 100))  # records per batch
+LOG_BATCH_DELAY = float(os.environ.get('LOG_BATCH_DELAY', 2))  # in seconds, max time a record waits for a batch
+LOG_SHIPPER_BUFFER_SIZE = int(os.environ.get('LOG_SHIPPER_BUFFER_SIZE', 5000))  # records kept in memory
+LOG_SHIPPER_RETRY_PERIOD = 30  # in seconds, how long to spill records after the sink failed
+
+SPILL_FILE_EXTENSION = '.jsonl'
+REPLAYING_FILE_EXTENSION = '.replaying'
+
+
+class GoogleCloudLoggingSink:
+    """Sends batches to Google Cloud Logging"""
+
+    def __init__(self, google_logger):
+        """
+        :param google_logger: google.cloud.logging.Logger to send records with
+        """
+        self.__google_logger = google_logger
+
+    def write_batch(self, records: List[Tuple[Dict, str]]) -> None:
+        """
+        Sends the records in one request
+        :param records: (struct, severity) pairs
+        :return: Nothing, raises if the records were not sent
+        """
+        batch = self.__google_logger.batch()
+        for struct, severity in records:
+            batch.log_struct(struct, severity=severity)
+        batch.commit()
+
+
+class LocalFileSink:
+    """Local stand-in for Google Cloud Logging, appends batches to a JSON lines file"""
+
+    def __init__(self, file_path: str):
+        """
+        :param file_path: Path of the file to append records to
+        """
+        self.__file_path = file_path
+
+    def write_batch(self, records: List[Tuple[Dict, str]]) -> None:
+        """
+        Appends the records to the file
+        :param records: (struct, severity) pairs
+        :return: Nothing
+        """
+        os.makedirs(os.path.dirname(self.__file_path), exist_ok=True)
+        with open(self.__file_path, 'a', encoding='utf-8') as file:
+            for struct, severity in records:
+                print(json.dumps({'severity': severity, 'struct': struct}, default=str), file=file)
+
+
+class LogShipper:
+    """
+    Bounded in-memory buffer of records, shipped in batches by a background thread
+    """
+
+    def __init__(self, sink, spill_directory: str, max_batch_size: int = LOG_BATCH_SIZE,
+                 max_batch_delay: float = LOG_BATCH_DELAY, max_buffered: int = LOG_SHIPPER_BUFFER_SIZE):
+        """
+        :param sink: An object with write_batch(records), like GoogleCloudLoggingSink or LocalFileSink
+        :param spill_directory: Directory for records which could not be sent
+        :param max_batch_size: Maximum number of records in a batch
+        :param max_batch_delay: Seconds to gather a batch
+        :param max_buffered: Maximum number of records kept in memory
+        """
+        self.__sink = sink
+        self.__spill_directory = spill_directory
+        self.__spill_path = os.path.join(spill_directory, f'{os.getpid()}{SPILL_FILE_EXTENSION}')
+        self.__file_numbers = itertools.count(1)  # for the names of the files taken over, see __new_file_path
+        self.__max_batch_size = max_batch_size
+        self.__max_batch_delay = max_batch_delay
+        self.__max_buffered = max_buffered
+
+        self.__buffer = collections.deque()
+        self.__condition = threading.Condition()
+        self.__sending = False
+        self.__sink_failed_at = None
+        self.__spill_lock = threading.Lock()
+        self.__replay_needed = True  # spill files of previous runs may exist
+
+        threading.Thread(target=self.__ship_batches, name='log_shipper', daemon=True).start()
+
+    def ship(self, struct: Dict, severity: str) -> None:
+        """
+        Queues a record, spilling it to disk if the buffer is full or the sink is failing. Never blocks on the sink
+        :param struct: The record
+        :param severity: Its severity
+        :return: Nothing
+        """
+        with self.__condition:
+            if len(self.__buffer) < self.__max_buffered and not self.__is_sink_failing():
+                self.__buffer.append((struct, severity))
+                if len(self.__buffer) >= self.__max_batch_size:
+                    self.__condition.notify_all()
+                return
+        self.__spill([(struct, severity)])
+
+    def flush(self, timeout: float = None) -> None:
+        """
+        Waits until the buffered records are sent or spilled
+        :param timeout: Seconds to wait, None to wait forever
+        :return: Nothing
+        """
+        with self.__condition:
+            self.__condition.notify_all()
+            self.__condition.wait_for(lambda: not self.__buffer and not self.__sending, timeout)
+
+    def __is_sink_failing(self) -> bool:
+        """Checks if the sink has failed during the last LOG_SHIPPER_RETRY_PERIOD"""
+        return self.__sink_failed_at is not None \
+            and time.monotonic() - self.__sink_failed_at < LOG_SHIPPER_RETRY_PERIOD
+
+    def __ship_batches(self) -> None:
+        """Sends the buffered records in batches, then replays the spilled ones"""
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: len(self.__buffer) >= self.__max_batch_size,
+                                          self.__max_batch_delay)
+                batch = [self.__buffer.popleft() for _ in range(min(len(self.__buffer), self.__max_batch_size))]
+                self.__sending = bool(batch)
+
+            try:
+                if batch and not self.__send(batch):
+                    self.__spill(batch)
+                if not self.__is_sink_failing() and self.__replay_needed:
+                    self.__replay()
+            except Exception as e:
+                print(f'Log shipper failed. Error message: {e}')
+            finally:
+                with self.__condition:
+                    self.__sending = False
+                    self.__condition.notify_all()
+
+    def __send(self, batch: List[Tuple[Dict, str]]) -> bool:
+        """Sends a batch, returns False if the sink failed"""
+        try:
+            self.__sink.write_batch(batch)
+        except Exception as e:
+            print(f'Could not send {len(batch)} log records, spilling them to disk. Error message: {e}')
+            self.__sink_failed_at = time.monotonic()
+            return False
+        self.__sink_failed_at = None
+        return True
+
+    def __spill(self, records: List[Tuple[Dict, str]]) -> None:
+        """Appends records to this process's spill file"""
+        with self.__spill_lock:
+            try:
+                os.makedirs(self.__spill_directory, exist_ok=True)
+                with open(self.__spill_path, 'a', encoding='utf-8') as file:
+                    for struct, severity in records:
+                        print(json.dumps([struct, severity], default=str), file=file)
+                self.__replay_needed = True
+            except Exception as e:
+                print(f'Could not spill {len(records)} log records. Error message: {e}')
+
+    def __replay(self) -> None:
+        """Sends the records of the spill files, keeping the ones which could not be sent"""
+        self.__replay_needed = False
+        for spill_path in self.__get_spill_files():
+            # Take the file over, so records spilled meanwhile go to a new one and other processes skip it
+            with self.__spill_lock:
+                replaying_path = self.__new_file_path(REPLAYING_FILE_EXTENSION)
+                try:
+                    os.rename(spill_path, replaying_path)
+                except OSError:
+                    continue
+
+            try:
+                sent = self.__replay_file(replaying_path)
+            except Exception as e:
+                print(f'Could not replay spilled log records, keeping them. Error message: {e}')
+                # A new name, as a spill file with the old one may exist by now
+                with self.__spill_lock:
+                    os.rename(replaying_path, self.__new_file_path(SPILL_FILE_EXTENSION))
+                self.__replay_needed = True
+                return
+            os.remove(replaying_path)
+            if not sent:
+                return
+
+    def __get_spill_files(self) -> List[str]:
+        """Returns the spill files, including the ones left being replayed by processes which are gone"""
+        spill_paths = glob.glob(os.path.join(self.__spill_directory, f'*{SPILL_FILE_EXTENSION}'))
+        for replaying_path in glob.glob(os.path.join(self.__spill_directory, f'*{REPLAYING_FILE_EXTENSION}')):
+            pid = os.path.basename(replaying_path).split('-', 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not self.__is_process_alive(int(pid)):
+                spill_paths.append(replaying_path)
+        return spill_paths
+
+    def __new_file_path(self, extension: str) -> str:
+        """
+        Returns a path in the spill directory which isn't taken, named '{pid}-{number}{extension}',
+        so files of this process are told apart by the pid (the spill lock must be held)
+        """
+        while True:
+            path = os.path.join(self.__spill_directory, f'{os.getpid()}-{next(self.__file_numbers)}{extension}')
+            if not os.path.exists(path):
+                return path
+
+    @staticmethod
+    def __is_process_alive(pid: int) -> bool:
+        """Checks if a process with the pid exists"""
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            # It exists, but belongs to someone else
+            return True
+        return True
+
+    def __replay_file(self, replaying_path: str) -> bool:
+        """
+        Sends the records of a spill file in batches, reading it line by line, so memory stays bounded.
+        Lines which can't be parsed are skipped. If the sink fails, the rest of the file is spilled again
+        :return: False if the sink failed
+        """
+        skipped = 0
+        with open(replaying_path, 'r', encoding='utf-8') as file:
+            batch = []
+            for line in file:
+                record = self.__parse_spilled_line(line)
+                if record is None:
+                    skipped += bool(line.strip())
+                    continue
+                batch.append(record)
+                if len(batch) < self.__max_batch_size:
+                    continue
+                if not self.__send(batch):
+                    self.__spill(batch)
+                    self.__spill_lines(file)
+                    return False
+                batch = []
+            if batch and not self.__send(batch):
+                self.__spill(batch)
+                return False
+        if skipped:
+            print(f'Skipped {skipped} corrupt spilled log records')
+        return True
+
+    @staticmethod
+    def __parse_spilled_line(line: str) -> Optional[Tuple[Dict, str]]:
+        """Returns the (struct, severity) record of a spill file's line, or None if it's corrupt"""
+        try:
+            struct, severity = json.loads(line)
+        except (ValueError, TypeError):
+            return None
+        return struct, severity
+
+    def __spill_lines(self, lines: Iterable[str]) -> None:
+        """Appends already serialized records to this process's spill file, one line at a time"""
+        with self.__spill_lock:
+            os.makedirs(self.__spill_directory, exist_ok=True)
+            with open(self.__spill_path, 'a', encoding='utf-8') as file:
+                for line in lines:
+                    file.write(line if line.endswith('\n') else f'{line}\n')
+            self.__replay_needed = True
@@ -11,15 +11,21 @@
 # logger.warning('current_module_name', 'warning')
 # logger.error('current_module_name', 'error')
 # logger.exception('current_module_name', 'exception')
+#
+# messages are written by a background thread; to format a costly message only if it's logged:
+# logger.debug('current_module_name', lambda: f'state: {expensive_dump()}')
 
+import atexit
 import datetime
+import queue
+import threading
 import traceback
-from multiprocessing import Lock
 
 import google.cloud.logging
 import requests
 
 from utils.constants import *
+from utils.log_shipper import GoogleCloudLoggingSink, LocalFileSink, LogShipper
 
 known_loggers = ['engine', 'own_adapter', 'test', 'agents_utils', 'utils', 'jokes']
 levels = {DEBUG_LEVEL: 0, INFO_LEVEL: 1, WARNING_LEVEL: 2, EXCEPTION_LEVEL: 3, ERROR_LEVEL: 4}
@@ -28,7 +34,8 @@ levels = {DEBUG_LEVEL: 0, INFO_LEVEL: 1, WARNING_LEVEL: 2, EXCEPTION_LEVEL: 3, E
 current_level = DEBUG_LEVEL
 console_level = DEBUG_LEVEL
 
-mutex = Lock()
+# the stack is only captured for these levels
+stack_trace_levels = {EXCEPTION_LEVEL, ERROR_LEVEL}
 
 google_cloud_project_name = None
 try:
@@ -42,86 +49,240 @@ google_logger = google_logging_client.logger(GOOGLE_LOGGER_NAME)
 
 agents_environment = os.environ.get('AGENTS_ENVIRONMENT', None)
 
+# In production, records are shipped in batches to google logs ('google'), or to a local file standing in for them
+# ('local'); the ones that could not be sent are kept in LOG_SPILL_DIRECTORY and sent later
+LOG_SINK = os.environ.get('LOG_SINK', 'google')
+LOG_SPILL_DIRECTORY = os.path.join(os.environ.get('OWN_AGENTS_PATH', ''), 'logs', 'spill')
+LOCAL_SINK_FILE = os.path.join(os.environ.get('OWN_AGENTS_PATH', ''), 'logs', 'google_logs_stand_in.jsonl')
+
+# Callers only put records to the queue, a background writer formats and writes them
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_FLUSH_TIMEOUT = 5  # in seconds, how long to wait for the queued records on exit
+
+__records = queue.Queue(LOG_QUEUE_SIZE)
+__writer = None
+__writer_pid = None
+__shipper = None
+__writer_lock = threading.Lock()
+__dropped_records = 0
+
 
-# returns True if writing to a file was successful, and False - in other cases
+# returns True if the message was queued for logging, and False - in other cases
 def __log_message(logger_name, message, level, response=None):
     """
-    Logs a messages. Prints it to console, file or sends to google logs
+    Queues a message to be printed to console, written to a file or sent to google logs
     :param logger_name: a name of the one who wants to log
-    :param message: a message to log
+    :param message: a message to log, or a function returning it, called only if the message is logged
     :param level: a level of the message, possible levels are in levels variable
     :param response: a response of a request for which the was an error
-    :return: True if message was logged, False otherwise
+    :return: True if message was queued, False otherwise
     """
-    result = False
-    stack_trace = ''.join(traceback.format_stack())
-    headers = None
+    global __dropped_records
+    if logger_name not in known_loggers:
+        return False
+    to_file = levels[level] >= levels[current_level]
+    to_console = levels[level] >= levels[console_level]
+    if not to_file and not to_console:
+        return False
+
+    stack_trace = ''.join(traceback.format_stack()) if level in stack_trace_levels else None
+    # the response is read now, later it may be consumed or closed by the caller
+    headers, response_body = None, None
+    if to_file and agents_environment == PRODUCTION_ENVIRONMENT:
+        headers, response_body = __read_response(response)
+    record = (logger_name, message, level, datetime.datetime.utcnow(), stack_trace, headers, response_body,
+              to_file, to_console)
+
+    __ensure_writer()
+    try:
+        __records.put_nowait(record)
+    except queue.Full:
+        with __writer_lock:
+            __dropped_records += 1
+        return False
+    return True
+
+
+def flush(timeout=LOG_FLUSH_TIMEOUT):
+    """
+    Waits until the queued messages are written
+    :param timeout: seconds to wait
+    :return: Nothing
+    """
+    if __writer_pid != os.getpid():
+        # Nothing was logged by this process, there is no writer to wait for
+        return
+    done = threading.Event()
+    try:
+        __records.put(done, timeout=timeout)
+    except queue.Full:
+        return
+    done.wait(timeout)
+    if __shipper:
+        __shipper.flush(timeout)
+
+
+def __reset_after_fork():
+    """
+    Replaces the queue and the lock in a forked child: they may have been held by a thread of the parent
+    during the fork, and the queued records are the parent's to write
+    """
+    global __records, __writer, __writer_pid, __shipper, __writer_lock, __dropped_records
+    __records = queue.Queue(LOG_QUEUE_SIZE)
+    __writer_lock = threading.Lock()
+    __writer = None
+    __writer_pid = None
+    __shipper = None
+    __dropped_records = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=__reset_after_fork)
+
+
+def __ensure_writer():
+    """Starts the writer thread of this process (threads don't survive a fork)"""
+    global __writer, __writer_pid, __shipper
+    if __writer_pid == os.getpid():
+        return
+    with __writer_lock:
+        if __writer_pid != os.getpid():
+            if agents_environment == PRODUCTION_ENVIRONMENT:
+                sink = LocalFileSink(LOCAL_SINK_FILE) if LOG_SINK == 'local' else GoogleCloudLoggingSink(google_logger)
+                __shipper = LogShipper(sink, LOG_SPILL_DIRECTORY)
+            __writer = threading.Thread(target=__write_records, name='logger_writer', daemon=True)
+            __writer.start()
+            __writer_pid = os.getpid()
+
+
+def __write_records():
+    """Writes the queued records, keeping a file open per logger and day"""
+    global __dropped_records
+    log_files = {}  # logger name -> (day, file)
+    while True:
+        record = __records.get()
+        batch = [record]
+        # take the whole backlog, so the files are flushed once per batch
+        while True:
+            try:
+                batch.append(__records.get_nowait())
+            except queue.Empty:
+                break
+
+        with __writer_lock:
+            dropped_records, __dropped_records = __dropped_records, 0
+        if dropped_records:
+            try_print_to_console(f'{dropped_records} log messages were dropped, the queue was full')
+
+        flush_events = []
+        for record in batch:
+            if isinstance(record, threading.Event):
+                flush_events.append(record)
+                continue
+            try:
+                __write_record(record, log_files)
+            except Exception as e:
+                try_print_to_console(f'Could not write a log message. Error message: {e}')
+
+        for _, log_file in log_files.values():
+            try:
+                log_file.flush()
+            except Exception as e:
+                try_print_to_console(f'Could not flush a log file. Error message: {e}')
+        for flush_event in flush_events:
+            flush_event.set()
+
+
+def __write_record(record, log_files):
+    """Formats a record and writes it to console, a file or google logs"""
+    logger_name, message, level, now, stack_trace, headers, response_body, to_file, to_console = record
+    if callable(message):
+        message = message()
+
+    formatted_time = now.strftime('%Y.%m.%d %H:%M:%S')
+    log_message = f'[{logger_name}] {message}'
+    log_message_to_log_files_and_console = f'{formatted_time} [{level}] {log_message}'
+
+    # write to a file
+    if to_file:
+        try:
+            # If 'AGENTS_ENVIRONMENT' env var is 'production' (i.e. agents platform in production mode)
+            if agents_environment == PRODUCTION_ENVIRONMENT:
+                __shipper.ship({
+                    'message': log_message,
+                    'agent': logger_name,
+                    'stack_trace': stack_trace or '',
+                    'timestamp_from_agent': formatted_time,  # as time between request arriving to google logs
+                    # and time of exception on the server may differ
+                    'headers': headers,
+                    'response_body': response_body
+                }, severity=google_logger_enums.get(level, WARNING_LEVEL))
+            else:
+                log_file = __get_log_file(logger_name, now.strftime('%Y.%m.%d'), log_files)
+                print(log_message_to_log_files_and_console, file=log_file)
+        except OSError as e:
+            try_print_to_console(f'Directory for logs was not created. Error message: {e}')
+        except KeyError as e:
+            try_print_to_console(f'The OWN_AGENTS_PATH environment variable is not defined. Error message: {e}')
+        except Exception as e:
+            try_print_to_console(f'File handler for logs was not created. Exception message: {e}')
+
+    # write to console
+    if to_console:
+        try:
+            print(log_message_to_log_files_and_console)
+        except Exception as e:
+            try_print_to_console(f'Console handler for logs was not created. Error message: {e}')
+
+
+def __get_log_file(logger_name, formatted_day, log_files):
+    """Returns the logger's file of the day, closing the one of the previous day"""
+    day, log_file = log_files.get(logger_name, (None, None))
+    if day == formatted_day:
+        return log_file
+    if log_file:
+        log_file.close()
+
+    agents_home_directory = os.environ['OWN_AGENTS_PATH']
+    logs_directory = os.path.join(agents_home_directory, 'logs', logger_name)
+    os.makedirs(logs_directory, exist_ok=True)
+    log_file = open(os.path.join(logs_directory, f'{formatted_day}.log'), 'a', encoding='utf-8')
+    log_files[logger_name] = (formatted_day, log_file)
+    return log_file
 
+
+def __to_serializable(headers):
+    """Returns response headers as a plain dict, so they can be spilled to disk"""
+    return dict(headers) if hasattr(headers, 'items') else headers
+
+
+def __read_response(response):
+    """
+    Returns headers and body of a response for google logs.
+    The body of a streamed response which was consumed or closed already is skipped
+    """
+    headers = None
     response_body = None
     if response:
         try:
             headers = response.headers
+            headers = __to_serializable(headers.get('x-uberblik-error', headers)) if headers else None
 
             if isinstance(response, requests.Response):
-                response_body = response.json()
+                try:
+                    response.content
+                except (RuntimeError, requests.RequestException):
+                    pass
+                else:
+                    response_body = response.json()
             else:
                 response_body = response.read().decode()
         except Exception as e:
             try_print_to_console(f'Unknown type of response. Error message: {e}')
+    return headers, response_body
 
-    if logger_name not in known_loggers:
-        return result
-
-    if levels[level] >= levels[current_level] or levels[level] >= levels[console_level]:
-        now = datetime.datetime.utcnow()
-        formatted_time = now.strftime('%Y.%m.%d %H:%M:%S')
-        formatted_day = now.strftime('%Y.%m.%d')
-        log_message = f'[{logger_name}] {message}'
-        log_message_to_log_files_and_console = f'{formatted_time} [{level}] {log_message}'
-
-        # write to a file
-        if levels[level] >= levels[current_level]:
-            mutex.acquire(timeout=5)
-            try:
-                agents_home_directory = os.environ['OWN_AGENTS_PATH']
-                logs_directory = os.path.join(agents_home_directory, 'logs', logger_name)
-                if not os.path.exists(logs_directory):
-                    os.makedirs(logs_directory)
-            finally:
-                mutex.release()
-            try:
-                log_file_name = os.path.join(logs_directory, f'{formatted_day}.log')
-
-                # If 'AGENTS_ENVIRONMENT' env var is 'production' (i.e. agents platform in production mode)
-                if agents_environment == PRODUCTION_ENVIRONMENT:
-                    google_logger.log_struct({
-                        'message': log_message,
-                        'agent': logger_name,
-                        'stack_trace': stack_trace,
-                        'timestamp_from_agent': formatted_time,  # as time between request arriving to google logs
-                        # and time of exception on the server may differ
-                        'headers': headers.get('x-uberblik-error', headers) if headers else None,
-                        'response_body': response_body
-                    }, severity=google_logger_enums.get(level, WARNING_LEVEL))
-                else:
-                    with open(log_file_name, 'a', encoding='utf-8') as log_file:
-                        print(log_message_to_log_files_and_console, file=log_file)
-                result = True
-            except OSError as e:
-                try_print_to_console(f'Directory for logs was not created. Error message: {e}')
-            except KeyError as e:
-                try_print_to_console(f'The OWN_AGENTS_PATH environment variable is not defined. Error message: {e}')
-            except Exception as e:
-                try_print_to_console(f'File handler for logs was not created. Exception message: {e}')
-
-        # write to console
-        if levels[level] >= levels[console_level]:
-            try:
-                print(log_message_to_log_files_and_console)
-            except Exception as e:
-                try_print_to_console(f'Console handler for logs was not created. Error message: {e}')
 
-    return result
+atexit.register(flush)
 
 
 # wrappers for different levels